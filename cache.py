@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import uuid
+import time
+import hashlib
+import tarfile
+import threading
+
+from collections import OrderedDict
+
+from docker.errors import APIError, NotFound, ImageNotFound, DockerException
+from requests.exceptions import RequestException
+from logzero import logger
+
+from config import COMPILE_CACHE_DIR, COMPILE_CACHE_SIZE, WORKING_DIR
+from exceptions import CrazyBoxError, DockerError
+from clients import docker_clients
+from metrics import metrics
+
+# image the artifacts are compiled in, its id is part of the cache key
+IMAGE = 'crazybox:latest'
+# the image id is looked up again after this long, a rebuilt image (e.g. a new compiler) gets new entries, s
+IMAGE_CHECK_INTERVAL = 60
+
+# 缓存中的编译产物文件名里，提交的文件名被替换为这个占位符
+PLACEHOLDER = '__crazybox_artifact__'
+
+
+def rename_members(data: bytes, old, new):
+    """:return: tar data with old replaced by new in every member name"""
+    out = io.BytesIO()
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r') as source, tarfile.open(fileobj=out, mode='w') as target:
+        for member in source.getmembers():
+            fileobj = source.extractfile(member) if member.isfile() else None
+            member.name = member.name.replace(old, new)
+            target.addfile(member, fileobj)
+    return out.getvalue()
+
+
+class ArtifactCache(object):
+    """
+    Content addressed cache of compiled outputs on disk.
+
+    The key is the hash of the image id, the language's compile command and the source code, an entry is a tar
+    of the artifacts relative to WORKING_DIR. Entries are evicted least recently used first once
+    the cache is larger than max_size bytes.
+    """
+
+    def __init__(self, directory=COMPILE_CACHE_DIR, max_size=COMPILE_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()  # key -> size, least recently used first
+        self.image = None  # (image id, time of the lookup)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        files = []
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.tar') and os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+
+    def image_id(self):
+        """:return: id of IMAGE, looked up again every IMAGE_CHECK_INTERVAL"""
+        with self.lock:
+            if self.image is not None and time.time() - self.image[1] < IMAGE_CHECK_INTERVAL:
+                return self.image[0]
+        try:
+            image_id = docker_clients.api.inspect_image(IMAGE)['Id']
+        except ImageNotFound:
+            raise CrazyBoxError("No image found: [%s]" % IMAGE)
+        except (RequestException, DockerException) as ex:
+            raise DockerError(str(ex))
+        with self.lock:
+            self.image = (image_id, time.time())
+        return image_id
+
+    def key(self, language, src_code):
+        # 镜像重新构建(编译器升级)后不再使用旧的编译产物
+        digest = hashlib.sha256(self.image_id().encode())
+        digest.update(b'\0')
+        digest.update(language['compile_command'].encode())
+        digest.update(b'\0')
+        # 和compress_code写入的源代码使用同样的编码
+        digest.update(src_code if isinstance(src_code, bytes) else src_code.encode('utf-8', 'surrogateescape'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.tar')
+
+    def size(self):
+        return sum(self.entries.values())
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'size': self.size()}
+
+    def load(self, key, name):
+        """
+        :param name: file name of the current submission
+        :return: tar data of the artifacts renamed for the submission, None on a miss
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path, None)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+                self.entries.pop(key, None)
+            metrics.count('crazybox_cache_requests_total', cache='compile', result='miss')
+            return None
+        metrics.count('crazybox_cache_requests_total', cache='compile', result='hit')
+        with self.lock:
+            self.hits += 1
+            self.entries[key] = len(data)
+            self.entries.move_to_end(key)
+        return rename_members(data, PLACEHOLDER, name)
+
+    def store(self, key, name, container, artifacts):
+        """
+        Copy the artifacts of a successful compile out of the container into the cache.
+
+        :param container: anything with get_archive, a container or utils.Sandbox
+        :param artifacts: absolute paths of the artifacts inside the container
+        """
+        out = io.BytesIO()
+        with tarfile.open(fileobj=out, mode='w') as target:
+            for path in artifacts:
+                directory = os.path.relpath(os.path.dirname(path.rstrip('/')), WORKING_DIR)
+                try:
+                    stream, _ = container.get_archive(path)
+                except NotFound:
+                    logger.warning('compile artifact not found: %s', path)
+                    return
+                except APIError:
+                    logger.exception('Failed to fetch compile artifact: %s', path)
+                    return
+                with tarfile.open(fileobj=stream, mode='r|') as source:
+                    for member in source:
+                        fileobj = source.extractfile(member) if member.isfile() else None
+                        member.name = os.path.normpath(os.path.join(directory, member.name)).replace(name, PLACEHOLDER)
+                        target.addfile(member, fileobj)
+        data = out.getvalue()
+
+        temp_path = self.path(key) + '.' + str(uuid.uuid4())
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.rename(temp_path, self.path(key))
+
+        with self.lock:
+            self.entries[key] = len(data)
+            self.entries.move_to_end(key)
+            evicted = []
+            while self.size() > self.max_size and len(self.entries) > 1:
+                evicted.append(self.entries.popitem(last=False)[0])
+        for old in evicted:
+            logger.info('evict compile cache entry: %s', old)
+            try:
+                os.remove(self.path(old))
+            except OSError:
+                pass
+
+
+compile_cache = ArtifactCache()
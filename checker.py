@@ -1,17 +1,32 @@
 # -*- coding: utf-8 -*-
+import io
 import os
+import uuid
+import atexit
+import tarfile
+import hashlib
+import threading
 import subprocess
 
-from exceptions import CrazyBoxError
+from comparator import compare
+from config import CHECKER_ENGINE, TESTLIB_CACHE_DIR, TESTLIB_COMPILE_TIMEOUT, CUSTOM_CHECKER_LIMITS
+from config import WORKING_DIR, TEST_DATA_DIR
+from exceptions import CrazyBoxError, DockerError
+from utils import Sandbox
+from metrics import metrics
+from result import AC, WA, PE, JF
 from logzero import logger
+from docker.errors import DockerException
+from requests.exceptions import RequestException
 
 # 说明
 #  ========== 以下均使用来自codeforces的testlib: http://codeforces.com/testlib ============
 # 'file': 一行一行比较两个文件，不忽略行中多余空白符
 # 'line': 一行一行比较两个文件，忽略行中多余空白符
 
-#  !!! temporary remove 'custom':
-#  !!! 同时需要custom_checker参数传入checker的c++代码，参考 https://github.com/MikeMirzayanov/testlib
+# 'custom': 题目自己的testlib checker(special judge)，源代码随测试数据同步，
+#           按problem.json的checker指定，默认为checker.cpp，参考 https://github.com/MikeMirzayanov/testlib
+#           编译一次后按源代码缓存，每个测试点在评测进程自己的checker沙箱中以CUSTOM_CHECKER_LIMITS的限制运行
 
 # 以下参数都有扩展参数，'nxx', 例如'nyesno'代表判断若干个”yes“或”no“, 'ndouble6' 以eps=1e-6判断若干对浮点数
 
@@ -25,7 +40,7 @@ from logzero import logger
 # 'double6': 以eps=1e-6比较两个浮点数
 
 
-method_choice = ['file', 'line',  # 'custom'
+method_choice = ['file', 'line', 'custom',
                  'yesno', 'int', 'long', 'huge', 'double4', 'double6',
                  'nyesno', 'nint', 'nlong', 'nhuge', 'ndouble4', 'ndouble6']
 
@@ -41,6 +56,20 @@ method_choice = ['file', 'line',  # 'custom'
 #     _unexpected_eof = 8,
 #     _partially = 16
 # };
+TESTLIB_STATUS = {0: AC, 1: WA, 2: PE}
+
+# source of the custom checker in the test data when problem.json doesn't name one
+CUSTOM_CHECKER = 'checker.cpp'
+
+TESTLIB_INCLUDE_DIR = os.path.join(os.getcwd(), 'checkers', 'source')
+# 静态链接，宿主机上编译的程序可以直接在沙箱中运行
+TESTLIB_COMPILE = ['g++', '-O2', '-w', '-fmax-errors=3', '-std=gnu++11', '-static']
+
+
+def testlib_status(code):
+    """:return: judge status of the exit code of a testlib checker or interactor, JF for _fail and the rest"""
+    return TESTLIB_STATUS.get(code, JF)
+
 
 def compress(string: str):
     if len(string) <= 64:
@@ -49,24 +78,215 @@ def compress(string: str):
 
 
 def get_data(path):
+    # 只读取文件首尾，文件再大内存占用也不变
     try:
-        ret = compress(open(path).read())
-        return ret
+        with open(path, 'rb') as file:
+            data = file.read(64)
+            if len(data) == 64 and file.read(1):
+                file.seek(-30, os.SEEK_END)
+                data = data[:30] + b'...' + file.read(30)
+        return data.decode(errors='replace')
     except Exception as exc:
         logger.warning('get data failed: %s\n %s', path, exc)
         return ''
 
 
-def check(input_file_path, output_file_path, answer_file_path, method='file'):
+def run_checker(input_file_path, output_file_path, answer_file_path, method):
+    """run the testlib binary of the method, :return: (exit code, message)"""
+    checker = os.path.join(os.getcwd(), 'checkers', method)
+    cmd = ' '.join([checker, input_file_path, output_file_path, answer_file_path])
+    return subprocess.getstatusoutput(cmd)
+
+
+class CheckerSandbox(object):
+    """
+    Run the custom checkers of the problems in a sandbox of the judge process, like a submission:
+    no network, a read-only root, the test data read-only on /data/ and CUSTOM_CHECKER_LIMITS applied
+    by ``Sandbox.execute``. A checker binary is copied in once, the output of a test case for its run,
+    and test data outside TEST_DATA_DIR as well.
+    """
+
+    def __init__(self, limits=CUSTOM_CHECKER_LIMITS):
+        self.limits = limits
+        self.lock = threading.Lock()
+        self.pid = None
+        self.box = None
+        self.installed = set()  # names of the checker binaries in the sandbox
+
+    def sandbox(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                # 父进程的沙箱属于父进程
+                self.pid, self.box, self.installed = os.getpid(), None, set()
+            if self.box is None:
+                self.box = Sandbox('checker', TEST_DATA_DIR)
+                atexit.register(self.box.destroy)
+                logger.info("Checker sandbox is started: %s", self.box.name)
+            return self.box
+
+    def reset(self):
+        with self.lock:
+            box, self.box, self.installed = self.box, None, set()
+        if box is not None:
+            box.destroy()
+
+    def run(self, checker, input_file_path, output_file_path, answer_file_path):
+        """
+        :param checker: path of the compiled custom checker on the host, see TestlibCache
+        :return: (exit code, message), exit code -1 if it was killed
+        """
+        box = self.sandbox()
+        name = str(uuid.uuid4())
+        binary = '.checker-' + os.path.basename(checker)
+        files = dict()  # name in the working directory -> host path
+        with self.lock:
+            if binary not in self.installed:
+                files[binary] = checker
+        paths = []
+        for suffix, path in (('.in', input_file_path), ('.out', output_file_path), ('.ans', answer_file_path)):
+            data_path = Sandbox.data_path(path) if suffix != '.out' else None
+            if data_path is None:
+                files[name + suffix] = path
+                data_path = WORKING_DIR + name + suffix
+            paths.append(data_path)
+
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as target:
+            for arcname, path in files.items():
+                target.add(path, arcname=arcname, recursive=False)
+        try:
+            try:
+                box.put_archive(WORKING_DIR, archive.getvalue())
+                with self.lock:
+                    self.installed.add(binary)
+                ret = box.execute(' '.join([WORKING_DIR + binary] + paths), self.limits['cpu_time'],
+                                  self.limits['memory'], self.limits['file_size'])
+            finally:
+                box.container.exec_run(['/bin/sh', '-c', 'rm -f {}{}.*'.format(WORKING_DIR, name)])
+        except (DockerError, RequestException, DockerException) as ex:
+            self.reset()
+            raise DockerError('custom checker sandbox failed: %s' % ex)
+
+        # testlib的结果写在stderr
+        message = (ret['stdout'] + ret['stderr']).decode(errors='replace').strip()
+        if ret['timeout']:
+            return -1, 'custom checker timed out'
+        if ret['oom_killed']:
+            return -1, 'custom checker exceeded its memory limit'
+        if ret['exit_code'] > 128:
+            return -1, 'custom checker killed by signal %s: %s' % (ret['exit_code'] - 128, message)
+        return ret['exit_code'], message
+
+
+checker_sandbox = CheckerSandbox()
+
+
+def verdict(input_file_path, output_file_path, answer_file_path, method, checker=None):
+    if method == 'custom':
+        if not checker:
+            raise CrazyBoxError('custom check method without a checker')
+        return checker_sandbox.run(checker, input_file_path, output_file_path, answer_file_path)
+    # 内置方法在进程内比较，出现意外错误时退回到testlib
+    if CHECKER_ENGINE:
+        try:
+            return compare(output_file_path, answer_file_path, method)
+        except Exception as e:
+            logger.exception('checker engine failed on %s, fall back to testlib: %s', output_file_path, e)
+    return run_checker(input_file_path, output_file_path, answer_file_path, method)
+
+
+@metrics.timed('checker')
+def check(input_file_path, output_file_path, answer_file_path, method='file', checker=None):
+    """:param checker: path of the compiled custom checker for the 'custom' method, see TestlibCache"""
     method = str(method).lower()
     if method not in method_choice:
         raise CrazyBoxError('check method value error')
-    checker = os.path.join(os.getcwd(), 'checkers', method)
-    cmd = ' '.join([checker, input_file_path, output_file_path, answer_file_path])
-    status, result = subprocess.getstatusoutput(cmd)
+    status, result = verdict(input_file_path, output_file_path, answer_file_path, method, checker)
     return status, result, get_data(input_file_path), get_data(output_file_path), get_data(answer_file_path)
 
 
+def check_many(cases, method='file', checker=None):
+    """
+    bulk mode of check, all the cases are checked in the current process with one method.
+
+    :param cases: iterable of (input file path, output file path, answer file path)
+    :return: list of the results of check in the order of cases
+    """
+    return [check(input_file_path, output_file_path, answer_file_path, method, checker)
+            for input_file_path, output_file_path, answer_file_path in cases]
+
+
+class TestlibCache(object):
+    """
+    testlib programs of the problems (interactors, custom checkers) compiled on the host, cached by
+    their source.
+
+    The key is the hash of the compile command, the source and the testlib.h it is compiled
+    against, the one next to the source if the problem has its own, otherwise the one in
+    checkers/source. A program is compiled once however many submissions wait for it.
+    """
+
+    def __init__(self, directory=TESTLIB_CACHE_DIR, timeout=TESTLIB_COMPILE_TIMEOUT):
+        self.directory = directory
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.locks = dict()  # key -> lock held while compiling
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def include_dirs(source_path):
+        return [os.path.dirname(source_path), TESTLIB_INCLUDE_DIR]
+
+    def key(self, source_path):
+        digest = hashlib.sha256(' '.join(TESTLIB_COMPILE).encode())
+        for path in [source_path] + [os.path.join(directory, 'testlib.h')
+                                     for directory in self.include_dirs(source_path)]:
+            digest.update(b'\0')
+            if os.path.isfile(path):
+                with open(path, 'rb') as file:
+                    digest.update(file.read())
+                if path != source_path:
+                    break
+        return digest.hexdigest()
+
+    def build(self, source_path):
+        """:return: path of the binary compiled from the source, raise CrazyBoxError if it doesn't compile"""
+        if not os.path.isfile(source_path):
+            raise CrazyBoxError('%s not found.' % source_path)
+        key = self.key(source_path)
+        path = os.path.join(self.directory, key)
+        if os.path.isfile(path):
+            metrics.count('crazybox_cache_requests_total', cache='testlib', result='hit')
+            return path
+        with self.lock:
+            lock = self.locks.setdefault(key, threading.Lock())
+        with lock:
+            if os.path.isfile(path):
+                metrics.count('crazybox_cache_requests_total', cache='testlib', result='hit')
+                return path
+            metrics.count('crazybox_cache_requests_total', cache='testlib', result='miss')
+            temp_path = path + '.' + str(uuid.uuid4())
+            command = TESTLIB_COMPILE + [source_path, '-o', temp_path, '-lm']
+            for directory in self.include_dirs(source_path):
+                command += ['-I', directory]
+            try:
+                with metrics.timer('testlib_compile'):
+                    process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                             timeout=self.timeout)
+            except (OSError, subprocess.TimeoutExpired) as e:
+                raise CrazyBoxError('failed to compile %s: %s' % (source_path, e))
+            if process.returncode != 0:
+                raise CrazyBoxError('failed to compile %s:\n%s'
+                                    % (source_path, process.stdout.decode(errors='replace')))
+            os.rename(temp_path, path)
+            logger.info('compiled %s: %s', source_path, key)
+            return path
+
+
+testlib_cache = TestlibCache()
+
+
 def compile_all():
     source_dir = os.path.join(os.getcwd(), 'checkers', 'source')
     compile_cmd = 'g++ {} -D AC -o {} -Wall -fmax-errors=3 -std=gnu++0x -static -lm'
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+
+import docker
+import requests.adapters
+
+from logzero import logger
+from docker.transport.unixconn import UnixAdapter, UnixHTTPConnectionPool
+
+from config import DOCKER_POOL_SIZE
+from exceptions import CrazyBoxError
+
+
+class PooledUnixAdapter(UnixAdapter):
+    """UnixAdapter keeping up to maxsize connections to the docker socket, docker-py fixes it at 10"""
+
+    def __init__(self, socket_url, timeout, maxsize):
+        self.maxsize = maxsize
+        super(PooledUnixAdapter, self).__init__(socket_url, timeout)
+
+    def get_connection(self, url, proxies=None):
+        with self.pools.lock:
+            pool = self.pools.get(url)
+            if pool:
+                return pool
+            pool = UnixHTTPConnectionPool(url, self.socket_path, self.timeout, maxsize=self.maxsize)
+            self.pools[url] = pool
+        return pool
+
+
+class DockerClients(object):
+    """
+    Docker clients of the current process, shared by its threads.
+
+    The clients are created on first use in every process, so a judge worker forked from the
+    server never reuses the connections of its parent, and their connection pool keeps
+    pool_size connections instead of docker-py's 10. ``client`` is the high level
+    docker.DockerClient, ``api`` the low level docker.APIClient behind it.
+    """
+
+    def __init__(self, pool_size=DOCKER_POOL_SIZE):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.pid = None
+        self._client = None
+
+    @property
+    def client(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self._client = self.create()
+                    self.pid = os.getpid()
+        return self._client
+
+    @property
+    def api(self):
+        return self.client.api
+
+    def create(self, pool_size=None):
+        """:return: a new docker.DockerClient from the environment with a connection pool of pool_size"""
+        pool_size = pool_size or self.pool_size
+        try:
+            client = docker.from_env()
+        except Exception as e:
+            logger.exception(e)
+            raise CrazyBoxError(e)
+        api = client.api
+        adapter = getattr(api, '_custom_adapter', None)
+        if isinstance(adapter, UnixAdapter):
+            adapter = PooledUnixAdapter('http+unix://' + adapter.socket_path, adapter.timeout, pool_size)
+            api.mount('http+docker://', adapter)
+            api._custom_adapter = adapter
+        elif api.base_url.startswith('http://'):
+            api.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+        else:
+            logger.warning('docker connection pool size is not configurable for %s', api.base_url)
+        return client
+
+    def new_api(self):
+        """:return: a new low level client with its own connection, for long-lived streams"""
+        return self.create(pool_size=1).api
+
+
+docker_clients = DockerClients()
@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import tempfile
+import threading
+import requests
+
+from collections import OrderedDict
+from zipfile import ZipFile
+
+from logzero import logger
+
+from config import CLUSTER_NODES, CLUSTER_PING_INTERVAL, CLUSTER_ATTEMPTS, CLUSTER_JUDGE_TIMEOUT
+from config import SUBMISSION_HISTORY
+from exceptions import CrazyBoxError, DockerError
+from result import Running
+from scheduler import Scheduler, RUNNING
+from testdata import manifests
+from metrics import metrics
+
+
+class Coordinator(Scheduler):
+    """
+    Dispatch judge jobs to the judge nodes of a cluster instead of local worker processes.
+
+    A node is a judge server registered by its base url and token. Every CLUSTER_PING_INTERVAL
+    its /ping/ reports the judge workers alive and the submissions queued or running there.
+    A submission goes to the least loaded node that already has the same hash of its test data.
+    If no node has it, the test data is synced to the least loaded node first, and only the
+    changed files are uploaded. The test data is synced to the coordinator like to a judge node.
+    A node failing a submission is marked down until its next ping answers, and the submission is
+    tried again on another node, on up to CLUSTER_ATTEMPTS nodes.
+
+    A local cluster is a few servers started from their own working directories (their test data),
+    judge nodes on their own ports with distinct CRAZYBOX_NODE_ID, and the coordinator with
+    SERVER_MODE = 'coordinator', see server.py.
+    """
+
+    def __init__(self, nodes=CLUSTER_NODES, history=SUBMISSION_HISTORY, ping_interval=CLUSTER_PING_INTERVAL,
+                 attempts=CLUSTER_ATTEMPTS, judge_timeout=CLUSTER_JUDGE_TIMEOUT):
+        super(Coordinator, self).__init__(worker_count=0, history=history)
+        self.ping_interval = ping_interval
+        self.attempts = attempts
+        self.judge_timeout = judge_timeout
+        self.nodes = OrderedDict()  # base url -> node
+        self.sync_locks = dict()  # (base url, test case id) -> lock
+        for url, token in nodes.items():
+            self.register(url, token, ping=False)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        threading.Thread(target=self.watch, name='crazybox-coordinator', daemon=True).start()
+
+    def register(self, url, token, ping=True):
+        """:return: the node, pinged at once unless ping is False"""
+        url = url.rstrip('/') + '/'
+        with self.lock:
+            node = self.nodes.get(url)
+            if node is None:
+                node = self.nodes[url] = {'url': url, 'token': token, 'alive': False, 'last_seen': None,
+                                          'error': None, 'hostname': None, 'cpu_percent': None,
+                                          'workers': 0, 'busy': 0, 'dispatched': 0, 'hashes': dict()}
+            node['token'] = token
+        if ping:
+            self.ping(node)
+        return node
+
+    def unregister(self, url):
+        with self.lock:
+            return self.nodes.pop(url.rstrip('/') + '/', None) is not None
+
+    def watch(self):
+        while True:
+            with self.lock:
+                nodes = list(self.nodes.values())
+            for node in nodes:
+                self.ping(node)
+            time.sleep(self.ping_interval)
+
+    @staticmethod
+    def headers(node):
+        return {'Authorization': 'Token %s' % node['token']}
+
+    def ping(self, node):
+        try:
+            response = requests.get(node['url'] + 'ping/', headers=self.headers(node), timeout=self.ping_interval)
+            response.raise_for_status()
+            info = response.json()['data']
+            judge = info['judge']
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            if node['alive']:
+                logger.warning('judge node %s is down: %s', node['url'], e)
+            with self.lock:
+                node.update(alive=False, error=str(e))
+            return
+        if not node['alive']:
+            logger.info('judge node %s is up', node['url'])
+        with self.lock:
+            node.update(alive=True, error=None, last_seen=time.time(), hostname=info.get('hostname'),
+                        cpu_percent=info.get('cpu_percent'),
+                        workers=sum(worker['alive'] for worker in judge['workers']),
+                        busy=judge['queue_depth'] + judge['running'])
+
+    def mark_down(self, node, error):
+        logger.warning('judge node %s failed: %s', node['url'], error)
+        with self.lock:
+            node.update(alive=False, error=str(error))
+
+    @staticmethod
+    def load(node):
+        """submissions per judge worker of the node, counting the ones dispatched since its last ping"""
+        return max(node['busy'], node['dispatched']) / max(node['workers'], 1), node['cpu_percent'] or 0
+
+    def node_hash(self, node, test_case_id):
+        try:
+            response = requests.post(node['url'] + 'hash/', headers=self.headers(node),
+                                     data={'test_case_id': test_case_id}, timeout=self.ping_interval)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            logger.warning('Failed to get the hash of test data %s on %s: %s', test_case_id, node['url'], e)
+            return None
+
+    def select(self, test_case_id, data_hash, tried):
+        """:return: the least loaded node alive not tried yet, preferring the nodes having the test data"""
+        with self.lock:
+            candidates = [node for node in self.nodes.values() if node['alive'] and node['url'] not in tried]
+        if not candidates:
+            raise CrazyBoxError('no judge node available')
+        for node in candidates:
+            # 节点上的测试数据也可能由其他后端同步，哈希不一致时重新查询；查询时不持有锁
+            with self.lock:
+                known = node['hashes'].get(test_case_id)
+            if known != data_hash:
+                node_hash = self.node_hash(node, test_case_id)
+                with self.lock:
+                    node['hashes'][test_case_id] = node_hash
+        with self.lock:
+            having = [node for node in candidates if node['hashes'].get(test_case_id) == data_hash]
+            return min(having or candidates, key=self.load)
+
+    def sync(self, node, test_case_id, data_dir, data_hash):
+        """upload the files of the test data the node is missing, delete the ones it should not have"""
+        with self.lock:
+            lock = self.sync_locks.setdefault((node['url'], test_case_id), threading.Lock())
+        with lock:
+            with self.lock:
+                synced = node['hashes'].get(test_case_id) == data_hash
+            if synced:
+                return
+            files = manifests.scan(data_dir)['files']
+            with metrics.timer('sync'):
+                response = requests.post(node['url'] + 'sync/diff/', headers=self.headers(node),
+                                         data={'test_case_id': test_case_id,
+                                               'manifest': json.dumps({name: entry['sha256']
+                                                                       for name, entry in files.items()})},
+                                         timeout=self.judge_timeout)
+                response.raise_for_status()
+                delta = response.json()['data']
+                with tempfile.TemporaryFile() as archive:
+                    with ZipFile(archive, 'w') as target:
+                        for name in delta['upload']:
+                            target.write(os.path.join(data_dir, name), name)
+                    archive.seek(0)
+                    response = requests.post(node['url'] + 'sync/', headers=self.headers(node),
+                                             data={'test_case_id': test_case_id, 'mode': 'delta',
+                                                   'delete': json.dumps(delta['delete'])},
+                                             files={'zipfile': ('delta.zip', archive)}, timeout=self.judge_timeout)
+                response.raise_for_status()
+            if response.json() != 'Done!':
+                raise CrazyBoxError('sync of test data %s to %s failed: %s'
+                                    % (test_case_id, node['url'], response.json()))
+            logger.info('synced test data %s to %s: %s files uploaded, %s deleted',
+                        test_case_id, node['url'], len(delta['upload']), len(delta['delete']))
+            with self.lock:
+                node['hashes'][test_case_id] = data_hash
+
+    def judge_on(self, node, job, data_dir, data_hash):
+        """:return: the response of the judge api of the node"""
+        self.sync(node, job['test_case_id'], data_dir, data_hash)
+        data = {'sync': 'true'}
+        for key in ('submission_id', 'src_code', 'language', 'test_case_id', 'time_limit', 'memory_limit',
+                    'file_size_limit', 'check_method', 'parallel'):
+            if job.get(key) is not None:
+                data[key] = job[key]
+        with self.lock:
+            node['dispatched'] += 1
+        try:
+            response = requests.post(node['url'] + 'judge/', headers=self.headers(node), data=data,
+                                     timeout=self.judge_timeout)
+            response.raise_for_status()
+            result = response.json()
+            if not isinstance(result, dict) or 'code' not in result:
+                raise ValueError('unexpected response: %s' % result)
+            return result
+        finally:
+            with self.lock:
+                node['dispatched'] -= 1
+
+    def dispatch(self, job):
+        threading.Thread(target=self.run, args=(job,), daemon=True).start()
+
+    def run(self, job):
+        submission_id = job['submission_id']
+        # 评测期间测试数据可能再次同步，整个评测使用同一个版本
+        data_dir = os.path.realpath(job['test_case_dir'])
+        tried = []
+        response = None
+        with metrics.timer('dispatch'):
+            while len(tried) < self.attempts:
+                try:
+                    data_hash = manifests.scan(data_dir)['hash']
+                    node = self.select(job['test_case_id'], data_hash, tried)
+                except (CrazyBoxError, OSError) as e:
+                    logger.exception(e)
+                    response = response or {'code': 1, 'result': {'err': CrazyBoxError.__name__, 'data': str(e)}}
+                    break
+                tried.append(node['url'])
+                self.started_on(submission_id, node['url'])
+                try:
+                    response = self.judge_on(node, job, data_dir, data_hash)
+                except (requests.RequestException, ValueError, KeyError, CrazyBoxError) as e:
+                    self.mark_down(node, e)
+                    response = {'code': 2, 'result': {'err': 'JudgeClientError',
+                                                      'data': 'judge node %s failed: %s' % (node['url'], e)}}
+                    continue
+                # 节点自身的故障换一个节点重试，评测结果和提交的错误直接返回
+                if response['code'] == 2 or response['result'].get('err') == DockerError.__name__:
+                    self.mark_down(node, response['result'])
+                    continue
+                break
+        self.complete(submission_id, response)
+
+    def started_on(self, submission_id, url):
+        with self.lock:
+            submission = self.submissions.get(submission_id)
+            if submission:
+                if submission['started_at'] is None:
+                    submission['started_at'] = time.time()
+                    metrics.observe('queue', submission['started_at'] - submission['queued_at'])
+                submission.update(state=RUNNING, status=Running, worker=url)
+
+    def complete(self, submission_id, response):
+        callback = None
+        with self.lock:
+            submission = self.submissions.get(submission_id)
+            if submission:
+                self.finish(submission, response)
+                callback = submission['callback_url']
+            self.finished.notify_all()
+        if callback:
+            threading.Thread(target=self.post_callback, args=(callback, submission_id, response), daemon=True).start()
+
+    def stats(self):
+        stats = super(Coordinator, self).stats()
+        with self.lock:
+            stats['nodes'] = [{key: node[key] for key in ('url', 'alive', 'last_seen', 'error', 'hostname',
+                                                          'cpu_percent', 'workers', 'busy', 'dispatched')}
+                              for node in self.nodes.values()]
+        return stats
@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+In-process implementation of the testlib checkers in checkers/.
+
+Every built-in check method reads the output and the answer file in chunks of CHUNK_SIZE
+bytes, like testlib's buffered reader, and returns the same exit code and message as the
+binary of the same name, without starting a process per test case.
+"""
+import re
+import math
+import itertools
+
+from contextlib import ExitStack
+
+# 读取文件的块大小
+CHUNK_SIZE = 64 * 1024
+
+# exit codes of testlib
+OK = 0
+WA = 1
+PE = 2
+FAIL = 3
+
+PREFIX = {OK: 'ok ', WA: 'wrong answer ', PE: 'wrong output format ', FAIL: 'FAIL '}
+
+# modes of the streams, only the answer and the output file are read by the checkers
+OUTPUT = 'output'
+ANSWER = 'answer'
+
+BLANKS = re.compile(rb'[ \t\r\n]*')
+TOKEN = re.compile(rb'[^ \t\r\n]*')
+TOKENS = re.compile(rb'[^ \t\r\n]+')
+EOLN = re.compile(rb'[\r\n]')
+DIGITS = re.compile(rb'[0-9]*')
+# integers that can be converted without the checks of stringToLongLong if they fit in int64
+SHORT_INTEGER = re.compile(rb'0|-?[1-9][0-9]{0,18}')
+# everything sscanf("%lf") accepts out of the characters testlib allows in a double,
+# glibc takes a dangling exponent like "1e" or "1e+" as part of the number
+DOUBLE = re.compile(rb'([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))(?:[eE][+-]?([0-9]*))?')
+NUMERIC = re.compile(rb'0|-?[1-9][0-9]*')
+
+CR = ord('\r')
+LF = ord('\n')
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+LLONG_MIN, LLONG_MAX = -2 ** 63, 2 ** 63 - 1
+
+YES = b'YES'
+NO = b'NO'
+
+
+class Quit(Exception):
+    """the verdict of a check, raised wherever testlib would call quit()"""
+
+    def __init__(self, result, msg):
+        super().__init__(result, msg)
+        self.result = result
+        self.msg = msg
+
+
+def part(s: bytes):
+    """__testlib_part: shorten long tokens and lines in messages"""
+    if len(s) <= 64:
+        return s
+    return s[:30] + b'...' + s[-31:]
+
+
+def text(s: bytes):
+    """testlib prints strings with %s, so a message ends at the first NUL byte"""
+    return part(s).split(b'\0', 1)[0].decode(errors='replace')
+
+
+def ending(n):
+    """englishEnding"""
+    n %= 100
+    if n // 10 == 1:
+        return 'th'
+    return {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+
+
+def real(value, digits):
+    """printf("%.*f"), which also prints the sign of a NaN"""
+    if value != value:
+        return '-nan' if math.copysign(1.0, value) < 0 else 'nan'
+    return '%.*f' % (digits, value)
+
+
+def t_abs(value):
+    return value if value > 0 else -value
+
+
+def t_min(a, b):
+    return a if a < b else b
+
+
+def t_max(a, b):
+    return a if a > b else b
+
+
+def is_infinite(value):
+    return value > 1E300 or value < -1E300
+
+
+def double_compare(expected, result, eps):
+    if expected != expected:
+        return result != result
+    if is_infinite(expected):
+        if expected > 0:
+            return result > 0 and is_infinite(result)
+        return result < 0 and is_infinite(result)
+    if result != result or is_infinite(result):
+        return False
+    if t_abs(result - expected) <= eps + 1E-15:
+        return True
+    low = t_min(expected * (1.0 - eps), expected * (1.0 + eps))
+    high = t_max(expected * (1.0 - eps), expected * (1.0 + eps))
+    return result + 1E-15 >= low and result <= high + 1E-15
+
+
+def double_delta(expected, result):
+    absolute = t_abs(result - expected)
+    if t_abs(expected) > 1E-9:
+        return t_min(absolute, t_abs(absolute / expected))
+    return absolute
+
+
+class Stream(object):
+    """
+    Chunked reader with the semantics of testlib's InStream in non strict mode.
+
+    Unlike testlib, a lone '\\r' ends a line instead of making readString return empty lines
+    forever.
+    """
+
+    def __init__(self, path, mode):
+        self.name = path
+        self.mode = mode
+        self.buffer = b''
+        self.pos = 0
+        self.exhausted = False
+        try:
+            self.file = open(path, 'rb')
+        except OSError:
+            self.file = None
+            if mode == OUTPUT:
+                raise Quit(PE, 'Output file not found: "%s"' % path)
+            raise Quit(FAIL, 'Answer file not found: "%s"' % path)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def quit(self, result, msg):
+        # 答案文件读取出错说明数据有问题
+        if self.mode != OUTPUT and result != FAIL:
+            raise Quit(FAIL, '%s (%s)' % (msg, self.name))
+        raise Quit(result, msg)
+
+    def fill(self):
+        """:return: False at the end of the file"""
+        if self.pos < len(self.buffer):
+            return True
+        if self.exhausted:
+            return False
+        chunk = self.file.read(CHUNK_SIZE)
+        self.buffer, self.pos = chunk, 0
+        if not chunk:
+            self.exhausted = True
+            return False
+        return True
+
+    def eof(self):
+        return not self.fill()
+
+    def skip_blanks(self):
+        while self.fill():
+            self.pos = BLANKS.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return
+
+    def seek_eof(self):
+        self.pos = BLANKS.match(self.buffer, self.pos).end()
+        if self.pos < len(self.buffer):
+            return False
+        self.skip_blanks()
+        return self.eof()
+
+    def read_word(self):
+        self.skip_blanks()
+        if self.eof():
+            self.quit(PE, 'Unexpected end of file - token expected')
+        parts = []
+        while self.fill():
+            end = TOKEN.match(self.buffer, self.pos).end()
+            parts.append(self.buffer[self.pos:end])
+            self.pos = end
+            if end < len(self.buffer):
+                break
+        return b''.join(parts)
+
+    def read_string(self):
+        parts = []
+        while self.fill():
+            match = EOLN.search(self.buffer, self.pos)
+            if match is None:
+                parts.append(self.buffer[self.pos:])
+                self.pos = len(self.buffer)
+                continue
+            parts.append(self.buffer[self.pos:match.start()])
+            self.pos = match.start()
+            break
+        if self.fill():
+            self.pos += 1
+            if self.buffer[self.pos - 1] == CR and self.fill() and self.buffer[self.pos] == LF:
+                self.pos += 1
+        return b''.join(parts)
+
+    def words(self):
+        """
+        generator of the remaining tokens, the same as read_word until seek_eof,
+        the position of the stream always follows the last token given out
+        """
+        while not self.seek_eof():
+            buffer = self.buffer
+            for match in TOKENS.finditer(buffer, self.pos):
+                if match.end() == len(buffer):
+                    # 单词可能延续到下一块
+                    self.pos = match.start()
+                    yield self.read_word()
+                    break
+                self.pos = match.end()
+                yield match.group()
+            else:
+                self.pos = len(buffer)
+
+    def read_token(self, kind):
+        if self.seek_eof():
+            self.quit(PE, 'Unexpected end of file - %s expected' % kind)
+        return self.read_word()
+
+    def parse_long(self, token):
+        """stringToLongLong, including its wrap around on overflow"""
+        if b'\0' in token:
+            # testlib parses numbers from c_str(), which ends at the first NUL byte
+            token = token.split(b'\0', 1)[0]
+        if SHORT_INTEGER.fullmatch(token):
+            value = int(token)
+            if LLONG_MIN < value <= LLONG_MAX:
+                return value
+        if token == b'-9223372036854775808':
+            return LLONG_MIN
+        minus = len(token) > 1 and token[:1] == b'-'
+        if len(token) > 20:
+            self.quit(PE, 'Expected integer, but "%s" found' % text(token))
+        digits = token[1:] if minus else token
+        if not DIGITS.fullmatch(digits):
+            self.quit(PE, 'Expected integer, but "%s" found' % text(token))
+        value = int(digits or b'0') % 2 ** 64
+        if value >= 2 ** 63:
+            self.quit(PE, 'Expected integer, but "%s" found' % text(token))
+        zeroes = len(digits) - len(digits.lstrip(b'0'))
+        if (zeroes > 0 and (value != 0 or minus)) or zeroes > 1:
+            self.quit(PE, 'Expected integer, but "%s" found' % text(token))
+        value = -value if minus else value
+        if len(token) < 19 or str(value).encode() == token:
+            return value
+        self.quit(PE, 'Expected int64, but "%s" found' % text(token))
+
+    def parse_int(self, token):
+        value = self.parse_long(token)
+        if value < INT_MIN or value > INT_MAX:
+            self.quit(PE, 'Expected int32, but "%s" found' % text(token))
+        return value
+
+    def parse_double(self, token):
+        if b'\0' in token:
+            token = token.split(b'\0', 1)[0]
+        match = DOUBLE.fullmatch(token)
+        if not match:
+            self.quit(PE, 'Expected double, but "%s" found' % text(token))
+        return float(token if match.group(2) else match.group(1))
+
+    def read_long(self):
+        return self.parse_long(self.read_token('int64'))
+
+    def read_int(self):
+        return self.parse_int(self.read_token('int32'))
+
+    def read_double(self):
+        return self.parse_double(self.read_token('double'))
+
+
+def check_lines(ans, ouf, exact):
+    n = 0
+    last = b''
+    while not ans.eof():
+        j = ans.read_string()
+        if j == b'' and ans.eof():
+            break
+        p = ouf.read_string()
+        last = j if exact else p
+        n += 1
+        if (j != p) if exact else (j.split() != p.split()):
+            raise Quit(WA, "%d%s lines differ - expected: '%s', found: '%s'" % (n, ending(n), text(j), text(p)))
+    if n == 1:
+        raise Quit(OK, "single line: '%s'" % text(last))
+    raise Quit(OK, '%d lines' % n)
+
+
+def check_integer(ans, ouf, read):
+    ja = read(ans)
+    pa = read(ouf)
+    if ja != pa:
+        raise Quit(WA, 'expected %d, found %d' % (ja, pa))
+    raise Quit(OK, 'answer is %d' % ja)
+
+
+def check_integers(ans, ouf, parse):
+    n = 0
+    first = []
+    ans_words, ouf_words = ans.words(), ouf.words()
+    pending = []
+    for ja in ans_words:
+        pa = next(ouf_words, None)
+        if pa is None:
+            pending.append(ja)
+            break
+        n += 1
+        j = parse(ans, ja)
+        p = parse(ouf, pa)
+        if j != p:
+            raise Quit(WA, "%d%s numbers differ - expected: '%d', found: '%d'" % (n, ending(n), j, p))
+        if n <= 5:
+            first.append(str(j).encode())
+    check_extra(ans, ouf, n, itertools.chain(pending, ans_words), ouf_words)
+    if n <= 5:
+        raise Quit(OK, '%d number(s): "%s"' % (n, text(b' '.join(first))))
+    raise Quit(OK, '%d numbers' % n)
+
+
+def check_extra(ans, ouf, n, ans_words, ouf_words):
+    """the n-variants of the integer checkers fail on sequences of different length"""
+    extra_in_ans = 0
+    for token in ans_words:
+        ans.parse_long(token)
+        extra_in_ans += 1
+    extra_in_ouf = 0
+    for token in ouf_words:
+        ouf.parse_long(token)
+        extra_in_ouf += 1
+    if extra_in_ans > 0:
+        raise Quit(WA, 'Answer contains longer sequence [length = %d], but output contains %d elements'
+                   % (n + extra_in_ans, n))
+    if extra_in_ouf > 0:
+        raise Quit(WA, 'Output contains longer sequence [length = %d], but answer contains %d elements'
+                   % (n + extra_in_ouf, n))
+
+
+def check_huge(ans, ouf):
+    ja = ans.read_word()
+    pa = ouf.read_word()
+    if not NUMERIC.fullmatch(ja):
+        raise Quit(FAIL, '%s is not a valid integer' % text(ja))
+    if not ans.seek_eof():
+        raise Quit(FAIL, 'expected exactly one token in the answer file')
+    if not NUMERIC.fullmatch(pa):
+        raise Quit(PE, '%s is not a valid integer' % text(pa))
+    if ja != pa:
+        raise Quit(WA, "expected '%s', found '%s'" % (text(ja), text(pa)))
+    raise Quit(OK, "answer is '%s'" % text(ja))
+
+
+def check_nhuge(ans, ouf):
+    n = 0
+    first = b''
+    ans_words, ouf_words = ans.words(), ouf.words()
+    pending = []
+    for ja in ans_words:
+        pa = next(ouf_words, None)
+        if pa is None:
+            pending.append(ja)
+            break
+        n += 1
+        if not NUMERIC.fullmatch(ja):
+            raise Quit(FAIL, '%s is not a valid integer' % text(ja))
+        if not NUMERIC.fullmatch(pa):
+            raise Quit(PE, '%s is not a valid integer' % text(pa))
+        if ja != pa:
+            raise Quit(WA, "%d%s numbers differ - expected '%s', found '%s'" % (n, ending(n), text(ja), text(pa)))
+        if n <= 1:
+            first += ja
+    check_extra(ans, ouf, n, itertools.chain(pending, ans_words), ouf_words)
+    if n == 1:
+        raise Quit(OK, '%d number: "%s"' % (n, text(first)))
+    raise Quit(OK, '%d numbers' % n)
+
+
+def check_double(ans, ouf, eps, digits):
+    ja = ans.read_double()
+    pa = ouf.read_double()
+    if not double_compare(ja, pa, eps):
+        raise Quit(WA, 'expected %s, found %s' % (real(ja, digits), real(pa, digits)))
+    raise Quit(OK, 'answer is %s' % real(ja, digits))
+
+
+def check_doubles(ans, ouf, eps):
+    n = 0
+    j = p = 0.0
+    ouf_words = ouf.words()
+    for ja in ans.words():
+        n += 1
+        j = ans.parse_double(ja)
+        pa = next(ouf_words, None)
+        if pa is None:
+            ouf.quit(PE, 'Unexpected end of file - double expected')
+        p = ouf.parse_double(pa)
+        if not double_compare(j, p, eps):
+            raise Quit(WA, "%d%s numbers differ - expected: '%s', found: '%s', error = '%s'"
+                       % (n, ending(n), real(j, 7), real(p, 7), real(double_delta(j, p), 7)))
+    if n == 1:
+        raise Quit(OK, "found '%s', expected '%s', error '%s'" % (real(p, 7), real(j, 7), real(double_delta(j, p), 7)))
+    raise Quit(OK, '%d numbers' % n)
+
+
+def read_yes_no(ans, ouf, ja=None, pa=None):
+    ja = (ja or ans.read_word()).upper()
+    pa = (pa or ouf.read_word()).upper()
+    if ja != YES and ja != NO:
+        raise Quit(FAIL, 'YES or NO expected in answer, but %s found' % text(ja))
+    if pa != YES and pa != NO:
+        raise Quit(PE, 'YES or NO expected, but %s found' % text(pa))
+    if ja != pa:
+        raise Quit(WA, 'expected %s, found %s' % (text(ja), text(pa)))
+    return ja
+
+
+def check_yesno(ans, ouf):
+    raise Quit(OK, 'answer is %s' % read_yes_no(ans, ouf).decode())
+
+
+def check_nyesno(ans, ouf):
+    n = 0
+    first = []
+    ouf_words = ouf.words()
+    for ja in ans.words():
+        pa = next(ouf_words, None)
+        if pa is None:
+            break
+        n += 1
+        answer = read_yes_no(ans, ouf, ja, pa)
+        if n <= 5:
+            first.append(answer)
+    if n <= 5:
+        raise Quit(OK, '%d tokens(s): "%s"' % (n, text(b' '.join(first))))
+    raise Quit(OK, '%d tokens' % n)
+
+
+CHECKERS = {
+    'file': lambda ans, ouf: check_lines(ans, ouf, True),
+    'line': lambda ans, ouf: check_lines(ans, ouf, False),
+    'int': lambda ans, ouf: check_integer(ans, ouf, Stream.read_int),
+    'long': lambda ans, ouf: check_integer(ans, ouf, Stream.read_long),
+    'nint': lambda ans, ouf: check_integers(ans, ouf, Stream.parse_int),
+    'nlong': lambda ans, ouf: check_integers(ans, ouf, Stream.parse_long),
+    'huge': check_huge,
+    'nhuge': check_nhuge,
+    'double4': lambda ans, ouf: check_double(ans, ouf, 1E-4, 5),
+    'double6': lambda ans, ouf: check_double(ans, ouf, 1E-6, 7),
+    'ndouble4': lambda ans, ouf: check_doubles(ans, ouf, 1E-4),
+    'ndouble6': lambda ans, ouf: check_doubles(ans, ouf, 1E-6),
+    'yesno': check_yesno,
+    'nyesno': check_nyesno,
+}
+
+
+def compare(output_file_path, answer_file_path, method):
+    """
+    :return: (exit code, message) as the testlib checker of the method would give them
+    """
+    with ExitStack() as stack:
+        try:
+            ouf = Stream(output_file_path, OUTPUT)
+            stack.callback(ouf.close)
+            ans = Stream(answer_file_path, ANSWER)
+            stack.callback(ans.close)
+            CHECKERS[method](ans, ouf)
+        except Quit as e:
+            result, msg = e.result, e.msg
+        if result == OK and not ouf.seek_eof():
+            result, msg = PE, 'Extra information in the output file'
+    return result, PREFIX[result] + msg
+
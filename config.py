@@ -25,6 +25,113 @@ CPU_TO_REAL_TIME_FACTOR = 3
 
 DEFAULT_GENERATE_FILE_SIZE = 256 * 1024 * 1024  # 256M
 
+# bytes of the stdout/stderr of a compile or run kept as diagnostics, the rest is dropped while
+# it is streamed (the last few KB, where the usage lines are, are always kept), Byte
+OUTPUT_CAPTURE_LIMIT = 64 * 1024
+
+# warm sandbox pool (utils.ContainerPool), number of paused containers kept per language family
+# 0 disables the pool for that family: a new container is created for every compile and test case
+# a pooled sandbox only sees the test data of the submission it serves, hard linked into its own
+# directory under TEST_DATA_DIR/.pool for every submission
+CONTAINER_POOL_SIZE = {
+    'native': 4,  # C, C++, Go
+    'jvm': 2,  # Java
+    'script': 2,  # Python, Python3, Ruby
+}
+# a sandbox is destroyed and replaced after serving this many submissions
+CONTAINER_POOL_MAX_USES = 100
+# sandboxes created beyond the pool size under load are evicted after being idle this long, s
+CONTAINER_POOL_MAX_IDLE = 300
+# interval of the health check / eviction / refill loop, s
+CONTAINER_POOL_CHECK_INTERVAL = 30
+
+# run all test cases of a submission through one crazybox-supervisor process (docker/supervisor.c)
+# inside its sandbox instead of one docker exec per case; families without a pool get a
+# one-off sandbox for the submission
+SUPERVISOR_MODE = True
+SUPERVISOR_PATH = '/usr/local/bin/crazybox-supervisor'
+
+# size of the tmpfs backing the working directory of a judge worker or sandbox, e.g. '512m',
+# None for a volume on disk without a quota
+WORKSPACE_SIZE = '512m'
+
+# connections kept to the docker daemon by every process (clients.py), shared by its threads
+DOCKER_POOL_SIZE = 32
+
+# containers run one per compile/test case are supervised by one asyncio loop (monitor.py):
+# threads for its blocking docker calls (start, kill, inspect)
+MONITOR_THREADS = 8
+# a killed container not seen exiting on the docker events stream is checked and killed again after, s
+MONITOR_KILL_GRACE = 2
+
+# number of test cases of one submission run at the same time, 1 runs them one by one.
+# every parallel case is pinned to its own CPU out of JUDGE_CPUS; with no free CPU left
+# a submission falls back to running its cases one by one
+PARALLEL_CASES = 1
+# CPUs reserved for running test cases, e.g. range(2, 16), None for all CPUs
+JUDGE_CPUS = None
+
+# measure the startup time of a language once per judge process: the cpu time of its empty program
+# (LANG[...]['empty_program']) run in the sandbox like a submission, reported as 'startup_time' of the
+# judge results and not subtracted from their times, e.g. to derive fair time multipliers
+STARTUP_BASELINE = False
+# runs of the empty program, the median is the startup time
+STARTUP_BASELINE_RUNS = 3
+
+# number of judge worker processes consuming the submission queue (scheduler.py)
+JUDGE_WORKERS = 2
+# number of finished submissions whose result stays available on /status/<id>
+SUBMISSION_HISTORY = 10000
+# timeout of posting a result to the callback url of a submission, s
+CALLBACK_TIMEOUT = 5
+
+# role of the server: 'judge' judges submissions on its own workers, 'coordinator' dispatches them
+# to the judge nodes of a cluster (cluster.py)
+SERVER_MODE = 'judge'
+# distinguishes the docker resources of judge nodes sharing one docker daemon, e.g. for a local cluster
+NODE_ID = os.environ.get('CRAZYBOX_NODE_ID', '')
+# judge nodes of a coordinator, base url -> token; more can be registered on /nodes/
+CLUSTER_NODES = {}
+# interval of pinging the judge nodes for their load, s
+CLUSTER_PING_INTERVAL = 5
+# number of nodes a submission is tried on before it fails
+CLUSTER_ATTEMPTS = 3
+# timeout of judging one submission on a node, s
+CLUSTER_JUDGE_TIMEOUT = 600
+
+# cache of compiled outputs keyed by the compile command and the source code (cache.py)
+COMPILE_CACHE = True
+COMPILE_CACHE_DIR = os.path.join(os.getcwd(), 'cache', 'compile')
+# total size of the cached artifacts, least recently used entries are evicted beyond it, Byte
+COMPILE_CACHE_SIZE = 2 * 1024 * 1024 * 1024
+
+# compile in the warm compiler daemons of LANG[...]['compile_server'] (utils.CompileServer), one sandbox
+# per language and judge process; False compiles every submission with a new compiler process
+COMPILE_SERVER = True
+
+# manifests of the test data directories: size, mtime and sha256 of every file (testdata.py)
+MANIFEST_DIR = os.path.join(os.getcwd(), 'cache', 'manifest')
+
+# cached test case indexes of the test data directories (testdata.py)
+INDEX_DIR = os.path.join(os.getcwd(), 'cache', 'index')
+# superseded versions of synced test data are kept this long for judgements still reading them, s
+SNAPSHOT_RETENTION = 600
+
+# interactors and custom checkers of the problems, compiled against testlib.h on the host once per
+# source (checker.py)
+TESTLIB_CACHE_DIR = os.path.join(os.getcwd(), 'cache', 'testlib')
+# timeout of compiling one interactor or custom checker, s
+TESTLIB_COMPILE_TIMEOUT = 60
+# limits of a custom checker run in the checker sandbox for a test case: cpu time s, memory MB, file size Byte
+CUSTOM_CHECKER_LIMITS = {'cpu_time': 10, 'memory': 1024, 'file_size': 64 * 1024 * 1024}
+
+# compare outputs of the built-in check methods in process (comparator.py),
+# False runs the testlib binaries in checkers/ for every test case
+CHECKER_ENGINE = True
+
+# prefix of the resource usage line reported by /usr/bin/time inside the sandbox
+USAGE_MARKER = '__crazybox_usage__'
+
 DEFAULT_LIMITS = {
     # CPU time in seconds, None for unlimited
     'cpu_time': 1,
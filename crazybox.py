@@ -1,77 +1,450 @@
 # -*- coding: utf-8 -*-
 import os
+import time
+import uuid
+import signal
+import queue
+import threading
 
-from docker.errors import APIError
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ThreadPoolExecutor, CancelledError
 
 from logzero import logger
 
-from config import TEMP_DIR, TEST_DATA_DIR, WORKING_DIR
+from config import TEST_DATA_DIR, WORKING_DIR, SUPERVISOR_MODE, PARALLEL_CASES, COMPILE_CACHE, COMPILE_SERVER
+from config import STARTUP_BASELINE, STARTUP_BASELINE_RUNS
 from result import *
 from exceptions import CrazyBoxError
 
-from utils import create_container, run_container
-from utils import working_volume, compress_code, replace_arg, extract_tar
-from checker import check
+from utils import create_container, run_container, pool, cpu_set, Sandbox, Supervisor
+from utils import working_volume, compress_code, replace_arg, output_file, volume_mountpoint, wrap_usage
+from utils import wrap_cgroup_cpu, read_head, wrap_interactor, generate_args
+from utils import add_to_archive, compile_servers, CompileServer
+from checker import check, get_data, testlib_status, testlib_cache, CUSTOM_CHECKER
+from cache import compile_cache
+from testdata import indexes, safe_path, ALL_OR_NOTHING, PER_TEST
+from metrics import metrics
 
 from languages import LANG
 
 
-def _compile(name: str, volume_name: str, command, time_limit, memory_limit, file_size_limit=128 * 1024 * 1024):
-    box_name = name.split('-')[0] + '-compile-box'
-    crazybox, real_time_limit = create_container(box_name, command, volume_name,
-                                                 time_limit, memory_limit, file_size_limit)
+@contextmanager
+def _supervisor(sandbox):
+    """yield a Supervisor running in the sandbox in supervisor mode, otherwise None"""
+    if not sandbox or not SUPERVISOR_MODE:
+        yield None
+        return
+    supervisor = Supervisor(sandbox)
+    try:
+        yield supervisor
+    finally:
+        supervisor.close()
 
-    tar_file_path = os.path.join(TEMP_DIR, name + '.tar')
-    file = open(tar_file_path).read().encode()
-    crazybox.put_archive(WORKING_DIR, file)
 
-    ret = run_container(crazybox, real_time_limit)
-    crazybox.remove(force=True)
+@contextmanager
+def _workspace(language, test_data_dir):
+    """
+    yield (volume_name, sandbox, data_path):
+    a warm sandbox from the pool when it serves the language family and the test data is under TEST_DATA_DIR,
+    a one-off sandbox in supervisor mode,
+    otherwise a new docker volume shared by one container per compile/test case.
+    data_path is where test_data_dir is visible inside the container.
+    """
+    family = language.get('family')
+    if pool.enabled(family) and Sandbox.data_path(test_data_dir):
+        with pool.sandbox(family) as sandbox:
+            # 沙箱的/data/中只有这个提交的题目的测试数据
+            yield None, sandbox, sandbox.bind_data(test_data_dir)
+    elif SUPERVISOR_MODE:
+        with pool.one_off(family, test_data_dir) as sandbox:
+            yield None, sandbox, '/data/'
+    else:
+        with working_volume() as volume_name:
+            yield volume_name, None, '/data/'
+
+
+@metrics.timed('compile')
+def _compile(name: str, volume_name: str, command, code_archive: bytes,
+             time_limit, memory_limit, file_size_limit=128 * 1024 * 1024,
+             sandbox: Sandbox = None, cache_key=None, artifacts=(), host_dir=None, server: CompileServer = None):
+
+    if sandbox:
+        crazybox = sandbox
+    else:
+        box_name = name.split('-')[0] + '-compile-box'
+        crazybox, real_time_limit = create_container(box_name, command, volume_name,
+                                                     time_limit, memory_limit, file_size_limit,
+                                                     host_dir=host_dir)
+    crazybox.put_archive(WORKING_DIR, code_archive)
+
+    # 相同的编译命令和源代码直接使用缓存的编译产物
+    cached = compile_cache.load(cache_key, name) if cache_key else None
+    if cached is not None:
+        logger.info('compile cache hit: %s', cache_key)
+        crazybox.put_archive(WORKING_DIR, cached)
+        ret = {'exit_code': 0, 'stdout': b'', 'stderr': b'', 'duration': 0, 'wall_time': 0, 'cpu_time': 0,
+               'memory': None, 'timeout': False, 'oom_killed': False, 'cached': True}
+    else:
+        # 有编译服务器时在预热的编译器中编译，产物复制到评测的沙箱
+        ret = server.compile(name, command, code_archive, time_limit, artifacts, crazybox) if server else None
+        if ret is None and sandbox:
+            ret = sandbox.execute(command, time_limit, memory_limit, file_size_limit)
+        elif ret is None:
+            ret = run_container(crazybox, real_time_limit, time_limit, host_dir)
+        ret['cached'] = False
+        if ret['exit_code'] == 0 and cache_key:
+            compile_cache.store(cache_key, name, crazybox, artifacts)
+
+    if not sandbox:
+        with metrics.timer('cleanup'):
+            crazybox.remove(force=True)
     return ret
 
 
+# language name -> startup time, ms, measured once per judge process
+_startup_times = dict()
+
+
+def _startup_time(language_name, sandbox: Sandbox, time_limit, memory_limit):
+    """
+    :return: median cpu time of the empty program of the language run in the sandbox like a submission
+             with the limits of the first submission, ms; None if it failed
+    """
+    if language_name in _startup_times:
+        return _startup_times[language_name]
+    language = LANG[language_name]
+    file_name, code_archive = compress_code(language['empty_program'], language['suffix'])
+    src_path = os.path.join(WORKING_DIR, file_name + language['suffix'])
+    exe_path = os.path.join(WORKING_DIR, file_name + language.get('exe_suffix', ''))
+    times = []
+    with metrics.timer('startup'):
+        sandbox.put_archive(WORKING_DIR, code_archive)
+        try:
+            ret = sandbox.execute(replace_arg(language['compile_command'], src_path, exe_path),
+                                  language['compile_max_cpu_time'] / 1000,
+                                  language['compile_max_memory'] / 1024 / 1024)
+            run_cmd = replace_arg(language['run_command'], src_path, exe_path, '%dM' % memory_limit)
+            for _ in range(STARTUP_BASELINE_RUNS if ret['exit_code'] == 0 else 0):
+                ret = sandbox.execute(run_cmd + ' < /dev/null > /dev/null', time_limit, memory_limit * 2)
+                cpu_time = ret['cpu_time'] if ret['cpu_time'] is not None else ret['duration']
+                if ret['exit_code'] != 0 or cpu_time is None:
+                    break
+                times.append(int(cpu_time * 1000))
+        finally:
+            # 不留在工作目录中，以免被当作提交的编译产物缓存
+            sandbox.container.exec_run(['/bin/sh', '-c', 'rm -rf {0}{1}* {0}__pycache__/{1}*'.format(
+                WORKING_DIR, file_name)])
+    if len(times) < STARTUP_BASELINE_RUNS:
+        logger.warning('Failed to measure the startup time of %s: %s', language_name,
+                       ret['stderr'].decode(errors='replace'))
+        return None
+    _startup_times[language_name] = sorted(times)[len(times) // 2]
+    logger.info('startup time of %s: %s ms', language_name, _startup_times[language_name])
+    return _startup_times[language_name]
+
+
+# the interactor reads the program's output on stdin and writes its input on stdout, testlib style:
+# interactor <input file> <output file> <answer file>
+INTERACTOR_COMMAND = ("timeout -s KILL {real_time} sh -c "
+                      "'exec {interactor} {input} {output} {answer} > {stdout} < {stdin} 2> {stderr}'")
+
+
+@contextmanager
 def _run(name, volume_name, command, data_dir, data_file_name,
          time_limit, memory_limit,
-         file_size_limit=10 * 1024 * 1024, use_time=False):
+         file_size_limit=10 * 1024 * 1024, sandbox: Sandbox = None, data_path='/data/',
+         supervisor: Supervisor = None, cpu=None, host_dir=None, interactor=None):
+    """
+    yield (run result, path of the program's output readable by the checker)
 
-    box_name = name.split('-')[0] + '-run-box'
+    :param host_dir: host mountpoint of the working directory, the output is read there in place
+    :param interactor: path of the interactor inside the container for an interactive problem;
+                       the output is then the interactor's output file and the run result has
+                       'interactor': {'exit_code', 'wall_time', 'cpu_time', 'memory', 'log'}
+    """
 
-    command = command + ' < /data/{}.in > /crazybox/{}.out'.format(data_file_name, name)
+    # 测试点可能并行运行，容器名和输出文件名都需要区分测试点
+    box_name = '{}-{}-run-box'.format(name.split('-')[0], str(uuid.uuid4())[:8])
+
+    in_path = os.path.join(data_path, data_file_name + '.in')
+    out_path = '/crazybox/{}-{}.out'.format(name, data_file_name)
+    # stderr也写入文件，受同一个文件大小限制，超出时程序立即被SIGXFSZ杀死
+    err_path = '/crazybox/{}-{}.err'.format(name, data_file_name)
+
+    interaction = None
+    if interactor:
+        # 交互题：选手程序和交互器通过两个命名管道直接相连，在同一个沙箱中运行，
+        # 交互器的输出文件作为评测输出，时间和内存由各自的/usr/bin/time分别统计
+        prefix = '/crazybox/{}-{}'.format(name, data_file_name)
+        to_program, from_program = prefix + '.to', prefix + '.from'
+        real_time_limit, _, _ = generate_args(time_limit, memory_limit, file_size_limit)
+        interaction = (INTERACTOR_COMMAND.format(
+            real_time=real_time_limit + 1, interactor=interactor, input=in_path, output=out_path,
+            answer=os.path.join(data_path, data_file_name + '.out'), stdout=to_program, stdin=from_program,
+            stderr=prefix + '.log'), (to_program, from_program))
+        command = command + ' < {} > {} 2> {}'.format(to_program, from_program, err_path)
+    else:
+        command = command + ' < {} > {} 2> {}'.format(in_path, out_path, err_path)
+
+    start = time.perf_counter()
+    if supervisor and not interactor:
+        ret = supervisor.run(command, in_path, out_path, err_path,
+                             time_limit, memory_limit, file_size_limit, cpu)
+        crazybox = sandbox
+    elif sandbox:
+        ret = sandbox.execute(command, time_limit, memory_limit, file_size_limit, cpu, interaction)
+        crazybox = sandbox
+    else:
+        # 如果不加sh -c参数，会导致获取内存不正确的情况，似乎这种情况下获取到的内存是重定向这个命令的内存？
+        # 时间和内存在同一次运行中由/usr/bin/time统计，不再单独运行第二次
+        # cpu时间取容器cgroup的统计，包括程序没有等待的子进程；交互题的cgroup包括交互器，只用rusage
+        if interaction:
+            command = '/bin/bash -c "{}; exit $s"'.format(wrap_interactor(wrap_usage(command), *interaction))
+        else:
+            command = '/bin/bash -c "{}; exit $s"'.format(wrap_cgroup_cpu(wrap_usage(command)))
 
-    # /usr/bin/time -v sh -c 'exec ./a < 2.in > 2.out' |& grep 'Maximum resident'
-    # 如果不加sh -c参数，会导致获取内存不正确的情况，似乎这种情况下获取到的内存是重定向这个命令的内存？
-    if use_time:
-        command = "/usr/bin/time -v sh -c 'exec {}' |& grep 'Maximum resident'".format(command)
+        crazybox, real_time_limit = create_container(box_name, command, volume_name,
+                                                     time_limit, memory_limit, file_size_limit, data_dir,
+                                                     None if cpu is None else str(cpu), host_dir)
 
-    command = '/bin/bash -c "{}"'.format(command)
+        ret = run_container(crazybox, real_time_limit, time_limit, host_dir, bool(interaction))
 
-    crazybox, real_time_limit = create_container(box_name, command, volume_name,
-                                                 time_limit, memory_limit, file_size_limit, data_dir)
+    if (not supervisor or interactor) and ret['exit_code'] != 0:
+        ret['stderr'] += read_head(crazybox, err_path, host_dir=host_dir)
+    if interaction:
+        # 交互器的返回值和用时随exec的stdout返回，不经过选手程序可写的工作目录
+        ret['interactor']['log'] = read_head(crazybox, prefix + '.log', host_dir=host_dir).decode(errors='replace')
+    metrics.observe('run', time.perf_counter() - start)
 
-    ret = run_container(crazybox, real_time_limit)
+    try:
+        with output_file(crazybox, out_path, host_dir) as out_file_path:
+            yield ret, out_file_path
+    finally:
+        if not sandbox:
+            with metrics.timer('cleanup'):
+                crazybox.remove(force=True)
+
+
+def _judge_case(data_name, ret, out_file_path, test_data_dir, time_limit, memory_limit, file_size_limit,
+                check_method, checker=None):
+    """
+    :return: (sub_result, failure, usage)
+             failure: None if the case is accepted, otherwise (status, info, msg)
+             usage: (time ms, memory KB) once the program finished normally, otherwise None
+    """
+    in_file_path = os.path.join(test_data_dir, data_name + '.in')
+    answer_file_path = os.path.join(test_data_dir, data_name + '.out')
+    # time是cpu时间(user + sys)，是否超时按它判断；wall time只作为参考
+    cpu_time = ret['cpu_time'] if ret['cpu_time'] is not None else ret['duration']
+    used_time = str(int(cpu_time * 1000)) + ' ms' if cpu_time is not None else None
+    wall_time = str(int(ret['duration'] * 1000)) + ' ms' if ret['duration'] is not None else None
+    sub_result = {'test': data_name, 'time': used_time, 'wall time': wall_time, 'memory': None,
+                  'exit code': ret['exit_code'],  'checker exit code': None, 'verdict': None,
+                  'input': None, 'output': None, 'answer': None, 'log': None}
+
+    interactor = ret.get('interactor')
+    exit_code = ret['exit_code']
+    # 交互器判定答案错误并退出后，选手程序常因SIGPIPE等异常退出，此时以交互器的结果为准；
+    # 选手程序异常退出导致交互器读到意外的EOF(PE)时仍是运行错误
+    if interactor and testlib_status(interactor['exit_code']) == WA and not ret['oom_killed'] \
+            and exit_code != 128 + signal.SIGXFSZ:
+        exit_code = 0
+
+    # 正常退出但cpu时间超出限制的也是超时
+    if exit_code != 0 or ret['timeout']:
+        if ret['exit_code'] == 128 + signal.SIGXFSZ:
+            info = 'File size limit exceeded : %s MB' % (file_size_limit / 1024 / 1024)
+            msg = 'Output limit exceed on test %s' % data_name
+            sub_result['verdict'] = 'Output Limit Exceed'
+            status = OLE
+
+        elif ret['oom_killed']:
+            info = 'memory limit exceeded : %s MB' % memory_limit
+            msg = 'Memory limit exceed on test %s' % data_name
+            sub_result['verdict'] = 'Memory Limit Exceed'
+            status = MLE
+
+        elif ret['timeout']:
+            info = 'time limit exceeded : %s s' % time_limit
+            msg = 'Time limit exceed on test %s' % data_name
+            sub_result['verdict'] = 'Time Limit Exceed'
+            status = TLE
 
-    if use_time:
-        crazybox.remove(force=True)
-        if ret['exit_code'] == 0:
-            return ret['stdout'].decode().split(':')[1].strip()  # KB
         else:
-            logger.warning('/usr/bin/time function error: %s |-| %s', ret['stdout'].decode(),  ret['stderr'].decode())
-            return None
+            info = ret['stdout'].decode(errors='replace') + '\n' + ret['stderr'].decode(errors='replace')
+            msg = 'Runtime error on test %s' % data_name
+            sub_result['verdict'] = 'Runtime Error'
+            status = RE
+
+        logger.warning(info)
+        return sub_result, (status, info, msg), None
+
+    used_maximum_memory = ret['memory']
+    if used_maximum_memory is None:
+        logger.warning('/usr/bin/time function error: %s |-| %s',
+                       ret['stdout'].decode(errors='replace'), ret['stderr'].decode(errors='replace'))
+        used_maximum_memory = 0
+
+    sub_result['memory'] = str(used_maximum_memory) + ' KB'
+
+    if used_maximum_memory / 1024 >= memory_limit:
+        sub_result['verdict'] = 'Memory Limit Exceed'
+        return sub_result, (MLE, 'memory limit exceeded : %s MB' % memory_limit,
+                            'Memory limit exceed on test %s' % data_name), None
+
+    usage = (int((cpu_time or 0) * 1000), used_maximum_memory)
+
+    if interactor:
+        # 交互题的结果是交互器的返回值，和checker一样是testlib的返回值
+        sub_result['checker exit code'], sub_result['log'] = interactor['exit_code'], interactor['log']
+        sub_result['input'], sub_result['output'], sub_result['answer'] = \
+            get_data(in_file_path), get_data(out_file_path), get_data(answer_file_path)
+        if interactor['cpu_time'] is not None:
+            sub_result['interactor time'] = str(int(interactor['cpu_time'] * 1000)) + ' ms'
+            sub_result['interactor memory'] = str(interactor['memory']) + ' KB'
     else:
+        sub_result['checker exit code'], sub_result['log'], \
+            sub_result['input'], sub_result['output'], sub_result['answer'] \
+            = check(in_file_path, out_file_path, answer_file_path, check_method, checker)
+    code = sub_result['checker exit code']
+
+    # info msg status
+    status = testlib_status(code)
+    if status == AC:
+        sub_result['verdict'] = 'OK'
+        return sub_result, None, usage
+
+    if status == WA:
+        sub_result['verdict'] = 'Wrong Answer'
+        info = msg = 'Wrong answer on test %s' % data_name
+    elif status == PE:
+        sub_result['verdict'] = 'Presentation Error'
+        info = msg = 'Presentation error on test %s' % data_name
+    else:
+        sub_result['verdict'] = 'Judgement Failed'
+        if interactor:
+            info = 'interactor(exit code {}) error: {}\n{}'.format(code, os.path.join(test_data_dir, data_name),
+                                                                  interactor['log'])
+        else:
+            info = 'check method({}) error: {}'.format(check_method, os.path.join(test_data_dir, data_name))
+        msg = 'judge failed, please contact manager.'
+    return sub_result, (status, info, msg), usage
+
+
+def _run_cases(run_case, name_list, slots, fail_fast):
+    """
+    Run run_case(data_name, slot) for the test cases in order and yield (data_name, case result).
+
+    fail_fast(data_name) is the key of the fail-fast group of the case, or None if the case always runs.
+    After a failure (case result[1] is not None) the remaining cases of its group are skipped and
+    yielded with None as their case result.
+
+    With more than one slot the cases run concurrently, one per slot. A failure is recorded as soon as
+    its case finishes: the cases of its group after it that did not start yet are not run, even while
+    an earlier case is still running. Results are still yielded in name_list order and a failure only
+    skips the cases after it, so the reported failure of a group is always its lowest-numbered failing
+    test whatever the parallelism. Neither are the cases left when the caller stops iterating run.
+    """
+    failed = dict()  # fail-fast group -> lowest index of its failed cases
+    lock = threading.Lock()
+
+    def skipped(index):
+        group = fail_fast(name_list[index])
+        with lock:
+            return group is not None and failed.get(group, len(name_list)) < index
+
+    def record(index, case):
+        """:return: whether the case is now the lowest failure of its group"""
+        group = fail_fast(name_list[index])
+        if case[1] is None or group is None:
+            return False
+        with lock:
+            if failed.get(group, len(name_list)) <= index:
+                return False
+            failed[group] = index
+            return True
+
+    if len(slots) == 1:
+        for index, data_name in enumerate(name_list):
+            if skipped(index):
+                yield data_name, None
+                continue
+            case = run_case(data_name, slots[0])
+            record(index, case)
+            yield data_name, case
+        return
+
+    free = queue.Queue()
+    for slot in slots:
+        free.put(slot)
+    stop = threading.Event()
+    futures = []
+
+    def task(index):
+        if stop.is_set() or skipped(index):
+            return None
+        slot = free.get()
         try:
-            data = crazybox.get_archive('/crazybox/{}.out'.format(name))
-            tar_path = os.path.join(TEMP_DIR, str(name).split('-')[0] + '-out.tar')
-            with open(tar_path, 'w') as file:
-                file.write(data[0].read().decode())
-        except APIError:
-            tar_path = None
-        crazybox.remove(force=True)
-        return ret, tar_path
+            # 等待空闲位置期间同组可能已经有测试点失败
+            if stop.is_set() or skipped(index):
+                return None
+            case = run_case(name_list[index], slot)
+            if record(index, case):
+                group = fail_fast(name_list[index])
+                for later, future in enumerate(futures[index + 1:], index + 1):
+                    if fail_fast(name_list[later]) == group:
+                        future.cancel()
+            return case
+        finally:
+            free.put(slot)
+
+    executor = ThreadPoolExecutor(max_workers=len(slots))
+    for index in range(len(name_list)):
+        futures.append(executor.submit(task, index))
+    try:
+        for index, (data_name, future) in enumerate(zip(name_list, futures)):
+            try:
+                case = future.result()
+            except CancelledError:
+                case = None
+            yield data_name, None if case is None or skipped(index) else case
+    finally:
+        stop.set()
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _skipped_case(data_name):
+    """:return: the sub result of a test case skipped after a failure in its group"""
+    return {'test': data_name, 'time': None, 'wall time': None, 'memory': None,
+            'exit code': None, 'checker exit code': None, 'verdict': 'Skipped',
+            'input': None, 'output': None, 'answer': None, 'log': None}
+
+
+def _score_group(group, statuses):
+    """
+    :param group: a group of the test case index: {'name', 'policy', 'score', 'cases'}
+    :param statuses: {test case name: status, None if the case was skipped}
+    :return: the result of the group, a group without test cases scores 0
+    """
+    total = len(group['cases'])
+    passed = sum(statuses[name] == AC for name in group['cases'])
+    failures = [statuses[name] for name in group['cases'] if statuses[name] not in (AC, None)]
+    if not total:
+        score = 0
+    elif group['policy'] == PER_TEST:
+        score = group['score'] * passed / total
+    else:
+        score = group['score'] if passed == total else 0
+    return {'name': group['name'], 'policy': group['policy'], 'status': failures[0] if failures else AC,
+            'score': score, 'max_score': group['score'], 'passed': passed, 'total': total,
+            'skipped': [name for name in group['cases'] if statuses[name] is None]}
 
 
 def judge(src_code, language, test_data_dir,
           time_limit, memory_limit, file_size_limit=10 * 1024 * 1024,
-          check_method='line'):
+          check_method='line', parallel=None):
     """
 
     :param src_code: 源代码
@@ -81,20 +454,64 @@ def judge(src_code, language, test_data_dir,
     :param memory_limit: 内存限制 单位：MB
     :param file_size_limit: 文件大小限制 (update: 似乎被docker.py转为Byte)单位：block 查看utils.py中generate_ulimits函数说明
     :param check_method: 查看checker.py文件
-    :return:
+    :param parallel: 同时运行的测试点数量，默认为config.PARALLEL_CASES
+    :return: 评测结果；测试数据的problem.json声明了分组(groups)时，
+             'groups'是每组的得分，'score'是总分，失败的all_or_nothing组中剩余的测试点被跳过；
+             problem.json的interactor是交互器的testlib源代码，此时为交互题，check_method不使用；
+             problem.json的checker是special judge的testlib源代码，此时check_method为custom；
+             config.STARTUP_BASELINE开启时'startup_time'是该语言空程序的cpu时间(ms)，单独报告，不从time中扣除
     """
-    language = str(language).capitalize()
-    if language not in LANG:
-        raise CrazyBoxError('No support for the language: %s', language)
-    language = LANG[language]
+    language_name = str(language).capitalize()
+    if language_name not in LANG:
+        raise CrazyBoxError('No support for the language: %s', language_name)
+    server = compile_servers.get(language_name) if COMPILE_SERVER else None
+    language = LANG[language_name]
     suffix = language['suffix']
+    # 同步会替换测试数据的符号链接，整个评测使用同一个版本
+    test_data_dir = os.path.realpath(test_data_dir)
     exe_suffix = language['exe_suffix'] if 'exe_suffix' in language else ''
 
     # info用来给维护者debug　msg用来显示给前台用户
     result = {'status': None, 'info': '', 'msg': '', 'time': 0, 'memory': 0,  # ms KB
-              'compile_time': None, 'compile_exit_code': None, 'detail': []}
-
-    with working_volume() as volume_name, compress_code(src_code, suffix) as file_name:
+              'compile_time': None, 'compile_exit_code': None, 'compile_cached': False, 'detail': [],
+              'score': None, 'max_score': None, 'groups': [], 'startup_time': None}
+
+    # 测试点按自然顺序排列，可以单独设置时间限制；声明了分组时按组计分
+    index = indexes.load(test_data_dir)
+    cases, groups = index['cases'], index['groups']
+    name_list = [case['name'] for case in cases]
+    time_limits = {case['name']: case['time_limit'] or time_limit for case in cases}
+    group_of = {name: group for group in groups for name in group['cases']}
+    if groups:
+        result['max_score'] = sum(group['score'] for group in groups)
+
+    # 交互题的交互器在宿主机上按源代码编译一次并缓存，随提交的源代码一起放入工作目录
+    interactor_binary = None
+    if index['problem'].get('interactor'):
+        interactor_binary = testlib_cache.build(safe_path(test_data_dir, index['problem']['interactor']))
+    # 题目自带checker(special judge)时使用它，同样只编译一次
+    checker = None
+    if index['problem'].get('checker') or str(check_method).lower() == 'custom':
+        check_method = 'custom'
+        checker = testlib_cache.build(safe_path(test_data_dir, index['problem'].get('checker', CUSTOM_CHECKER)))
+
+    def fail_fast(data_name):
+        # 没有分组时所有测试点是一个组，第一个错误就结束评测
+        if not groups:
+            return ''
+        group = group_of[data_name]
+        return group['name'] if group['policy'] == ALL_OR_NOTHING else None
+
+    with _workspace(language, test_data_dir) as (volume_name, sandbox, data_path), ExitStack() as stack:
+        # 直接在宿主机上读取工作目录中的输出文件，不可访问时再通过docker流式读取
+        host_dir = volume_mountpoint(sandbox.volume_name if sandbox else volume_name)
+
+        file_name, code_archive = compress_code(src_code, suffix)
+        interactor = None
+        if interactor_binary:
+            interactor = os.path.join(WORKING_DIR, file_name + '.interactor')
+            with open(interactor_binary, 'rb') as file:
+                code_archive = add_to_archive(code_archive, file_name + '.interactor', file.read(), 0o755)
         src_path = os.path.join(WORKING_DIR, file_name + suffix)
         exe_path = os.path.join(WORKING_DIR, file_name + exe_suffix)
 
@@ -102,144 +519,86 @@ def judge(src_code, language, test_data_dir,
         compile_time_limit = language['compile_max_cpu_time'] / 1000
         compile_memory_limit = language['compile_max_memory'] / 1024 / 1024
 
-        ret = _compile(file_name, volume_name, compile_cmd, compile_time_limit, compile_memory_limit)
+        cache_key = compile_cache.key(language, src_code) if COMPILE_CACHE else None
+        artifacts = [replace_arg(path, src_path, exe_path) for path in language.get('artifacts', [])]
+        ret = _compile(file_name, volume_name, compile_cmd, code_archive, compile_time_limit, compile_memory_limit,
+                       sandbox=sandbox, cache_key=cache_key, artifacts=artifacts, host_dir=host_dir, server=server)
 
         result['compile_time'] = ret['duration']
         result['compile_exit_code'] = ret['exit_code']
+        result['compile_cached'] = ret['cached']
 
         if ret['exit_code'] != 0:
-            err = ret['stderr'].decode()
+            err = ret['stderr'].decode(errors='replace')
             logger.warning('complied failed(exit code: %s, time: %s): %s', ret['exit_code'], ret['duration'], err)
             result['status'] = CE
             result['info'] = err
             result['msg'] = err
+            if groups:
+                result['score'] = 0
             return result
 
-        run_cmd = replace_arg(language['run_command'], src_path, exe_path)
-
-        name_list = []
-        for data_name in os.listdir(test_data_dir):
-            if not os.path.isfile(os.path.join(test_data_dir, data_name)):
-                continue
-            name, file_suffix = os.path.splitext(data_name)
-            if file_suffix == '.in' and os.path.exists(os.path.join(test_data_dir, name + '.out')):
-                name_list.append(name)
-
-        name_list.sort()
-
-        for data_name in name_list:
+        run_cmd = replace_arg(language['run_command'], src_path, exe_path, '%dM' % memory_limit)
+        # 语言的启动时间只在沙箱中测量，每个评测进程一次
+        if STARTUP_BASELINE and sandbox:
+            result['startup_time'] = _startup_time(language_name, sandbox, time_limit, memory_limit)
+
+        # 并行时每个测试点独占一个CPU，没有空闲CPU时退化为串行
+        workers = min(parallel or PARALLEL_CASES, len(name_list))
+        cpus = stack.enter_context(cpu_set.reserve(workers)) if workers > 1 else []
+        if sandbox:
+            sandbox.concurrency = max(len(cpus), 1)
+            sandbox.set_cpus(','.join(str(cpu) for cpu in cpus))
+        # supervisor只能连接文件，交互题通过docker exec运行
+        slots = [(cpu, stack.enter_context(_supervisor(None if interactor else sandbox))) for cpu in cpus or [None]]
+
+        def run_case(data_name, slot):
             logger.info('----running on case: %s----', data_name)
-
-            ret, tar_path = _run(file_name, volume_name, run_cmd, test_data_dir, data_name,
-                                 time_limit, memory_limit * 2, file_size_limit)
-
-            with extract_tar(tar_path) as out_file_path:
-                in_file_path = os.path.join(test_data_dir, data_name + '.in')
-                answer_file_path = os.path.join(test_data_dir, data_name + '.out')
-                used_time = str(int(ret['duration'] * 1000)) + ' ms' if ret['duration'] else None
-                sub_result = {'test': data_name, 'time': used_time, 'memory': None,
-                              'exit code': ret['exit_code'],  'checker exit code': None, 'verdict': None,
-                              'input': None, 'output': None, 'answer': None, 'log': None}
-
-                if ret['exit_code'] != 0:
-                    if ret['exit_code'] == 153:
-                        info = 'File size limit exceeded : %s MB' % (file_size_limit / 1024 / 1024)
-                        msg = 'Output limit exceed on test %s' % data_name
-                        sub_result['verdict'] = 'Output Limit Exceed'
-                        result['status'] = OLE
-
-                    elif ret['oom_killed']:
-                        info = 'memory limit exceeded : %s MB' % memory_limit
-                        msg = 'Memory limit exceed on test %s' % data_name
-                        sub_result['verdict'] = 'Memory Limit Exceed'
-                        result['status'] = MLE
-
-                    elif ret['timeout']:
-                        info = 'time limit exceeded : %s s' % time_limit
-                        msg = 'Time limit exceed on test %s' % data_name
-                        sub_result['verdict'] = 'Time Limit Exceed'
-                        result['status'] = TLE
-
-                    else:
-                        info = ret['stdout'].decode() + '\n' + ret['stderr'].decode()
-                        msg = 'Runtime error on test %s' % data_name
-                        sub_result['verdict'] = 'Runtime Error'
-                        result['status'] = RE
-
-                    logger.warning(info)
-                    result['info'] = info
-                    result['msg'] = msg
-                    result['detail'].append(sub_result)
-                    return result
-
-                used_maximum_memory = _run(file_name, volume_name, run_cmd, test_data_dir, data_name,
-                                           time_limit, memory_limit * 2, file_size_limit, use_time=True)
-
-                if int(used_maximum_memory) / 1024 >= memory_limit:
-                    result['info'] = 'memory limit exceeded : %s MB' % memory_limit
-                    result['msg'] = 'Memory limit exceed on test %s' % data_name
-                    sub_result['verdict'] = 'Memory Limit Exceed'
-                    result['detail'].append(sub_result)
-                    return result
-
-                result['time'] = max(result['time'], int(ret['duration'] * 1000))
-                result['memory'] = max(result['memory'], int(used_maximum_memory))
-
-                sub_result['memory'] = str(used_maximum_memory) + ' KB'
-
-                sub_result['checker exit code'], sub_result['log'], \
-                    sub_result['input'], sub_result['output'], sub_result['answer'] \
-                    = check(in_file_path, out_file_path, answer_file_path, check_method)
-                code = sub_result['checker exit code']
-
-                # info msg status
-                if code == 0:
-                    sub_result['verdict'] = 'OK'
-                    result['detail'].append(sub_result)
-                else:
-                    if code == 1:
-                        sub_result['verdict'] = 'Wrong Answer'
-                        info = msg = 'Wrong answer on test %s' % data_name
-                    elif code == 2:
-                        sub_result['verdict'] = 'Presentation Error'
-                        info = msg = 'Presentation error on test %s' % data_name
-                    else:
-                        sub_result['verdict'] = 'Judgement Failed'
-                        info = 'check method({}) error: {}'.format(check_method, os.path.join(test_data_dir, data_name))
-                        msg = 'judge failed, please contact manager.'
-
-                    result['info'] = info
-                    result['msg'] = msg
-                    result['detail'].append(sub_result)
-                    return result
-
-    result['status'] = AC
+            cpu, supervisor = slot
+            with _run(file_name, volume_name, run_cmd, test_data_dir, data_name,
+                      time_limits[data_name], memory_limit * 2, file_size_limit,
+                      sandbox=sandbox, data_path=data_path, supervisor=supervisor, cpu=cpu,
+                      host_dir=host_dir, interactor=interactor) as (ret, out_file_path):
+                return _judge_case(data_name, ret, out_file_path, test_data_dir,
+                                   time_limits[data_name], memory_limit, file_size_limit, check_method, checker)
+
+        statuses = dict()
+        first_failure = None
+        for data_name, case in _run_cases(run_case, name_list, slots, fail_fast):
+            if case is None:
+                result['detail'].append(_skipped_case(data_name))
+                statuses[data_name] = None
+                continue
+            sub_result, failure, usage = case
+            result['detail'].append(sub_result)
+            statuses[data_name] = failure[0] if failure else AC
+            if usage:
+                result['time'] = max(result['time'], usage[0])
+                result['memory'] = max(result['memory'], usage[1])
+            if failure:
+                first_failure = first_failure or failure
+                if not groups:
+                    break
+
+    result['status'], result['info'], result['msg'] = first_failure or (AC, '', '')
+    if groups:
+        result['groups'] = [_score_group(group, statuses) for group in groups]
+        result['score'] = sum(group['score'] for group in result['groups'])
     return result
 
 
 def test():
-    code_path = '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/new.py'
-    data_dir = '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/solio/H/tests'
-    with open(code_path) as file:
-        ret = judge(file.read(), 'python3', data_dir, 3, 128)
-        print(ret)
-
-
-def test2():
-    code_path = '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/F.cpp'
-    data_dir = '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/solio/F/tests'
-    with open(code_path) as file:
-        ret = judge(file.read(), 'c++', data_dir, 1, 256)
-        print(ret)
+    """judge an a+b solution on a small generated problem, tests/benchmark.py is the full benchmark"""
+    data_dir = os.path.join(TEST_DATA_DIR, 'smoke-aplusb')
+    os.makedirs(data_dir, exist_ok=True)
+    for i, (a, b) in enumerate([(1, 2), (-5, 7), (10 ** 9, 10 ** 9)], 1):
+        with open(os.path.join(data_dir, '%d.in' % i), 'w') as file:
+            file.write('%d %d\n' % (a, b))
+        with open(os.path.join(data_dir, '%d.out' % i), 'w') as file:
+            file.write('%d\n' % (a + b))
+    code = '#include <cstdio>\nint main() { long long a, b; scanf("%lld %lld", &a, &b); printf("%lld\\n", a + b); }\n'
+    print(judge(code, 'c++', data_dir, 1, 64, check_method='nint'))
 
 
 if __name__ == '__main__':
-    test2()
-    #
-    #
-    # code_path = '/home/xjw/Desktop/crazyX/project/OnlineJudge2.0/crazybox/judger/test_data/1/a.cpp'
-    # # code_path =  '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/H.cpp'
-    # data_dir = '/home/xjw/Desktop/crazyX/project/OnlineJudge2.0/crazybox/judger/test_data/1/'
-    # # data_dir = '/home/xjw/Desktop/crazyX/algorithm/code/oj/codeforces.com-gym/Gym_101174_SWERC_2016/solio/H/tests'
-    # with open(code_path) as file:
-    #     judge(file.read(), 'c++', data_dir, 1, 64)
+    test()
@@ -0,0 +1,64 @@
+import java.io.*;
+import java.math.BigDecimal;
+import java.math.BigInteger;
+import java.util.*;
+import java.util.stream.Collectors;
+import java.util.stream.IntStream;
+
+/**
+ * Uses the JDK classes typical submissions use, build-cds.sh adds the classes it loads to the
+ * class data sharing archive. Reads "n" and n pairs of integers on stdin.
+ */
+public class ClassListWarmUp {
+    public static void main(String[] args) throws IOException {
+        Scanner scanner = new Scanner(new BufferedInputStream(System.in));
+        int n = scanner.nextInt();
+        long[] sums = new long[n];
+        for (int i = 0; i < n; i++) {
+            sums[i] = scanner.nextLong() + scanner.nextLong();
+        }
+
+        BufferedReader reader = new BufferedReader(new InputStreamReader(new ByteArrayInputStream("7 8\n".getBytes())));
+        StringTokenizer tokenizer = new StringTokenizer(reader.readLine());
+        StreamTokenizer streamTokenizer = new StreamTokenizer(new StringReader("9 10"));
+        streamTokenizer.nextToken();
+        long extra = Long.parseLong(tokenizer.nextToken()) + Integer.parseInt(tokenizer.nextToken())
+                + (long) streamTokenizer.nval;
+
+        List<Long> list = new ArrayList<>();
+        for (long sum : sums) {
+            list.add(sum);
+        }
+        Collections.sort(list, Comparator.reverseOrder());
+        Arrays.sort(sums);
+        Integer[] boxed = {3, 1, 2};
+        Arrays.sort(boxed, (a, b) -> b - a);
+        Map<Long, Integer> hashMap = new HashMap<>();
+        TreeMap<Long, Integer> treeMap = new TreeMap<>();
+        Set<Long> hashSet = new HashSet<>(list);
+        TreeSet<Long> treeSet = new TreeSet<>(list);
+        for (long sum : list) {
+            hashMap.merge(sum, 1, Integer::sum);
+            treeMap.put(sum, treeMap.getOrDefault(sum, 0) + 1);
+        }
+        Deque<Long> deque = new ArrayDeque<>(list);
+        PriorityQueue<Long> heap = new PriorityQueue<>(list);
+        LinkedList<Long> linked = new LinkedList<>(list);
+        BitSet bits = new BitSet();
+        bits.set(n);
+
+        BigInteger big = BigInteger.valueOf(extra).pow(20).mod(BigInteger.valueOf(1000000007));
+        BigDecimal decimal = new BigDecimal("1.5").multiply(BigDecimal.TEN);
+        String joined = IntStream.range(0, n).mapToObj(Integer::toString).collect(Collectors.joining(","));
+
+        StringBuilder builder = new StringBuilder();
+        builder.append(String.format("%d %.3f %s%n", big.longValue(), Math.sqrt(decimal.doubleValue()), joined));
+        builder.append(hashSet.size() + treeSet.first() + deque.peekFirst() + heap.peek() + linked.size()
+                + hashMap.size() + treeMap.firstKey() + bits.cardinality()).append('\n');
+        PrintWriter writer = new PrintWriter(new BufferedWriter(new OutputStreamWriter(System.out)));
+        writer.print(builder);
+        writer.printf("%d%n", extra);
+        writer.flush();
+        System.out.println(Arrays.toString(sums));
+    }
+}
@@ -0,0 +1,90 @@
+import java.io.*;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.util.ArrayList;
+import java.util.List;
+import javax.tools.JavaCompiler;
+import javax.tools.ToolProvider;
+
+/**
+ * Warm javac of the Java compile sandbox (utils.CompileServer).
+ *
+ * Compiles the requests of crazybox-javac one at a time on a loopback port, in a JVM where the
+ * compiler is already loaded and JIT compiled, instead of starting a new javac for every submission.
+ *
+ * request: one javac argument per line, an empty line ends it
+ * response: the diagnostics of the compiler, then the line "__crazybox_javac__ <exit code>"
+ *
+ * usage: java -cp /usr/local/lib/crazybox JavacServer [port]
+ */
+public class JavacServer {
+    static final String MARKER = "__crazybox_javac__";
+
+    static final String WARM_UP = "import java.util.*;\nimport java.io.*;\n"
+            + "public class Main { public static void main(String[] args) throws IOException {\n"
+            + "BufferedReader in = new BufferedReader(new InputStreamReader(System.in));\n"
+            + "Map<String, List<Integer>> map = new TreeMap<>(); String line;\n"
+            + "while ((line = in.readLine()) != null) map.computeIfAbsent(line, k -> new ArrayList<>()).add(line.length());\n"
+            + "System.out.println(map.size()); } }\n";
+
+    public static void main(String[] args) throws IOException {
+        int port = args.length > 0 ? Integer.parseInt(args[0]) : 17000;
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        warmUp(compiler, 5);
+        try (ServerSocket server = new ServerSocket(port, 64, InetAddress.getLoopbackAddress())) {
+            while (true) {
+                try (Socket socket = server.accept()) {
+                    serve(compiler, socket);
+                } catch (IOException e) {
+                    // the client is gone, e.g. killed at the compile time limit
+                }
+            }
+        }
+    }
+
+    static void warmUp(JavaCompiler compiler, int rounds) throws IOException {
+        Path directory = Files.createTempDirectory("crazybox-javac");
+        Path source = directory.resolve("Main.java");
+        Files.write(source, WARM_UP.getBytes(StandardCharsets.UTF_8));
+        ByteArrayOutputStream output = new ByteArrayOutputStream();
+        for (int i = 0; i < rounds; i++) {
+            compiler.run(null, output, output, "-proc:none", "-d", directory.toString(), source.toString());
+        }
+        for (File file : directory.toFile().listFiles()) {
+            file.delete();
+        }
+        Files.delete(directory);
+    }
+
+    static void serve(JavaCompiler compiler, Socket socket) throws IOException {
+        BufferedReader in = new BufferedReader(new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+        // annotation processors would run code of the submission's classpath inside the server
+        List<String> arguments = new ArrayList<>();
+        arguments.add("-proc:none");
+        for (String line = in.readLine(); line != null && !line.isEmpty(); line = in.readLine()) {
+            arguments.add(line);
+        }
+
+        ByteArrayOutputStream output = new ByteArrayOutputStream();
+        int code;
+        try {
+            code = compiler.run(null, output, output, arguments.toArray(new String[0]));
+        } catch (RuntimeException e) {
+            e.printStackTrace(new PrintStream(output, true));
+            code = 4;  // javac's exit code of an abnormal termination
+        }
+
+        byte[] diagnostics = output.toByteArray();
+        OutputStream out = socket.getOutputStream();
+        out.write(diagnostics);
+        if (diagnostics.length > 0 && diagnostics[diagnostics.length - 1] != '\n') {
+            out.write('\n');
+        }
+        out.write((MARKER + " " + code + "\n").getBytes(StandardCharsets.UTF_8));
+        out.flush();
+    }
+}
@@ -0,0 +1,15 @@
+#!/usr/bin/env bash
+# build-cds.sh <ClassListWarmUp.java>
+# regenerate the class data sharing archive of the JDK with the classes typical submissions load
+# (ClassListWarmUp.java) added to the JDK's default class list. java -Xshare:auto -XX:+UseSerialGC
+# then maps them from the archive instead of loading and verifying them from rt.jar at every start.
+set -e
+jre=$(dirname "$(dirname "$(readlink -f "$(which java)")")")
+work=$(mktemp -d)
+javac -d "$work" "$1"
+printf '3\n1 2\n3 4\n5 6\n' | java -Xshare:off -XX:+UseSerialGC -verbose:class -cp "$work" ClassListWarmUp |
+    sed -n 's/^\[Loaded \([^ ]*\) from .*rt\.jar\]$/\1/p' | tr . / > "$work/classlist"
+cat "$jre/lib/classlist" >> "$work/classlist"
+awk '!seen[$0]++' "$work/classlist" > "$work/classlist.unique"
+java -Xshare:dump -XX:+UseSerialGC -XX:SharedClassListFile="$work/classlist.unique"
+rm -rf "$work"
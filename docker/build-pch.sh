@@ -0,0 +1,15 @@
+#!/usr/bin/env bash
+# build-pch.sh <pch dir> <g++ flags>...
+# precompile the standard library bundles once for every set of g++ flags given.
+# g++ takes <pch dir>/bits/stdc++.h.gch/* for '#include <bits/stdc++.h>' when the compile has
+# -I <pch dir> and the same flags as one of them, otherwise it silently reads the header itself.
+set -e
+dir=$1
+shift
+mkdir -p "$dir/bits/stdc++.h.gch"
+echo '#include <bits/stdc++.h>' > /tmp/stdc++.h
+for flags in "$@"; do
+    name=$(echo "$flags" | tr -c 'A-Za-z0-9+=\n' '_')
+    g++ $flags -x c++-header /tmp/stdc++.h -o "$dir/bits/stdc++.h.gch/$name.gch"
+done
+rm /tmp/stdc++.h
@@ -0,0 +1,222 @@
+/*
+ * crazybox-supervisor: run many test cases of one submission inside one sandbox.
+ *
+ * Reads one request per line from stdin (fields separated by '\t'):
+ *     cpu_ms  real_ms  memory_bytes  fsize_bytes  cpu  stdin_path  stdout_path  stderr_path  command
+ * and answers one line per request on stdout:
+ *     exit_code  wall_ms  cpu_ms  maxrss_kb  timeout  oom_killed
+ *
+ * exit_code follows the shell convention (128 + signal for a killed program), so
+ * SIGXFSZ is still reported as 153 and SIGKILL as 137.
+ * The memory limit itself is the cgroup limit of the container; memory_bytes is only
+ * used to recognize an oom kill on kernels without the oom_kill counter.
+ * cpu pins the program to one CPU of the container's cpuset, -1 leaves it unpinned.
+ * Several supervisors may serve one sandbox concurrently, so an increase of the shared
+ * oom_kill counter only counts for a program that was actually killed.
+ * An empty line or EOF ends the session.
+ */
+#define _GNU_SOURCE
+#include <errno.h>
+#include <sched.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/time.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+
+#define OOM_CONTROL "/sys/fs/cgroup/memory/memory.oom_control"
+
+static long oom_kills(void)
+{
+    char key[64];
+    long value;
+    long result = -1;
+    FILE *file = fopen(OOM_CONTROL, "r");
+    if (!file)
+        return -1;
+    while (fscanf(file, "%63s %ld", key, &value) == 2) {
+        if (strcmp(key, "oom_kill") == 0) {
+            result = value;
+            break;
+        }
+    }
+    fclose(file);
+    return result;
+}
+
+static long elapsed_ms(const struct timespec *start)
+{
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (now.tv_sec - start->tv_sec) * 1000 + (now.tv_nsec - start->tv_nsec) / 1000000;
+}
+
+static void redirect(const char *path, int fd, int flags)
+{
+    int file = open(path, flags, 0644);
+    if (file < 0 || dup2(file, fd) < 0)
+        _exit(127);
+    if (file != fd)
+        close(file);
+}
+
+static void child(long cpu_ms, long fsize, int cpu,
+                  const char *in, const char *out, const char *err, const char *command)
+{
+    struct rlimit limit;
+    cpu_set_t cpus;
+    char *shell_command;
+    sigset_t mask;
+    int file;
+
+    setpgid(0, 0);
+    sigemptyset(&mask);
+    sigprocmask(SIG_SETMASK, &mask, NULL);
+
+    if (cpu >= 0) {
+        CPU_ZERO(&cpus);
+        CPU_SET(cpu, &cpus);
+        sched_setaffinity(0, sizeof(cpus), &cpus);
+    }
+
+    /* the program, not the supervisor, has to be the victim of the cgroup oom killer */
+    file = open("/proc/self/oom_score_adj", O_WRONLY);
+    if (file >= 0) {
+        if (write(file, "1000", 4) < 0) {
+            /* not fatal */
+        }
+        close(file);
+    }
+
+    redirect(in, STDIN_FILENO, O_RDONLY);
+    redirect(out, STDOUT_FILENO, O_WRONLY | O_CREAT | O_TRUNC);
+    redirect(err, STDERR_FILENO, O_WRONLY | O_CREAT | O_TRUNC);
+
+    limit.rlim_cur = (cpu_ms + 999) / 1000;
+    limit.rlim_max = limit.rlim_cur + 1;
+    setrlimit(RLIMIT_CPU, &limit);
+    limit.rlim_cur = limit.rlim_max = fsize;
+    setrlimit(RLIMIT_FSIZE, &limit);
+    limit.rlim_cur = limit.rlim_max = 0;
+    setrlimit(RLIMIT_CORE, &limit);
+
+    if (asprintf(&shell_command, "exec %s", command) < 0)
+        _exit(127);
+    execl("/bin/sh", "sh", "-c", shell_command, (char *) NULL);
+    _exit(127);
+}
+
+static void run(char *line)
+{
+    char *fields[9];
+    char *rest = line;
+    long cpu_ms, real_ms, memory, fsize, before, after, wall;
+    int i, cpu, status = 0, timeout = 0, oom = 0, exit_code;
+    struct rusage usage;
+    struct timespec start, wait_for;
+    sigset_t chld;
+    pid_t pid;
+
+    for (i = 0; i < 8; i++)
+        fields[i] = strsep(&rest, "\t");
+    fields[8] = rest;
+    if (!fields[8]) {
+        printf("-1\t0\t0\t0\t0\t0\n");
+        fflush(stdout);
+        return;
+    }
+    cpu_ms = atol(fields[0]);
+    real_ms = atol(fields[1]);
+    memory = atol(fields[2]);
+    fsize = atol(fields[3]);
+    cpu = atoi(fields[4]);
+
+    sigemptyset(&chld);
+    sigaddset(&chld, SIGCHLD);
+
+    before = oom_kills();
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    pid = fork();
+    if (pid < 0) {
+        printf("-1\t0\t0\t0\t0\t0\n");
+        fflush(stdout);
+        return;
+    }
+    if (pid == 0)
+        child(cpu_ms, fsize, cpu, fields[5], fields[6], fields[7], fields[8]);
+
+    memset(&usage, 0, sizeof(usage));
+    for (;;) {
+        pid_t done = wait4(pid, &status, WNOHANG, &usage);
+        if (done == pid)
+            break;
+        if (done < 0 && errno != EINTR)
+            break;
+        wall = elapsed_ms(&start);
+        if (wall >= real_ms) {
+            timeout = 1;
+            kill(-pid, SIGKILL);
+            kill(pid, SIGKILL);
+            while (wait4(pid, &status, 0, &usage) < 0 && errno == EINTR)
+                ;
+            break;
+        }
+        wait_for.tv_sec = (real_ms - wall) / 1000;
+        wait_for.tv_nsec = ((real_ms - wall) % 1000) * 1000000;
+        sigtimedwait(&chld, NULL, &wait_for);
+    }
+    wall = elapsed_ms(&start);
+    /* leftovers of the program's process group must not outlive the test case */
+    kill(-pid, SIGKILL);
+
+    cpu_ms = usage.ru_utime.tv_sec * 1000 + usage.ru_utime.tv_usec / 1000 +
+             usage.ru_stime.tv_sec * 1000 + usage.ru_stime.tv_usec / 1000;
+
+    if (WIFSIGNALED(status))
+        exit_code = 128 + WTERMSIG(status);
+    else
+        exit_code = WEXITSTATUS(status);
+
+    after = oom_kills();
+    if (!timeout && exit_code == 128 + SIGKILL) {
+        if (before >= 0 && after >= 0)
+            oom = after > before;
+        else
+            oom = usage.ru_maxrss >= memory / 1024 * 9 / 10;
+    }
+
+    if (!oom && (exit_code == 128 + SIGKILL || exit_code == 128 + SIGXCPU))
+        timeout = 1;
+
+    printf("%d\t%ld\t%ld\t%ld\t%d\t%d\n", exit_code, wall, cpu_ms, usage.ru_maxrss, timeout, oom);
+    fflush(stdout);
+}
+
+int main(void)
+{
+    char *line = NULL;
+    size_t size = 0;
+    ssize_t length;
+    sigset_t chld;
+
+    /* SIGCHLD stays blocked so that sigtimedwait can wait for it */
+    sigemptyset(&chld);
+    sigaddset(&chld, SIGCHLD);
+    sigprocmask(SIG_BLOCK, &chld, NULL);
+
+    while ((length = getline(&line, &size, stdin)) > 0) {
+        if (line[length - 1] == '\n')
+            line[--length] = '\0';
+        if (length == 0)
+            break;
+        run(line);
+    }
+    free(line);
+    return 0;
+}
@@ -1,67 +1,113 @@
 # -*- coding: utf-8 -*-
+
+# precompiled standard library bundles built into the image (docker/build-pch.sh): g++ reads
+# <bits/stdc++.h> from here only with the exact flags of the image's CXX_PCH_FLAGS, otherwise the header itself
+PCH_DIR = '/usr/local/include/crazybox-pch'
+
 LANG = {
     "C": {
+        'family': 'native',
         'suffix': '.c',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 128 * 1024 * 1024,  # 128M
         'compile_command': '/usr/bin/gcc -DONLINE_JUDGE -O2 -w -fmax-errors=3 -std=c99 {src_path} -lm -o {exe_path}',
         'run_command': '{exe_path}',
+        # compiled outputs kept by the compile cache
+        'artifacts': ['{exe_path}'],
+        # program doing nothing, its run time is the startup baseline of the language
+        'empty_program': 'int main() { return 0; }\n',
     },
 
     "C++": {
+        'family': 'native',
         'suffix': '.cpp',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 256 * 1024 * 1024,  # 256M
-        'compile_command': '/usr/bin/g++ -DONLINE_JUDGE -O2 -w -fmax-errors=3 -std=c++11 {src_path} -lm -o {exe_path}',
+        # the flags before -I must stay equal to CXX_PCH_FLAGS of docker/Dockerfile
+        'compile_command': '/usr/bin/g++ -DONLINE_JUDGE -O2 -w -fmax-errors=3 -std=c++11 -I' + PCH_DIR +
+                           ' {src_path} -lm -o {exe_path}',
         'run_command': '{exe_path}',
+        # compiled outputs kept by the compile cache
+        'artifacts': ['{exe_path}'],
+        'empty_program': 'int main() { return 0; }\n',
     },
 
     "Java": {
+        'family': 'jvm',
         #  TODO test java memory
         'suffix': '.java',
         "compile_max_cpu_time": 5000,
         "compile_max_memory": 512 * 1024 * 1024,  # 512M
-        "compile_command": "/usr/bin/javac {src_path} -d {exe_path} -encoding UTF8",
-        "run_command": "/usr/bin/java -cp {exe_path} -Xss1M "
+        "compile_command": "/usr/local/bin/crazybox-javac {src_path} -d {exe_path} -encoding UTF8",
+        # warm javac daemon (docker/JavacServer.java) in a compile sandbox of its own (utils.CompileServer),
+        # crazybox-javac above falls back to the plain javac where it is not running
+        'compile_server': {
+            'command': '/usr/bin/java -Xshare:auto -XX:+UseSerialGC -Xmx384M -cp /usr/local/lib/crazybox '
+                       'JavacServer 17000',
+            'memory': 768 * 1024 * 1024,  # 768M, the daemon and the compile
+        },
+        # -Xshare:auto maps the JDK classes from the class data sharing archive of the image (docker/build-cds.sh),
+        # which is only used with the serial collector on JDK 8
+        "run_command": "/usr/bin/java -cp {exe_path} -Xshare:auto -XX:+UseSerialGC -Xss1M "
                        "-Xms16M -Xmx{max_memory} -Djava.security.manager "
                        "-Djava.security.policy==policy -Djava.awt.headless=true Main",
+        # compiled outputs kept by the compile cache
+        'artifacts': ['{exe_path}'],
+        'empty_program': 'class Main { public static void main(String[] args) { } }\n',
     },
 
     "Python": {
+        'family': 'script',
         'suffix': '.py',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 256 * 1024 * 1024,  # 256M
         "compile_command": "/usr/bin/python -m py_compile {src_path}",
         "run_command": '/usr/bin/python {exe_path}',
 
-        'exe_suffix': '.py'
+        'exe_suffix': '.py',
+        # compiled outputs kept by the compile cache
+        # python never loads a cached .pyc of the main script, a cache hit only skips the syntax check
+        'artifacts': [],
+        'empty_program': 'pass\n',
     },
 
     "Python3": {
+        'family': 'script',
         'suffix': '.py3',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 256 * 1024 * 1024,  # 256M
         "compile_command": "/usr/bin/python3 -m py_compile {src_path}",
         "run_command": '/usr/bin/python3 {exe_path}',
 
-        'exe_suffix': '.py3'
+        'exe_suffix': '.py3',
+        # compiled outputs kept by the compile cache
+        'artifacts': [],  # as for Python, a cache hit only skips the syntax check
+        'empty_program': 'pass\n',
     },
 
     "Go": {
+        'family': 'native',
         'suffix': '.go',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 256 * 1024 * 1024,  # 256M
         "compile_command": "/usr/bin/go build {src_path}",
         'run_command': '.{exe_path}',
+        # compiled outputs kept by the compile cache
+        'artifacts': ['{exe_path}'],
+        'empty_program': 'package main\n\nfunc main() {\n}\n',
     },
 
     "Ruby": {
+        'family': 'script',
         'suffix': '.rb',
         "compile_max_cpu_time": 5000,  # 5s
         "compile_max_memory": 256 * 1024 * 1024,  # 256M
         "compile_command": "/usr/bin/ruby -c {src_path}",
         'run_command': '/usr/bin/ruby {exe_path}',
 
-        'exe_suffix': '.rb'
+        'exe_suffix': '.rb',
+        # compiled outputs kept by the compile cache
+        'artifacts': [],  # only a syntax check, a cache hit skips it
+        'empty_program': 'nil\n',
     },
 }
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import time
+import functools
+import threading
+
+from contextlib import contextmanager
+
+# upper bounds of the latency histogram buckets, s
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PHASE_HISTOGRAM = 'crazybox_phase_seconds'
+
+# name -> help text of the counters
+COUNTERS = {
+    'crazybox_judgements_total': 'Finished judgements by status.',
+    'crazybox_cache_requests_total': 'Lookups of the compile cache, test data manifests and test case indexes.',
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                           .replace('\n', '\\n'))
+                          for name, value in labels) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+    """
+    Judge metrics of the current process: a latency histogram per judging phase and counters.
+
+    A judge worker ``drain``s its metrics to the scheduler after every job, which ``merge``s them
+    into the metrics of the server process; ``render`` writes them in the Prometheus text format.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.phases = {}  # phase -> {'buckets': [count per bucket], 'sum': s, 'count': n}
+        self.counters = {}  # (name, ((label, value), ...)) -> value
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    @contextmanager
+    def timer(self, phase):
+        """record the time spent in the with block as one observation of the phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def timed(self, phase):
+        """decorator recording every call of the function as one observation of the phase"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(phase):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def drain(self):
+        """:return: the metrics recorded since the last drain, they are reset"""
+        with self.lock:
+            data = {'phases': self.phases, 'counters': list(self.counters.items())}
+            self.phases = {}
+            self.counters = {}
+        return data
+
+    def merge(self, data):
+        with self.lock:
+            for phase, other in data['phases'].items():
+                histogram = self.phases.get(phase)
+                if histogram is None:
+                    histogram = self.phases[phase] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+                histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], other['buckets'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+            for key, value in data['counters']:
+                key = (key[0], tuple(tuple(label) for label in key[1]))
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self, gauges=()):
+        """
+        :param gauges: [(name, help, value)] of current values added to the output
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self.lock:
+            lines.append('# HELP {} Time spent in each judging phase.'.format(PHASE_HISTOGRAM))
+            lines.append('# TYPE {} histogram'.format(PHASE_HISTOGRAM))
+            for phase, histogram in sorted(self.phases.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        PHASE_HISTOGRAM, format_labels((('phase', phase), ('le', format_value(float(bound))))),
+                        cumulative))
+                lines.append('{}_bucket{} {}'.format(
+                    PHASE_HISTOGRAM, format_labels((('phase', phase), ('le', '+Inf'))), histogram['count']))
+                lines.append('{}_sum{} {}'.format(PHASE_HISTOGRAM, format_labels((('phase', phase),)),
+                                                  format_value(histogram['sum'])))
+                lines.append('{}_count{} {}'.format(PHASE_HISTOGRAM, format_labels((('phase', phase),)),
+                                                    histogram['count']))
+            for name, help_text in sorted(COUNTERS.items()):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} counter'.format(name))
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+        for name, help_text, value in gauges:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} gauge'.format(name))
+            lines.append('{} {}'.format(name, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+
+from concurrent.futures import ThreadPoolExecutor
+
+from logzero import logger
+from docker.errors import DockerException, NotFound, APIError
+from requests.exceptions import RequestException
+
+from config import MONITOR_THREADS, MONITOR_KILL_GRACE
+from exceptions import DockerError
+from clients import docker_clients
+
+
+class ContainerMonitor(object):
+    """
+    Supervise running containers from one asyncio loop in a background thread.
+
+    Exits and oom kills are learned from a single docker events stream, wall time limits are
+    timers of the loop and the container is killed the moment its limit passes. While a program
+    runs no thread or docker API connection is held for it, so one judge process can supervise
+    hundreds of containers; blocking docker calls (start, kill, inspect) go to a small thread pool.
+    The loop is started on first use in every process, a forked judge worker gets its own.
+    """
+
+    EVENTS = {'type': 'container', 'event': ['die', 'oom']}
+
+    def __init__(self, threads=MONITOR_THREADS, kill_grace=MONITOR_KILL_GRACE):
+        self.threads = threads
+        self.kill_grace = kill_grace
+        self.lock = threading.Lock()
+        self.pid = None
+        self.loop = None
+        self.ready = None
+        self.executor = None
+        self.watches = {}  # container id -> state of the run, only touched on the loop
+
+    def start(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.ready = threading.Event()
+                self.executor = ThreadPoolExecutor(max_workers=self.threads)
+                self.watches = {}
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name='crazybox-monitor', daemon=True).start()
+                threading.Thread(target=self.follow_events, name='crazybox-monitor-events', daemon=True).start()
+        # 容器必须在订阅事件之后启动，否则可能错过它的die事件
+        if not self.ready.wait(timeout=10):
+            raise DockerError('failed to subscribe to docker events')
+
+    def follow_events(self):
+        while True:
+            try:
+                # 事件流长期占用一个连接，不使用共享的连接池
+                events = docker_clients.new_api().events(filters=self.EVENTS, decode=True)
+                self.ready.set()
+                # 重新连接期间退出的容器没有事件，逐个检查
+                self.loop.call_soon_threadsafe(self.reconcile)
+                for event in events:
+                    self.loop.call_soon_threadsafe(self.on_event, event)
+                logger.warning('docker events stream ended, reconnecting')
+            except (RequestException, DockerException, OSError):
+                logger.exception('docker events stream failed, reconnecting')
+            time.sleep(1)
+
+    def run(self, container_id, start, real_time):
+        """
+        Start a container and block until it exits or is killed at the real time limit.
+
+        :param start: callable starting the container, called once the container is watched
+        :param real_time: wall time limit, s
+        :return: {'exit_code': int, 'timeout': bool, 'oom_killed': bool}
+        """
+        self.start()
+        future = asyncio.run_coroutine_threadsafe(self.wait(container_id, start, real_time), self.loop)
+        try:
+            return future.result(timeout=real_time + self.kill_grace * 3)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise DockerError('container %s was not seen exiting' % container_id)
+
+    async def wait(self, container_id, start, real_time):
+        """the coroutine behind ``run`` for callers on the loop"""
+        loop = asyncio.get_event_loop()
+        watch = {'future': loop.create_future(), 'started': False, 'timeout': False, 'oom_killed': False,
+                 'timer': None}
+        self.watches[container_id] = watch
+        try:
+            await loop.run_in_executor(self.executor, start)
+            watch['started'] = True
+            if not watch['future'].done():
+                watch['timer'] = loop.call_later(real_time, self.expire, container_id)
+            return await watch['future']
+        finally:
+            if watch['timer']:
+                watch['timer'].cancel()
+            self.watches.pop(container_id, None)
+
+    def on_event(self, event):
+        watch = self.watches.get(event.get('id'))
+        if watch is None:
+            return
+        action = event.get('Action') or event.get('status')
+        if action == 'oom':
+            watch['oom_killed'] = True
+        elif action == 'die':
+            exit_code = event.get('Actor', {}).get('Attributes', {}).get('exitCode')
+            self.resolve(event['id'], int(exit_code) if exit_code is not None else None)
+
+    def resolve(self, container_id, exit_code, oom_killed=False):
+        watch = self.watches.get(container_id)
+        if watch is None or watch['future'].done():
+            return
+        watch['future'].set_result({'exit_code': exit_code, 'timeout': watch['timeout'],
+                                    'oom_killed': watch['oom_killed'] or oom_killed})
+
+    def expire(self, container_id, attempt=0):
+        watch = self.watches.get(container_id)
+        if watch is None:
+            return
+        watch['timeout'] = True
+        if attempt:
+            # 没有收到die事件(例如事件流断开)，直接检查容器状态，仍在运行就再杀一次
+            self.check(container_id)
+        self.loop.run_in_executor(self.executor, self.kill, container_id)
+        watch['timer'] = self.loop.call_later(self.kill_grace, self.expire, container_id, attempt + 1)
+
+    def kill(self, container_id):
+        try:
+            docker_clients.api.kill(container_id)
+        except NotFound:
+            pass
+        except APIError as ex:
+            # 409: the container is not running any more
+            if ex.response is None or ex.response.status_code != 409:
+                logger.exception('Failed to kill container %s', container_id)
+        except (RequestException, DockerException):
+            logger.exception('Failed to kill container %s', container_id)
+
+    def inspect(self, container_id):
+        try:
+            return docker_clients.api.inspect_container(container_id)['State']
+        except NotFound:
+            return {'Running': False, 'ExitCode': None, 'OOMKilled': False}
+        except (RequestException, DockerException):
+            logger.exception('Failed to inspect container %s', container_id)
+            return None
+
+    def check(self, container_id):
+        """resolve the run from the container state if it already exited"""
+        async def check():
+            state = await self.loop.run_in_executor(self.executor, self.inspect, container_id)
+            if state and not state['Running']:
+                self.resolve(container_id, state['ExitCode'], state.get('OOMKilled', False))
+        self.loop.create_task(check())
+
+    def reconcile(self):
+        for container_id, watch in list(self.watches.items()):
+            if watch['started']:
+                self.check(container_id)
+
+
+monitor = ContainerMonitor()
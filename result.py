@@ -18,6 +18,9 @@ Queueing = 18
 
 JF = 20  # judgement failed
 
+STATUS_NAMES = {AC: 'AC', WA: 'WA', PE: 'PE', MLE: 'MLE', TLE: 'TLE', OLE: 'OLE', RE: 'RE', CE: 'CE',
+                Running: 'Running', Compiling: 'Compiling', Queueing: 'Queueing', JF: 'JF'}
+
 CODE2RESULT = {
 
     # _ok = 0,
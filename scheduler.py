@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import uuid
+import queue
+import threading
+import requests
+import multiprocessing
+
+from collections import OrderedDict
+
+from logzero import logger
+
+from config import JUDGE_WORKERS, SUBMISSION_HISTORY, CALLBACK_TIMEOUT
+from exceptions import CrazyBoxError, DockerError
+from result import Queueing, Running, JF, STATUS_NAMES
+from metrics import metrics
+
+# 提交状态
+QUEUEING = 'queueing'
+RUNNING = 'running'
+FINISHED = 'finished'
+
+
+def run_judge(job):
+    """
+    judge one job in the current process.
+
+    :return: the response of the judge api: {'code': 0, 'result': judge result} or an error
+    """
+    from crazybox import judge
+
+    try:
+        if not os.path.isdir(job['test_case_dir']):
+            raise CrazyBoxError('directory %s not found.' % job['test_case_dir'])
+        with metrics.timer('judge'):
+            result = judge(job['src_code'], job['language'], job['test_case_dir'],
+                           job['time_limit'], job['memory_limit'], job['file_size_limit'], job['check_method'],
+                           job['parallel'])
+        return {'code': 0, 'result': result}
+    except (CrazyBoxError, DockerError) as e:
+        logger.exception(e)
+        ret = dict()
+        ret["err"] = e.__class__.__name__
+        ret["data"] = str(e)
+        return {'code': 1, 'result': ret}
+    except Exception as e:
+        logger.exception(e)
+        ret = dict()
+        ret["err"] = "JudgeClientError"
+        ret["data"] = e.__class__.__name__ + ":" + str(e)
+        return {'code': 2, 'result': ret}
+
+
+def worker_main(index, cpus, jobs, events):
+    """entry of a judge worker process: judge jobs one by one and report through events"""
+    from utils import cpu_set, workspace
+    # 各个worker进程使用互不重叠的CPU和各自的工作目录
+    cpu_set.assign(cpus)
+    workspace.assign(index)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        events.put(('start', index, job['submission_id'], time.time()))
+        response = run_judge(job)
+        events.put(('done', index, job['submission_id'], response))
+        # 评测阶段的耗时在worker进程中记录，汇总到服务进程的/metrics
+        events.put(('metrics', index, None, metrics.drain()))
+
+
+class Scheduler(object):
+    """
+    Queue judge jobs and run them on JUDGE_WORKERS worker processes.
+
+    Submissions are identified by their submission id; their state and result are kept for
+    the last SUBMISSION_HISTORY submissions and optionally posted to a callback url.
+    """
+
+    def __init__(self, worker_count=JUDGE_WORKERS, history=SUBMISSION_HISTORY):
+        self.worker_count = worker_count
+        self.history = history
+        self.jobs = multiprocessing.Queue()
+        self.events = multiprocessing.Queue()
+        self.submissions = OrderedDict()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        self.started = False
+        self.stopping = False
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            for index in range(self.worker_count):
+                self.workers.append({'process': None, 'state': 'idle', 'submission_id': None, 'since': time.time()})
+                self.spawn(index)
+        threading.Thread(target=self.collect, name='crazybox-scheduler', daemon=True).start()
+
+    def spawn(self, index):
+        from utils import cpu_set
+        cpus = cpu_set.cpus[index::self.worker_count] or cpu_set.cpus
+        process = multiprocessing.Process(target=worker_main, name='crazybox-worker-%d' % index,
+                                          args=(index, cpus, self.jobs, self.events), daemon=True)
+        process.start()
+        self.workers[index].update(process=process, state='idle', submission_id=None, since=time.time())
+        logger.info('judge worker %s started: pid %s', index, process.pid)
+
+    def submit(self, job, callback_url=None):
+        """
+        :param job: arguments of run_judge, submission_id is generated if it is missing
+        :return: submission id
+        """
+        if not self.started:
+            self.start()
+        submission_id = str(job.get('submission_id') or uuid.uuid4())
+        job['submission_id'] = submission_id
+        with self.lock:
+            self.submissions.pop(submission_id, None)
+            self.submissions[submission_id] = {'state': QUEUEING, 'status': Queueing, 'worker': None,
+                                               'queued_at': time.time(), 'started_at': None,
+                                               'finished_at': None, 'response': None,
+                                               'callback_url': callback_url}
+            while len(self.submissions) > self.history:
+                self.submissions.popitem(last=False)
+        self.dispatch(job)
+        return submission_id
+
+    def dispatch(self, job):
+        """hand a submitted job over to the worker processes"""
+        self.jobs.put(job)
+
+    def status(self, submission_id):
+        with self.lock:
+            submission = self.submissions.get(str(submission_id))
+            if submission is None:
+                return None
+            submission = dict(submission)
+        submission.pop('callback_url')
+        submission['submission_id'] = str(submission_id)
+        return submission
+
+    def wait(self, submission_id, timeout=None):
+        """block until the submission is finished, return its status"""
+        def done():
+            submission = self.submissions.get(submission_id)
+            return submission is None or submission['state'] == FINISHED
+
+        with self.finished:
+            self.finished.wait_for(done, timeout=timeout)
+        return self.status(submission_id)
+
+    def stats(self):
+        with self.lock:
+            states = [submission['state'] for submission in self.submissions.values()]
+            workers = [{'pid': worker['process'].pid if worker['process'] else None,
+                        'alive': bool(worker['process'] and worker['process'].is_alive()),
+                        'state': worker['state'],
+                        'submission_id': worker['submission_id'],
+                        'since': worker['since']}
+                       for worker in self.workers]
+        return {'queue_depth': states.count(QUEUEING),
+                'running': states.count(RUNNING),
+                'workers': workers}
+
+    def collect(self):
+        """apply events of the workers and restart dead workers"""
+        while True:
+            try:
+                event = self.events.get(timeout=1)
+            except queue.Empty:
+                event = None
+            if event:
+                self.apply(*event)
+            self.check_workers()
+
+    def apply(self, kind, index, submission_id, data):
+        if kind == 'metrics':
+            metrics.merge(data)
+            return
+        callback = None
+        with self.lock:
+            worker = self.workers[index]
+            submission = self.submissions.get(submission_id)
+            if kind == 'start':
+                worker.update(state='running', submission_id=submission_id, since=data)
+                if submission:
+                    submission.update(state=RUNNING, status=Running, worker=index, started_at=data)
+                    metrics.observe('queue', data - submission['queued_at'])
+            else:
+                worker.update(state='idle', submission_id=None, since=time.time())
+                if submission:
+                    self.finish(submission, data)
+                    callback = submission['callback_url'], submission_id, data
+            self.finished.notify_all()
+        if callback and callback[0]:
+            threading.Thread(target=self.post_callback, args=callback, daemon=True).start()
+
+    @staticmethod
+    def finish(submission, response):
+        submission.update(state=FINISHED, finished_at=time.time(), response=response)
+        if response['code'] == 0:
+            submission['status'] = response['result']['status']
+        else:
+            submission['status'] = JF
+        metrics.count('crazybox_judgements_total', status=STATUS_NAMES.get(submission['status'],
+                                                                            submission['status']))
+
+    def check_workers(self):
+        callbacks = []
+        with self.lock:
+            if self.stopping:
+                return
+            for index, worker in enumerate(self.workers):
+                if worker['process'].is_alive():
+                    continue
+                logger.error('judge worker %s died with exit code %s', index, worker['process'].exitcode)
+                submission = self.submissions.get(worker['submission_id'])
+                if submission and submission['state'] == RUNNING:
+                    response = {'code': 2, 'result': {'err': 'JudgeClientError',
+                                                      'data': 'judge worker died while judging'}}
+                    self.finish(submission, response)
+                    callbacks.append((submission['callback_url'], worker['submission_id'], response))
+                self.spawn(index)
+            if callbacks:
+                self.finished.notify_all()
+        for callback in callbacks:
+            if callback[0]:
+                threading.Thread(target=self.post_callback, args=callback, daemon=True).start()
+
+    @staticmethod
+    def post_callback(url, submission_id, response):
+        try:
+            requests.post(url, json={'submission_id': submission_id, 'response': response},
+                          timeout=CALLBACK_TIMEOUT)
+        except requests.RequestException as e:
+            logger.warning('callback of submission %s to %s failed: %s', submission_id, url, e)
+
+    def shutdown(self):
+        with self.lock:
+            self.stopping = True
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker['process'].join(timeout=5)
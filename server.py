@@ -1,29 +1,34 @@
 # coding=utf-8
 import socket
 import psutil
-import shutil
+import json
 import os
 
-from flask import Flask, jsonify, make_response, request
-from flask_restful import Api, Resource, reqparse
+from flask import Flask, Response, jsonify, make_response, request
+from flask_restful import Api, Resource, reqparse, inputs
 from flask_httpauth import HTTPTokenAuth
 
 from werkzeug.datastructures import FileStorage
 
-from zipfile import ZipFile
+from zipfile import BadZipFile
 
 from languages import LANG
 from checker import method_choice
-from config import JUDGE_TOKEN, TEST_DATA_DIR
+from config import JUDGE_TOKEN, TEST_DATA_DIR, SERVER_MODE
 from utils import get_dir_hash
+from testdata import snapshots, diff
 from exceptions import DockerError, CrazyBoxError
-from crazybox import judge
+from scheduler import Scheduler
+from cluster import Coordinator
+from metrics import metrics, CONTENT_TYPE
 
 from logzero import logger
 
 app = Flask(__name__)
 api = Api(app)
 auth = HTTPTokenAuth(scheme='Token')
+# 协调模式下提交分发到集群中的评测节点
+scheduler = Coordinator() if SERVER_MODE == 'coordinator' else Scheduler()
 
 
 @auth.verify_token
@@ -47,6 +52,7 @@ class PingAPI(Resource):
                 "cpu_percent": psutil.cpu_percent(),
                 "cpu_core": psutil.cpu_count(),
                 "memory_percent": psutil.virtual_memory().percent,
+                "judge": scheduler.stats(),
                 }
         ip = request.remote_addr
         info['more'] = self.flag
@@ -75,31 +81,46 @@ class SyncAPI(Resource):
     def __init__(self):
         self.reqparse = reqparse.RequestParser()
         self.reqparse.add_argument('test_case_id', type=str, required=True)
-        self.reqparse.add_argument('zipfile', type=FileStorage, location='files', required=True)
+        self.reqparse.add_argument('zipfile', type=FileStorage, location='files', default=None)
+        # full: the zip is the whole test data, delta: the zip only has the new or changed files
+        self.reqparse.add_argument('mode', type=str, default='full', choices=('full', 'delta'))
+        # json list of the files to remove, only for a delta sync
+        self.reqparse.add_argument('delete', type=str, default='[]')
 
     def post(self):
         args = self.reqparse.parse_args()
-        test_case_id = args['test_case_id']
+        test_case_id = str(args['test_case_id'])
         s_file = args['zipfile']
+        if s_file is None and args['mode'] == 'full':
+            return {'code': 1, 'result': {'err': CrazyBoxError.__name__, 'data': 'zipfile is required.'}}
 
-        aim = os.path.join(TEST_DATA_DIR, str(test_case_id))
-        if os.path.exists(aim):
-            shutil.rmtree(aim, ignore_errors=True)
+        try:
+            delete = json.loads(args['delete'])
+            # the upload is already spooled to a temporary file by werkzeug, read the zip from there
+            snapshots.sync(test_case_id, s_file.stream if s_file else None, delete, args['mode'] == 'delta')
+        except (ValueError, BadZipFile, CrazyBoxError) as e:
+            logger.exception(e)
+            return {'code': 1, 'result': {'err': e.__class__.__name__, 'data': str(e)}}
+        return "Done!"
 
-        os.mkdir(aim)
-        os.chmod(aim, 0o777)
 
-        path = os.path.join('/tmp', s_file.filename)
-        s_file.save(path)
+class SyncDiffAPI(Resource):
+    decorators = [auth.login_required]
 
-        zipfile = ZipFile(path)
-        for sub_file in zipfile.namelist():
-            zipfile.extract(sub_file, aim)
-            os.chmod(os.path.join(aim, sub_file), 0o777)
-        zipfile.close()
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('test_case_id', type=str, required=True)
+        # json object: relative path -> sha256 of every file of the test data on the backend
+        self.reqparse.add_argument('manifest', type=str, required=True)
 
-        os.remove(path)
-        return "Done!"
+    def post(self):
+        args = self.reqparse.parse_args()
+        try:
+            remote = json.loads(args['manifest'])
+        except ValueError as e:
+            return {'code': 1, 'result': {'err': e.__class__.__name__, 'data': str(e)}}
+        path = os.path.join(TEST_DATA_DIR, str(args['test_case_id']))
+        return {'code': 0, 'data': diff(path, remote)}
 
 
 # def judge(src_code, language, test_data_dir,
@@ -117,8 +138,12 @@ class JudgeAPI(Resource):
         # MB
         self.reqparse.add_argument('memory_limit', type=int, required=True, help='unit with MB.')
 
-        # TODO: sync with status
-        # self.reqparse.add_argument('submission_id', type=int, required=True)
+        self.reqparse.add_argument('submission_id', type=str, default=None,
+                                   help='generated if not given.')
+        self.reqparse.add_argument('callback_url', type=str, default=None,
+                                   help='the result is posted to it when finished.')
+        self.reqparse.add_argument('sync', type=inputs.boolean, default=False,
+                                   help='wait for the result instead of returning the submission id.')
 
         self.reqparse.add_argument('language', type=str, required=True,
                                    choices=LANG.keys(),
@@ -126,42 +151,117 @@ class JudgeAPI(Resource):
 
         self.reqparse.add_argument('file_size_limit', type=int, default=10 * 1024 * 1024, help='unit with Byte.')
         self.reqparse.add_argument('check_method', type=str, default='line', choices=method_choice)
+        self.reqparse.add_argument('parallel', type=int, default=None,
+                                   help='number of test cases run at the same time.')
 
     def post(self):
-        try:
-            args = self.reqparse.parse_args()
-            src_code = args['src_code']
-            test_case_id = args['test_case_id']
-            time_limit = args['time_limit']
-            memory_limit = args['memory_limit']
-            language = args['language']
-            file_size_limit = args['file_size_limit']
-            check_method = args['check_method']
-            test_case_dir = os.path.join(TEST_DATA_DIR, test_case_id)
-            if not os.path.isdir(test_case_dir):
-                raise CrazyBoxError('directory %s not found.' % test_case_dir)
-
-            result = judge(src_code, language, test_case_dir, time_limit, memory_limit, file_size_limit, check_method)
-            return {'code': 0, 'result': result}
-        except (CrazyBoxError, DockerError) as e:
-            logger.exception(e)
-            ret = dict()
-            ret["err"] = e.__class__.__name__
-            ret["data"] = str(e)
-            return {'code': 1, 'result': ret}
-        except Exception as e:
-            logger.exception(e)
-            ret = dict()
-            ret["err"] = "JudgeClientError"
-            ret["data"] = e.__class__.__name__ + ":" + str(e)
-            return {'code': 2, 'result': ret}
+        args = self.reqparse.parse_args()
+        test_case_dir = os.path.join(TEST_DATA_DIR, args['test_case_id'])
+        if not os.path.isdir(test_case_dir):
+            return {'code': 1, 'result': {'err': CrazyBoxError.__name__,
+                                          'data': 'directory %s not found.' % test_case_dir}}
+
+        job = {'submission_id': args['submission_id'],
+               'src_code': args['src_code'],
+               'test_case_id': args['test_case_id'],
+               'language': args['language'],
+               'test_case_dir': test_case_dir,
+               'time_limit': args['time_limit'],
+               'memory_limit': args['memory_limit'],
+               'file_size_limit': args['file_size_limit'],
+               'check_method': args['check_method'],
+               'parallel': args['parallel']}
+        submission_id = scheduler.submit(job, args['callback_url'])
+        if args['sync']:
+            status = scheduler.wait(submission_id)
+            # 等待期间提交可能已经被挤出历史记录
+            if status is None or status['response'] is None:
+                return {'code': 1, 'result': {'err': 'NotFound',
+                                              'data': 'submission %s left the history before it finished.'
+                                                      % submission_id}}
+            return status['response']
+        return {'code': 0, 'submission_id': submission_id}
+
+
+class StatusAPI(Resource):
+    decorators = [auth.login_required]
+
+    def get(self, submission_id):
+        status = scheduler.status(submission_id)
+        if status is None:
+            return {'code': 1, 'result': {'err': 'NotFound', 'data': 'submission %s not found.' % submission_id}}
+        return {'code': 0, 'data': status}
+
+
+class NodeAPI(Resource):
+    """judge nodes of a coordinator"""
+    decorators = [auth.login_required]
+
+    def __init__(self):
+        self.reqparse = reqparse.RequestParser()
+        self.reqparse.add_argument('url', type=str, required=True, help='base url of the judge node.')
+        self.reqparse.add_argument('token', type=str, default=JUDGE_TOKEN)
+
+    @staticmethod
+    def not_coordinator():
+        return {'code': 1, 'result': {'err': CrazyBoxError.__name__, 'data': 'not running as a coordinator.'}}
+
+    def get(self):
+        if not isinstance(scheduler, Coordinator):
+            return self.not_coordinator()
+        return {'code': 0, 'data': scheduler.stats()['nodes']}
+
+    def post(self):
+        if not isinstance(scheduler, Coordinator):
+            return self.not_coordinator()
+        args = self.reqparse.parse_args()
+        node = scheduler.register(args['url'], args['token'])
+        return {'code': 0, 'data': {'url': node['url'], 'alive': node['alive'], 'error': node['error']}}
+
+    def delete(self):
+        if not isinstance(scheduler, Coordinator):
+            return self.not_coordinator()
+        args = self.reqparse.parse_args()
+        if not scheduler.unregister(args['url']):
+            return {'code': 1, 'result': {'err': 'NotFound', 'data': 'node %s not found.' % args['url']}}
+        return {'code': 0}
+
+
+@app.route('/metrics')
+@auth.login_required
+def metrics_view():
+    """judge metrics in the Prometheus text format, scraped with the header Authorization: Token <JUDGE_TOKEN>"""
+    stats = scheduler.stats()
+    gauges = [('crazybox_queue_depth', 'Submissions waiting for a judge worker.', stats['queue_depth']),
+              ('crazybox_running_submissions', 'Submissions being judged.', stats['running']),
+              ('crazybox_workers_alive', 'Judge worker processes alive.',
+               sum(worker['alive'] for worker in stats['workers']))]
+    return Response(metrics.render(gauges), content_type=CONTENT_TYPE)
 
 
 api.add_resource(PingAPI, '/ping/', endpoint='ping')
 api.add_resource(TestCaseHashAPI, '/hash/', endpoint='hash')
 api.add_resource(SyncAPI, '/sync/', endpoint='sync')
+api.add_resource(SyncDiffAPI, '/sync/diff/', endpoint='sync_diff')
 
 api.add_resource(JudgeAPI, '/judge/', endpoint='judge')
+api.add_resource(StatusAPI, '/status/<string:submission_id>', endpoint='status')
+api.add_resource(NodeAPI, '/nodes/', endpoint='nodes')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0')
+    import argparse
+
+    parser = argparse.ArgumentParser(description='crazybox judge server')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--mode', choices=('judge', 'coordinator'), default=SERVER_MODE)
+    parser.add_argument('--node', action='append', default=[],
+                        help='base url of a judge node of the coordinator, its token is JUDGE_TOKEN')
+    options = parser.parse_args()
+    if options.mode == 'coordinator' and not isinstance(scheduler, Coordinator):
+        scheduler = Coordinator()
+    elif options.mode == 'judge' and isinstance(scheduler, Coordinator):
+        scheduler = Scheduler()
+    for node_url in options.node:
+        scheduler.register(node_url, JUDGE_TOKEN)
+    scheduler.start()
+    app.run(host='0.0.0.0', port=options.port, threaded=True)
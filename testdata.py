@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+from zipfile import ZipFile
+from collections import OrderedDict
+
+from logzero import logger
+
+from config import MANIFEST_DIR, INDEX_DIR, TEST_DATA_DIR, SNAPSHOT_RETENTION
+from exceptions import CrazyBoxError
+from metrics import metrics
+
+# 修改时间距离扫描时刻太近的文件，下次扫描时仍然重新计算哈希
+RACY_WINDOW = 2 * 10 ** 9  # ns
+
+BLOCK_SIZE = 1024 * 1024
+
+# TEST_DATA_DIR/<test case id> is a relative symlink to SNAPSHOT_DIR/<test case id>/<version>,
+# relative so that it also resolves inside sandboxes mounting TEST_DATA_DIR
+SNAPSHOT_DIR = '.snapshots'
+
+# optional metadata of the test cases next to the test data, e.g.
+# {"cases": {"1": {"time_limit": 2, "group": "small"}, "2": {"group": "large"}},
+#  "groups": {"small": {"score": 40, "policy": "all_or_nothing"}, "large": {"score": 60, "policy": "per_test"}},
+#  "interactor": "interactor.cpp", "checker": "checker.cpp"}
+# interactor: testlib source of the interactor of an interactive problem, relative to the test data
+# checker: testlib source of the custom checker (special judge) of the problem, relative to the test data
+PROBLEM_MANIFEST = 'problem.json'
+
+# scoring policies of the test groups:
+# all_or_nothing: the score of the group if all its cases pass, the rest of the group is skipped after a failure
+# per_test: every case passed gets its share of the score of the group, all cases run
+ALL_OR_NOTHING = 'all_or_nothing'
+PER_TEST = 'per_test'
+GROUP_POLICIES = (ALL_OR_NOTHING, PER_TEST)
+
+# bumped when the content of the index changes, so indexes cached by an older version are rebuilt
+INDEX_FORMAT = 2
+
+
+def file_hash(path):
+    """:return: sha256 hex digest of the file, of empty content if it does not exist"""
+    hasher = hashlib.sha256()
+    if not os.path.exists(path):
+        return hasher.hexdigest()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def reduce_hash(hashes):
+    """the directory hash of checksumdir.dirhash: sha256 of the sorted hashes of the files"""
+    hasher = hashlib.sha256()
+    for value in sorted(hashes):
+        hasher.update(value.encode())
+    return hasher.hexdigest()
+
+
+def walk_files(directory):
+    """:return: {relative path: os.stat_result or None} of the files checksumdir.dirhash hashes"""
+    files = dict()
+    for root, dirs, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            files[os.path.relpath(path, directory)] = stat
+    return files
+
+
+class ManifestStore(object):
+    """
+    Per directory manifests of the test data: size, mtime and sha256 of every file.
+
+    A manifest is kept in memory and persisted in MANIFEST_DIR, outside of the test data so that
+    it does not change the directory hash. A scan only stats the files and rehashes those whose
+    size, mtime or inode changed, the directory hash computed from the manifest equals
+    checksumdir.dirhash(directory, 'sha256').
+    """
+
+    def __init__(self, directory=MANIFEST_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.locks = dict()  # test data directory -> lock of its manifest
+        self.manifests = dict()  # test data directory -> manifest
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, data_dir):
+        name = hashlib.sha256(os.path.abspath(data_dir).encode()).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def dir_lock(self, data_dir):
+        with self.lock:
+            return self.locks.setdefault(os.path.abspath(data_dir), threading.Lock())
+
+    def load(self, data_dir):
+        data_dir = os.path.abspath(data_dir)
+        manifest = self.manifests.get(data_dir)
+        if manifest is not None:
+            return manifest
+        try:
+            with open(self.path(data_dir)) as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            manifest = {'hash': None, 'files': {}}
+        self.manifests[data_dir] = manifest
+        return manifest
+
+    def save(self, data_dir, manifest):
+        data_dir = os.path.abspath(data_dir)
+        self.manifests[data_dir] = manifest
+        path = self.path(data_dir)
+        temp_path = path + '.' + str(uuid.uuid4())
+        try:
+            with open(temp_path, 'w') as file:
+                json.dump(manifest, file)
+            os.rename(temp_path, path)
+        except OSError as e:
+            logger.warning('Failed to save the manifest of %s: %s', data_dir, e)
+
+    def scan(self, data_dir):
+        """
+        bring the manifest of the directory up to date.
+
+        :return: the manifest, {'hash': directory hash, 'files': {relative path: entry}}
+                 entry: {'size', 'mtime', 'inode', 'sha256'}
+        """
+        with self.dir_lock(data_dir):
+            manifest = self.load(data_dir)
+            old_files = manifest['files']
+            files = dict()
+            changed = False
+            now = int(time.time() * 10 ** 9)
+            for name, stat in walk_files(data_dir).items():
+                old = old_files.get(name)
+                if stat is None:
+                    entry = {'size': None, 'mtime': None, 'inode': None, 'sha256': hashlib.sha256().hexdigest()}
+                elif old and old['mtime'] == stat.st_mtime_ns and old['size'] == stat.st_size \
+                        and old['inode'] == stat.st_ino:
+                    entry = old
+                    metrics.count('crazybox_cache_requests_total', cache='manifest', result='hit')
+                else:
+                    metrics.count('crazybox_cache_requests_total', cache='manifest', result='miss')
+                    entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'inode': stat.st_ino,
+                             'sha256': file_hash(os.path.join(data_dir, name))}
+                    if now - stat.st_mtime_ns < RACY_WINDOW:
+                        # the file may still change within the resolution of mtime
+                        entry['mtime'] = None
+                changed = changed or entry is not old
+                files[name] = entry
+            if changed or len(files) != len(old_files) or manifest['hash'] is None:
+                manifest = {'hash': reduce_hash(entry['sha256'] for entry in files.values()), 'files': files}
+                self.save(data_dir, manifest)
+            return manifest
+
+    def dir_hash(self, data_dir):
+        """:return: sha256 directory hash, -1 if the directory does not exist"""
+        if not os.path.isdir(data_dir):
+            return -1
+        return self.scan(data_dir)['hash']
+
+    def invalidate(self, data_dir):
+        """forget the manifest of the directory, its next scan hashes every file"""
+        with self.dir_lock(data_dir):
+            self.manifests.pop(os.path.abspath(data_dir), None)
+            try:
+                os.remove(self.path(data_dir))
+            except OSError:
+                pass
+
+
+manifests = ManifestStore()
+
+
+def diff(data_dir, remote):
+    """
+    :param remote: {relative path: sha256} of the files the test data should consist of
+    :return: {'upload': paths missing or different here, 'delete': paths only here}
+    """
+    local = manifests.scan(data_dir)['files'] if os.path.isdir(data_dir) else {}
+    upload = [name for name, value in remote.items() if name not in local or local[name]['sha256'] != value]
+    delete = [name for name in local if name not in remote]
+    return {'upload': sorted(upload), 'delete': sorted(delete)}
+
+
+def safe_path(root, name):
+    """:return: absolute path of name under root, raise CrazyBoxError if it points outside of root"""
+    path = os.path.normpath(os.path.join(root, name))
+    if os.path.isabs(name) or not path.startswith(os.path.join(root, '')):
+        raise CrazyBoxError('invalid test data path: %s' % name)
+    return path
+
+
+class SnapshotStore(object):
+    """
+    Versioned test data directories.
+
+    A sync writes a new version into a staging directory and then atomically replaces the
+    TEST_DATA_DIR/<test case id> symlink, so a judge holding the resolved path keeps reading
+    one consistent version. A delta sync starts the staging directory as hard links of the
+    current version. Superseded versions are removed, with their cached index and manifest,
+    by a later sync once they were superseded more than SNAPSHOT_RETENTION seconds ago.
+    """
+
+    def __init__(self, data_dir=TEST_DATA_DIR, retention=SNAPSHOT_RETENTION):
+        self.data_dir = data_dir
+        self.retention = retention
+        self.lock = threading.Lock()
+        self.locks = dict()  # test case id -> lock serializing its syncs
+
+    def test_case_lock(self, test_case_id):
+        with self.lock:
+            return self.locks.setdefault(test_case_id, threading.Lock())
+
+    def link_path(self, test_case_id):
+        return safe_path(self.data_dir, test_case_id)
+
+    def versions_dir(self, test_case_id):
+        return safe_path(os.path.join(self.data_dir, SNAPSHOT_DIR), test_case_id)
+
+    def sync(self, test_case_id, archive=None, delete=(), delta=False):
+        """
+        :param archive: file object of a zip with the new or changed files
+        :param delete: relative paths removed from the test data, only for a delta sync
+        :param delta: apply archive and delete to the current version instead of replacing it
+        :return: path of the new version
+        """
+        with self.test_case_lock(test_case_id):
+            link = self.link_path(test_case_id)
+            versions = self.versions_dir(test_case_id)
+            os.makedirs(versions, exist_ok=True)
+            staging = os.path.join(versions, '.staging-' + str(uuid.uuid4()))
+            try:
+                if delta and os.path.isdir(link):
+                    shutil.copytree(os.path.realpath(link), staging, copy_function=os.link)
+                else:
+                    os.mkdir(staging)
+                for name in delete if delta else ():
+                    path = safe_path(staging, name)
+                    if os.path.isfile(path) or os.path.islink(path):
+                        os.remove(path)
+                if archive is not None:
+                    self.extract(archive, staging)
+                version = os.path.join(versions, '%d-%s' % (time.time(), uuid.uuid4().hex[:8]))
+                os.rename(staging, version)
+            except BaseException:
+                shutil.rmtree(staging, ignore_errors=True)
+                raise
+            self.swap(link, version)
+            self.remove_superseded(test_case_id, version)
+        manifests.scan(link)
+        indexes.load(version)
+        return version
+
+    @staticmethod
+    def extract(archive, target):
+        os.chmod(target, 0o777)
+        with ZipFile(archive) as zipfile:
+            for member in zipfile.infolist():
+                path = safe_path(target, member.filename)
+                # 硬链接与当前版本共享inode，必须先删除再写入
+                if os.path.isfile(path) or os.path.islink(path):
+                    os.remove(path)
+                zipfile.extract(member, target)
+                os.chmod(path, 0o777)
+        for root, dirs, _ in os.walk(target):
+            for name in dirs:
+                os.chmod(os.path.join(root, name), 0o777)
+
+    def swap(self, link, version):
+        target = os.path.relpath(version, os.path.dirname(link))
+        if os.path.isdir(link) and not os.path.islink(link):
+            # a directory from before versioned snapshots, becomes a superseded version
+            os.rename(link, os.path.join(os.path.dirname(version), 'legacy-' + uuid.uuid4().hex[:8]))
+        temp_link = os.path.join(os.path.dirname(link), '.%s.%s' % (os.path.basename(link), uuid.uuid4().hex))
+        os.symlink(target, temp_link)
+        os.replace(temp_link, link)
+
+    def remove_superseded(self, test_case_id, current):
+        versions = self.versions_dir(test_case_id)
+        now = time.time()
+        for name in os.listdir(versions):
+            path = os.path.join(versions, name)
+            if path == current or name.startswith('.'):
+                continue
+            # 标记文件的修改时间记录版本被替换的时刻
+            marker = os.path.join(versions, '.superseded-' + name)
+            if not os.path.exists(marker):
+                open(marker, 'w').close()
+            elif now - os.path.getmtime(marker) > self.retention:
+                logger.info('remove superseded test data %s', path)
+                indexes.invalidate(path)
+                manifests.invalidate(path)
+                shutil.rmtree(path, ignore_errors=True)
+                os.remove(marker)
+
+
+def natural_key(name):
+    """sort key putting '2' before '10'"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+class CaseIndex(object):
+    """
+    Index of the test cases of test data directories.
+
+    An index has the cases in natural order with the sizes of their files and the metadata of
+    PROBLEM_MANIFEST. It is cached in memory and in INDEX_DIR by the resolved path of the
+    directory, so a new synced version always gets a new index, and it is rebuilt when the
+    mtime of the directory or of PROBLEM_MANIFEST changed.
+    """
+
+    def __init__(self, directory=INDEX_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.indexes = dict()  # resolved test data directory -> index
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, data_dir):
+        name = hashlib.sha256(data_dir.encode()).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    @staticmethod
+    def version(data_dir):
+        """:return: what invalidates the index of the directory"""
+        try:
+            manifest_mtime = os.stat(os.path.join(data_dir, PROBLEM_MANIFEST)).st_mtime_ns
+        except OSError:
+            manifest_mtime = None
+        return [os.stat(data_dir).st_mtime_ns, manifest_mtime, INDEX_FORMAT]
+
+    @staticmethod
+    def build(data_dir):
+        try:
+            with open(os.path.join(data_dir, PROBLEM_MANIFEST)) as file:
+                problem = json.load(file)
+        except FileNotFoundError:
+            problem = dict()
+        except (OSError, ValueError) as e:
+            raise CrazyBoxError('invalid %s in %s: %s' % (PROBLEM_MANIFEST, data_dir, e))
+        metadata = problem.get('cases', {})
+
+        cases = []
+        files = {entry.name: entry for entry in os.scandir(data_dir) if entry.is_file()}
+        for file_name in sorted(files, key=natural_key):
+            name, file_suffix = os.path.splitext(file_name)
+            if file_suffix != '.in' or name + '.out' not in files:
+                continue
+            case = {'name': name, 'input_size': files[file_name].stat().st_size,
+                    'answer_size': files[name + '.out'].stat().st_size,
+                    'time_limit': None, 'group': None}
+            case.update(metadata.get(name, {}))
+            cases.append(case)
+        return {'cases': cases, 'groups': CaseIndex.build_groups(data_dir, cases, problem.get('groups')),
+                'problem': problem}
+
+    @staticmethod
+    def build_groups(data_dir, cases, declared):
+        """
+        :param declared: the groups of PROBLEM_MANIFEST, {name: {'score', 'policy'}}
+        :return: [{'name', 'policy', 'score', 'cases': [case names]}] in the order of their first case,
+                 empty if the problem has no groups
+        """
+        if not declared:
+            return []
+        groups = OrderedDict()
+        for case in cases:
+            name = case['group']
+            if name not in declared:
+                raise CrazyBoxError('invalid %s in %s: test case %s is not in a declared group'
+                                    % (PROBLEM_MANIFEST, data_dir, case['name']))
+            groups.setdefault(name, []).append(case['name'])
+
+        result = []
+        for name, names in groups.items():
+            group = declared[name]
+            policy = group.get('policy', ALL_OR_NOTHING)
+            if policy not in GROUP_POLICIES:
+                raise CrazyBoxError('invalid %s in %s: unknown policy %s of group %s'
+                                    % (PROBLEM_MANIFEST, data_dir, policy, name))
+            # 没有设置分数时每个测试点一分
+            result.append({'name': name, 'policy': policy, 'score': group.get('score', len(names)),
+                           'cases': names})
+        return result
+
+    def load(self, data_dir):
+        """
+        :return: {'cases': [{'name', 'input_size', 'answer_size', 'time_limit', 'group', ...}],
+                  'groups': [{'name', 'policy', 'score', 'cases'}], see build_groups,
+                  'problem': content of PROBLEM_MANIFEST}
+        """
+        data_dir = os.path.realpath(data_dir)
+        version = self.version(data_dir)
+        with self.lock:
+            cached = self.indexes.get(data_dir)
+        if cached is None:
+            try:
+                with open(self.path(data_dir)) as file:
+                    cached = json.load(file)
+            except (OSError, ValueError):
+                pass
+        if cached is None or cached['version'] != version:
+            metrics.count('crazybox_cache_requests_total', cache='index', result='miss')
+            cached = dict(self.build(data_dir), version=version)
+            path = self.path(data_dir)
+            temp_path = path + '.' + str(uuid.uuid4())
+            try:
+                with open(temp_path, 'w') as file:
+                    json.dump(cached, file)
+                os.rename(temp_path, path)
+            except OSError as e:
+                logger.warning('Failed to save the test case index of %s: %s', data_dir, e)
+        else:
+            metrics.count('crazybox_cache_requests_total', cache='index', result='hit')
+        with self.lock:
+            self.indexes[data_dir] = cached
+        return cached
+
+    def invalidate(self, data_dir):
+        """forget the index of the directory, in memory and in INDEX_DIR"""
+        data_dir = os.path.realpath(data_dir)
+        with self.lock:
+            self.indexes.pop(data_dir, None)
+        try:
+            os.remove(self.path(data_dir))
+        except OSError:
+            pass
+
+
+snapshots = SnapshotStore()
+indexes = CaseIndex()
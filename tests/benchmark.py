@@ -0,0 +1,379 @@
+# coding=utf-8
+"""
+Judge benchmark on synthetic problems and submissions.
+
+    python benchmark.py [--mode judge|http] [--url http://0.0.0.0:5000/] [--concurrency 4]
+                        [--repeat 3] [--tiny-cases 200] [--huge-mb 16] [--output result.json]
+                        [--unique-sources] [--baseline]
+
+judge mode calls crazybox.judge in this process, http mode syncs the problems to a running
+server and submits through /judge/ and /status/. Both print (or write to --output) one JSON
+document: throughput, end-to-end latency and per phase p50/p99, container overhead per test
+case, compile time per submission and the verdicts that differ from the expected ones, so two
+versions can be compared.
+
+The compile speed-up of the precompiled headers and the compile servers shows comparing
+
+    python benchmark.py --unique-sources --only aplusb-c++-bits,aplusb-java --repeat 10 --baseline
+    python benchmark.py --unique-sources --only aplusb-c++-bits,aplusb-java --repeat 10
+
+--unique-sources makes every source distinct so that no compile is a compile cache hit,
+--baseline (judge mode) compiles without the precompiled headers and the compile servers.
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from config import JUDGE_TOKEN, TEST_DATA_DIR
+from languages import LANG, PCH_DIR
+from metrics import BUCKETS
+from result import STATUS_NAMES, AC, WA, RE, TLE, MLE, OLE
+
+PROBLEM_PREFIX = 'benchmark-'
+
+APLUSB = {
+    'C': '#include <stdio.h>\n'
+         'int main() { long long a, b; while (scanf("%lld %lld", &a, &b) == 2) printf("%lld\\n", a + b); '
+         'return 0; }\n',
+    'C++': '#include <cstdio>\n'
+           'int main() { long long a, b; while (scanf("%lld %lld", &a, &b) == 2) printf("%lld\\n", a + b); '
+           'return 0; }\n',
+    'Java': 'import java.util.*;\n'
+            'public class Main { public static void main(String[] args) { Scanner in = new Scanner(System.in); '
+            'while (in.hasNextLong()) { long a = in.nextLong(), b = in.nextLong(); System.out.println(a + b); } } }\n',
+    'Python': 'import sys\nd = sys.stdin.read().split()\n'
+              'for i in range(0, len(d), 2):\n    print(int(d[i]) + int(d[i + 1]))\n',
+    'Python3': 'import sys\nd = sys.stdin.read().split()\n'
+               'for i in range(0, len(d), 2):\n    print(int(d[i]) + int(d[i + 1]))\n',
+    'Go': 'package main\nimport (\n\t"bufio"\n\t"fmt"\n\t"os"\n)\n'
+          'func main() {\n\tr := bufio.NewReader(os.Stdin)\n\tw := bufio.NewWriter(os.Stdout)\n'
+          '\tdefer w.Flush()\n\tvar a, b int64\n'
+          '\tfor {\n\t\tif _, err := fmt.Fscan(r, &a, &b); err != nil {\n\t\t\tbreak\n\t\t}\n'
+          '\t\tfmt.Fprintln(w, a+b)\n\t}\n}\n',
+    'Ruby': 'STDIN.read.split.map(&:to_i).each_slice(2) { |a, b| puts a + b }\n',
+}
+
+# the usual C++ submission, compiled with the precompiled <bits/stdc++.h>
+BITS = '#include <bits/stdc++.h>\nusing namespace std;\n' \
+       'int main() { ios::sync_with_stdio(false); long long a, b; vector<long long> sums; ' \
+       'while (cin >> a >> b) sums.push_back(a + b); for (long long x : sums) cout << x << "\\n"; return 0; }\n'
+
+# line comment of the languages, --unique-sources appends one to every source
+COMMENTS = {'Python': '#', 'Python3': '#', 'Ruby': '#'}
+
+# C++ programs for the other verdicts, judged on the tiny problem
+VERDICTS = {
+    'wa': ('#include <cstdio>\nint main() { long long a, b; scanf("%lld %lld", &a, &b); '
+           'printf("%lld\\n", a - b + 1); return 0; }\n', WA),
+    're': ('#include <cstdlib>\nint main() { abort(); }\n', RE),
+    'tle': ('int main() { volatile unsigned long long i = 0; for (;;) i++; }\n', TLE),
+    'mle': ('#include <cstring>\n#include <cstdlib>\n'
+            'int main() { for (;;) { char *p = (char *) malloc(1 << 20); memset(p, 1, 1 << 20); } }\n', MLE),
+    'ole': ('#include <cstdio>\nint main() { for (;;) fputs("0123456789012345678901234567890123456789\\n", stdout); }\n',
+            OLE),
+}
+
+COPY = '#include <cstdio>\nint main() { static char buffer[1 << 16]; size_t n; ' \
+       'while ((n = fread(buffer, 1, sizeof(buffer), stdin)) > 0) fwrite(buffer, 1, n, stdout); return 0; }\n'
+
+
+def generate_problems(root, tiny_cases, huge_mb, seed=0):
+    """
+    write the synthetic problems under root.
+
+    :return: {problem name: directory}
+    """
+    rng = random.Random(seed)
+    problems = {'tiny': os.path.join(root, PROBLEM_PREFIX + 'tiny'),
+                'huge': os.path.join(root, PROBLEM_PREFIX + 'huge')}
+    for directory in problems.values():
+        os.makedirs(directory, exist_ok=True)
+
+    # many tiny a+b cases
+    for i in range(1, tiny_cases + 1):
+        a, b = rng.randint(-10 ** 9, 10 ** 9), rng.randint(-10 ** 9, 10 ** 9)
+        write_case(problems['tiny'], str(i), '%d %d\n' % (a, b), '%d\n' % (a + b))
+
+    # a few huge cases, the answer is the input itself
+    line_count = huge_mb * 1024 * 1024 // 21
+    for i in range(1, 4):
+        lines = ''.join('%d %d\n' % (rng.randint(0, 10 ** 9), rng.randint(0, 10 ** 9)) for _ in range(line_count))
+        write_case(problems['huge'], str(i), lines, lines)
+    return problems
+
+
+def write_case(directory, name, data, answer):
+    for suffix, content in (('.in', data), ('.out', answer)):
+        path = os.path.join(directory, name + suffix)
+        if os.path.isfile(path):
+            with open(path) as file:
+                if file.read() == content:
+                    continue
+        with open(path, 'w') as file:
+            file.write(content)
+
+
+def submissions():
+    """:return: [(name, language, source, problem, check method, time limit, memory limit, expected status)]"""
+    result = [('aplusb-' + language.lower(), language, APLUSB[language], 'tiny', 'nint', 2, 256, AC)
+              for language in LANG if language in APLUSB]
+    result.append(('aplusb-c++-bits', 'C++', BITS, 'tiny', 'nint', 2, 256, AC))
+    result += [(name, 'C++', source, 'tiny', 'nint', 1, 64, expected)
+               for name, (source, expected) in sorted(VERDICTS.items())]
+    result.append(('copy-huge', 'C++', COPY, 'huge', 'line', 5, 256, AC))
+    return result
+
+
+def unique_sources(jobs):
+    """:return: the jobs with a distinct comment appended to every source, so that every compile is real"""
+    stamp = '%x' % int(time.time() * 1000)
+    return [job[:2] + ('%s\n%s crazybox-benchmark %s-%d\n' % (job[2], COMMENTS.get(job[1], '//'), stamp, i),) + job[3:]
+            for i, job in enumerate(jobs)]
+
+
+def use_baseline():
+    """compile like before the precompiled headers and the compile servers, in this process"""
+    import crazybox
+    crazybox.COMPILE_SERVER = False
+    for language in LANG.values():
+        language['compile_command'] = language['compile_command'].replace(' -I' + PCH_DIR, '')
+    LANG['Java']['compile_command'] = LANG['Java']['compile_command'].replace('/usr/local/bin/crazybox-javac',
+                                                                              '/usr/bin/javac')
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def bucket_quantile(buckets, q):
+    """quantile estimated from non-cumulative histogram bucket counts, like histogram_quantile"""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    cumulative, lower = 0, 0.0
+    for bound, count in zip(BUCKETS, buckets):
+        if count and cumulative + count >= rank:
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return BUCKETS[-1]
+
+
+def summarize(values):
+    return {'p50': percentile(values, 0.5), 'p99': percentile(values, 0.99),
+            'mean': sum(values) / len(values) if values else None, 'count': len(values)}
+
+
+def milliseconds(text):
+    return int(text.split()[0]) if text else 0
+
+
+def run_judge_mode(args, problems, jobs):
+    """judge every job with crazybox.judge in this process, phases are drained from metrics per submission"""
+    from crazybox import judge
+    from metrics import metrics
+
+    def task(job):
+        name, language, source, problem, method, time_limit, memory_limit, expected = job
+        start = time.perf_counter()
+        result = judge(source, language, problems[problem], time_limit, memory_limit, check_method=method)
+        latency = time.perf_counter() - start
+        # 并发时各提交的阶段会混在一起，这里只作为整体的分布
+        phases = metrics.drain()['phases']
+        return name, result, latency, {phase: h['sum'] for phase, h in phases.items()}, \
+            {phase: h['count'] for phase, h in phases.items()}
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(task, jobs))
+
+
+def run_http_mode(args, problems, jobs):
+    """sync the problems to the server, submit every job and poll its status"""
+    import requests
+    headers = {'Authorization': 'Token %s' % JUDGE_TOKEN}
+
+    for problem, directory in problems.items():
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as target:
+            for name in sorted(os.listdir(directory)):
+                target.write(os.path.join(directory, name), name)
+        archive.seek(0)
+        response = requests.post(args.url + 'sync/', headers=headers, data={'test_case_id': PROBLEM_PREFIX + problem},
+                                 files={'zipfile': ('problem.zip', archive)})
+        response.raise_for_status()
+
+    before = scrape(args.url)
+
+    def task(job):
+        name, language, source, problem, method, time_limit, memory_limit, expected = job
+        start = time.perf_counter()
+        response = requests.post(args.url + 'judge/', headers=headers, data={
+            'src_code': source, 'language': language, 'test_case_id': PROBLEM_PREFIX + problem,
+            'time_limit': time_limit, 'memory_limit': memory_limit, 'check_method': method}).json()
+        while True:
+            status = requests.get(args.url + 'status/%s' % response['submission_id'], headers=headers).json()['data']
+            if status['state'] == 'finished':
+                break
+            time.sleep(0.05)
+        latency = time.perf_counter() - start
+        result = status['response']['result'] if status['response']['code'] == 0 else {'status': status['status']}
+        return name, result, latency, {'queue': status['started_at'] - status['queued_at'],
+                                       'judge': status['finished_at'] - status['started_at']}, None
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(task, jobs))
+    return results, histogram_delta(before, scrape(args.url))
+
+
+def scrape(url):
+    """:return: {phase: (non-cumulative bucket counts, sum, count)} from /metrics"""
+    import requests
+    phases = {}
+    for line in requests.get(url + 'metrics').text.splitlines():
+        if not line.startswith('crazybox_phase_seconds'):
+            continue
+        metric, value = line.rsplit(' ', 1)
+        phase = metric.split('phase="', 1)[1].split('"', 1)[0]
+        histogram = phases.setdefault(phase, {'cumulative': [], 'sum': 0.0, 'count': 0})
+        if metric.startswith('crazybox_phase_seconds_bucket') and 'le="+Inf"' not in metric:
+            histogram['cumulative'].append(float(value))
+        elif metric.startswith('crazybox_phase_seconds_sum'):
+            histogram['sum'] = float(value)
+        elif metric.startswith('crazybox_phase_seconds_count'):
+            histogram['count'] = float(value)
+    for histogram in phases.values():
+        cumulative = histogram.pop('cumulative')
+        histogram['buckets'] = [b - a for a, b in zip([0.0] + cumulative, cumulative)]
+    return phases
+
+
+def histogram_delta(before, after):
+    phases = {}
+    for phase, histogram in after.items():
+        old = before.get(phase, {'buckets': [0.0] * len(histogram['buckets']), 'sum': 0.0, 'count': 0})
+        count = histogram['count'] - old['count']
+        if not count:
+            continue
+        buckets = [b - a for a, b in zip(old['buckets'], histogram['buckets'])]
+        phases[phase] = {'p50': bucket_quantile(buckets, 0.5), 'p99': bucket_quantile(buckets, 0.99),
+                         'mean': (histogram['sum'] - old['sum']) / count, 'count': count}
+    return phases
+
+
+def report(args, jobs, results, elapsed, server_phases=None):
+    expected = {job[0]: job[7] for job in jobs}
+    by_name, phases, mismatches = {}, {}, []
+    run_time, run_count, wall_time, test_count = 0.0, 0, 0, 0
+    for name, result, latency, phase_times, phase_counts in results:
+        entry = by_name.setdefault(name, {'latency': [], 'statuses': {}, 'compile_time': []})
+        entry['latency'].append(latency)
+        if result.get('compile_time') is not None and not result.get('compile_cached'):
+            entry['compile_time'].append(result['compile_time'])
+        status = STATUS_NAMES.get(result.get('status'), result.get('status'))
+        entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        if result.get('status') != expected[name]:
+            mismatches.append({'submission': name, 'expected': STATUS_NAMES[expected[name]], 'status': status,
+                               'info': str(result.get('info', ''))[:200]})
+        for phase, seconds in phase_times.items():
+            phases.setdefault(phase, []).append(seconds)
+        if phase_counts and 'run' in phase_counts:
+            run_time += phase_times['run']
+            run_count += phase_counts['run']
+        for detail in result.get('detail', []):
+            wall_time += milliseconds(detail.get('wall time'))
+            test_count += 1
+    if server_phases and 'run' in server_phases:
+        run_time, run_count = server_phases['run']['mean'] * server_phases['run']['count'], server_phases['run']['count']
+
+    document = {
+        'version': git_version(),
+        'mode': args.mode,
+        'concurrency': args.concurrency,
+        'repeat': args.repeat,
+        'submissions': len(results),
+        'elapsed': elapsed,
+        'throughput': len(results) / elapsed if elapsed else None,  # submissions/s
+        'latency': summarize([latency for _, _, latency, _, _ in results]),
+        'phases': server_phases or {phase: summarize(values) for phase, values in sorted(phases.items())},
+        # judge mode: time of a phase per submission; http mode: time of a phase per call, from the
+        # histograms of the server
+        'phase_unit': 'call' if server_phases is not None else 'submission',
+        # 每个测试点在程序本身运行时间之外花在容器上的时间
+        'container_overhead_per_test': (run_time / run_count - wall_time / 1000 / test_count)
+        if run_count and test_count else None,
+        'baseline': args.baseline,
+        # compile time in the sandbox of the compiles that were not compile cache hits, s
+        'by_submission': {name: {'latency': summarize(entry['latency']), 'statuses': entry['statuses'],
+                                 'compile_time': summarize(entry['compile_time'])}
+                          for name, entry in sorted(by_name.items())},
+        'mismatches': mismatches,
+    }
+    return document
+
+
+def git_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='crazybox judge benchmark')
+    parser.add_argument('--mode', choices=('judge', 'http'), default='judge')
+    parser.add_argument('--url', default='http://0.0.0.0:5000/')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3, help='times every submission is judged')
+    parser.add_argument('--tiny-cases', type=int, default=200)
+    parser.add_argument('--huge-mb', type=int, default=16, help='size of every huge input, MB')
+    parser.add_argument('--data-dir', default=TEST_DATA_DIR,
+                        help='where the problems are generated, judge mode uses the warm pool under TEST_DATA_DIR')
+    parser.add_argument('--only', default=None, help='comma separated submission names')
+    parser.add_argument('--output', default=None, help='write the JSON result here instead of stdout')
+    parser.add_argument('--unique-sources', action='store_true', help='no compile is a compile cache hit')
+    parser.add_argument('--baseline', action='store_true',
+                        help='judge mode: compile without the precompiled headers and the compile servers')
+    args = parser.parse_args()
+    if args.baseline and args.mode != 'judge':
+        parser.error('--baseline only applies to judge mode')
+
+    problems = generate_problems(args.data_dir, args.tiny_cases, args.huge_mb)
+    jobs = [job for job in submissions() if not args.only or job[0] in args.only.split(',')] * args.repeat
+    if args.unique_sources:
+        jobs = unique_sources(jobs)
+    if args.baseline:
+        use_baseline()
+
+    start = time.perf_counter()
+    if args.mode == 'judge':
+        results, server_phases = run_judge_mode(args, problems, jobs), None
+    else:
+        results, server_phases = run_http_mode(args, problems, jobs)
+    document = report(args, jobs, results, time.perf_counter() - start, server_phases)
+
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+# coding=utf-8
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cache import ArtifactCache
+from languages import LANG
+from utils import compress_code
+
+
+def cache_on_image(directory, image_id):
+    cache = ArtifactCache(str(directory))
+    cache.image = (image_id, time.time())
+    return cache
+
+
+def test_key_depends_on_image(tmp_path):
+    old, new = cache_on_image(tmp_path, 'sha256:old'), cache_on_image(tmp_path, 'sha256:new')
+    source = 'int main() { return 0; }\n'
+    assert old.key(LANG['C++'], source) == cache_on_image(tmp_path, 'sha256:old').key(LANG['C++'], source)
+    assert old.key(LANG['C++'], source) != new.key(LANG['C++'], source)
+    assert old.key(LANG['C++'], source) != old.key(LANG['C'], source)
+
+
+def test_key_encodes_like_compress_code(tmp_path):
+    cache = cache_on_image(tmp_path, 'sha256:image')
+    # undecodable bytes of a submission survive as surrogates
+    source = b'// \xff\xfe\nint main() { return 0; }\n'.decode('utf-8', 'surrogateescape')
+    _, archive = compress_code(source, '.cpp')
+    assert source.encode('utf-8', 'surrogateescape') in archive
+    assert cache.key(LANG['C++'], source) == cache.key(LANG['C++'], source.encode('utf-8', 'surrogateescape'))
@@ -0,0 +1,107 @@
+# coding=utf-8
+"""
+Parity of comparator.py with the testlib checkers in checkers/ it reimplements: every case of the
+corpus is checked by both and must give the same exit code and message.
+"""
+import os
+import sys
+import subprocess
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from comparator import compare, PE
+
+CHECKERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'checkers')
+
+# (method, output, answer)
+CORPUS = [
+    # line endings and trailing whitespace
+    ('file', b'1 2\n3 4\n', b'1 2\n3 4\n'),
+    ('file', b'1 2\r\n3 4\r\n', b'1 2\n3 4\n'),
+    ('file', b'1 2\n3 4', b'1 2\n3 4\n'),
+    ('file', b'1 2 \n3 4\n', b'1 2\n3 4\n'),
+    ('file', b'1 2\n3 4\n\n', b'1 2\n3 4\n'),
+    ('file', b'1 2\n', b'1 2\n3 4\n'),
+    ('file', b'', b''),
+    ('line', b'1  2\t\n3 4\r\n', b'1 2\n3 4\n'),
+    ('line', b'1 2\n3 5\n', b'1 2\n3 4\n'),
+    ('line', b'1 2\n3 4\nextra\n', b'1 2\n3 4\n'),
+    ('line', b'hello world\n', b'hello world\n'),
+    # integers
+    ('int', b'3\n', b'3\n'),
+    ('int', b'  -7 \r\n', b'-7'),
+    ('int', b'4\n', b'3\n'),
+    ('int', b'2147483648\n', b'3\n'),
+    ('int', b'03\n', b'3\n'),
+    ('int', b'3 4\n', b'3\n'),
+    ('int', b'', b'3\n'),
+    ('long', b'-9223372036854775808\n', b'-9223372036854775808\n'),
+    ('long', b'9223372036854775808\n', b'1\n'),
+    ('nint', b'1 2 3\n', b'1\n2\n3\n'),
+    ('nint', b'1 2\n', b'1 2 3\n'),
+    ('nint', b'1 2 3 4\n', b'1 2 3\n'),
+    ('nint', b'1 2 x\n', b'1 2 3\n'),
+    ('nint', b' '.join(str(i).encode() for i in range(10)) + b'\n', b'\n'.join(str(i).encode() for i in range(10))),
+    ('nlong', b'10000000000 -1\n', b'10000000000 -1\n'),
+    ('huge', b'123456789012345678901234567890\n', b'123456789012345678901234567890\n'),
+    ('huge', b'-0\n', b'0\n'),
+    ('nhuge', b'1 22 333\n', b'1 22 333\n'),
+    ('nhuge', b'1 22 334\n', b'1 22 333\n'),
+    # float epsilons
+    ('double4', b'0.33333\n', b'0.333333\n'),
+    ('double4', b'0.3334\n', b'0.333333\n'),
+    ('double4', b'1000000.5\n', b'1000000\n'),
+    ('double4', b'1e5\n', b'100000.0\n'),
+    ('double6', b'3.1415926\n', b'3.14159265358979\n'),
+    ('double6', b'3.14159\n', b'3.14159265358979\n'),
+    ('double6', b'nan\n', b'1\n'),
+    ('ndouble4', b'0.5 0.25 0.125\n', b'0.5000 0.2500 0.1250\n'),
+    ('ndouble4', b'0.5 0.26\n', b'0.5 0.25\n'),
+    ('ndouble6', b'1.0000001\n', b'1\n'),
+    ('ndouble6', b'1 2\n', b'1 2 3\n'),
+    # yes/no case
+    ('yesno', b'yes\n', b'YES\n'),
+    ('yesno', b'No\n', b'NO\n'),
+    ('yesno', b'no\n', b'YES\n'),
+    ('yesno', b'maybe\n', b'YES\n'),
+    ('nyesno', b'YES no yEs\n', b'yes NO yes\n'),
+    ('nyesno', b'YES no no\n', b'yes NO yes\n'),
+    ('nyesno', b'YES\n', b'yes NO\n'),
+]
+
+
+def write(path, data):
+    with open(path, 'wb') as file:
+        file.write(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('method, output, answer', CORPUS)
+def test_parity_with_testlib(tmp_path, method, output, answer):
+    input_path = write(tmp_path / 'input', b'')
+    output_path = write(tmp_path / 'output', output)
+    answer_path = write(tmp_path / 'answer', answer)
+    binary = subprocess.run([os.path.join(CHECKERS_DIR, method), input_path, output_path, answer_path],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+    expected = (binary.returncode, binary.stderr.decode(errors='replace').strip())
+    assert compare(output_path, answer_path, method) == expected
+
+
+def test_lone_carriage_return_ends_a_line(tmp_path):
+    """documented deviation: after a lone '\\r' testlib reads empty lines, here it ends a line"""
+    input_path = write(tmp_path / 'input', b'')
+    output_path = write(tmp_path / 'output', b'1 2\r3 4\n')
+    answer_path = write(tmp_path / 'answer', b'1 2\n3 4\n')
+    for method in ('line', 'file'):
+        binary = subprocess.run([os.path.join(CHECKERS_DIR, method), input_path, output_path, answer_path],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=10)
+        assert binary.returncode == 1
+        assert compare(output_path, answer_path, method) == (0, 'ok 2 lines')
+
+
+def test_missing_output_file(tmp_path):
+    answer_path = write(tmp_path / 'answer', b'1\n')
+    result, _ = compare(str(tmp_path / 'missing'), answer_path, 'int')
+    assert result == PE
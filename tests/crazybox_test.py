@@ -0,0 +1,109 @@
+# coding=utf-8
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from crazybox import _run_cases, _score_group, _skipped_case
+from result import AC, WA, TLE, RE
+from testdata import ALL_OR_NOTHING, PER_TEST
+
+NAMES = [str(i) for i in range(1, 9)]
+
+
+def stub_run_case(slow=(), failing=(), delay=0.3):
+    """:return: (run_case returning a case result like _judge_case, names of the cases it ran)"""
+    ran = []
+    lock = threading.Lock()
+
+    def run_case(data_name, slot):
+        with lock:
+            ran.append(data_name)
+        if data_name in slow:
+            time.sleep(delay)
+        failure = (WA, 'wrong', 'Wrong answer on test %s' % data_name) if data_name in failing else None
+        return {'test': data_name}, failure, None
+    return run_case, ran
+
+
+def one_group(data_name):
+    return ''
+
+
+@pytest.mark.parametrize('slots', [[None], [None, None]])
+def test_failure_skips_the_cases_after_it(slots):
+    run_case, ran = stub_run_case(slow={'1'}, failing={'3'})
+    results = list(_run_cases(run_case, NAMES, slots, one_group))
+    assert [data_name for data_name, _ in results] == NAMES
+    assert [case is None for _, case in results] == [False, False, False] + [True] * 5
+    assert results[2][1][1][0] == WA
+    # 第1个测试点还在运行时第3个失败，之后的测试点不再运行
+    assert sorted(ran) == ['1', '2', '3']
+
+
+def test_lowest_failure_is_reported():
+    # 第3个先失败，较慢的第1个随后失败，报告的是第1个
+    run_case, ran = stub_run_case(slow={'1'}, failing={'1', '3'})
+    results = list(_run_cases(run_case, NAMES, [None, None], one_group))
+    assert [data_name for data_name, _ in results] == NAMES
+    assert results[0][1][1] is not None
+    assert all(case is None for _, case in results[1:])
+    assert sorted(ran) == ['1', '2', '3']
+
+
+def test_cases_outside_fail_fast_groups_still_run():
+    run_case, ran = stub_run_case(slow={'1'}, failing={'3'})
+    results = list(_run_cases(run_case, NAMES, [None, None], lambda data_name: None if data_name == '8' else ''))
+    assert [case is None for _, case in results] == [False, False, False] + [True] * 4 + [False]
+    assert sorted(ran) == ['1', '2', '3', '8']
+
+
+def test_all_cases_run_without_a_failure():
+    run_case, ran = stub_run_case(slow={'1', '5'})
+    results = list(_run_cases(run_case, NAMES, [None, None, None], one_group))
+    assert [data_name for data_name, case in results if case is not None] == NAMES
+    assert sorted(ran) == sorted(NAMES)
+
+
+def group(policy, cases, score=30):
+    return {'name': 'g', 'policy': policy, 'score': score, 'cases': cases}
+
+
+def test_all_or_nothing_group_with_a_failure():
+    # 失败之后的测试点被跳过
+    result = _score_group(group(ALL_OR_NOTHING, ['1', '2', '3', '4']), {'1': AC, '2': WA, '3': None, '4': None})
+    assert result == {'name': 'g', 'policy': ALL_OR_NOTHING, 'status': WA, 'score': 0, 'max_score': 30,
+                      'passed': 1, 'total': 4, 'skipped': ['3', '4']}
+
+
+def test_all_or_nothing_group_passed():
+    result = _score_group(group(ALL_OR_NOTHING, ['1', '2']), {'1': AC, '2': AC})
+    assert (result['status'], result['score'], result['passed'], result['skipped']) == (AC, 30, 2, [])
+
+
+def test_per_test_group_partial_score():
+    result = _score_group(group(PER_TEST, ['1', '2', '3', '4'], score=20), {'1': AC, '2': TLE, '3': AC, '4': WA})
+    assert (result['status'], result['score'], result['max_score'], result['passed']) == (TLE, 10, 20, 2)
+    assert result['skipped'] == []
+
+
+def test_per_test_group_all_failed():
+    result = _score_group(group(PER_TEST, ['1', '2']), {'1': RE, '2': WA})
+    assert (result['status'], result['score'], result['passed']) == (RE, 0, 0)
+
+
+@pytest.mark.parametrize('policy', [ALL_OR_NOTHING, PER_TEST])
+def test_empty_group(policy):
+    result = _score_group(group(policy, []), {})
+    assert (result['status'], result['score'], result['passed'], result['total'], result['skipped']) == \
+        (AC, 0, 0, 0, [])
+
+
+def test_skipped_case_result():
+    assert _skipped_case('7') == {'test': '7', 'time': None, 'wall time': None, 'memory': None,
+                                  'exit code': None, 'checker exit code': None, 'verdict': 'Skipped',
+                                  'input': None, 'output': None, 'answer': None, 'log': None}
@@ -0,0 +1,73 @@
+# coding=utf-8
+import os
+import sys
+import json
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from metrics import Metrics, PHASE_HISTOGRAM
+
+
+def sample_lines(text):
+    return [line for line in text.split('\n') if line and not line.startswith('#')]
+
+
+def test_render_histogram():
+    metrics = Metrics(buckets=(0.1, 1, 10))
+    for seconds in (0.05, 0.1, 0.5, 0.7, 5, 100):
+        metrics.observe('run', seconds)
+    text = metrics.render()
+
+    assert '# TYPE {} histogram'.format(PHASE_HISTOGRAM) in text
+    samples = [line for line in sample_lines(text) if line.startswith(PHASE_HISTOGRAM)]
+    # 桶是累计的，+Inf等于总数
+    assert samples == [
+        PHASE_HISTOGRAM + '_bucket{phase="run",le="0.1"} 2',
+        PHASE_HISTOGRAM + '_bucket{phase="run",le="1.0"} 4',
+        PHASE_HISTOGRAM + '_bucket{phase="run",le="10.0"} 5',
+        PHASE_HISTOGRAM + '_bucket{phase="run",le="+Inf"} 6',
+        PHASE_HISTOGRAM + '_sum{phase="run"} 106.35',
+        PHASE_HISTOGRAM + '_count{phase="run"} 6',
+    ]
+    assert text.endswith('\n')
+
+
+def test_render_counters_and_gauges():
+    metrics = Metrics()
+    metrics.count('crazybox_judgements_total', status='AC')
+    metrics.count('crazybox_judgements_total', 2, status='AC')
+    metrics.count('crazybox_cache_requests_total', cache='index', result='hit')
+    text = metrics.render([('crazybox_queue_depth', 'Submissions waiting.', 3)])
+
+    assert 'crazybox_judgements_total{status="AC"} 3' in sample_lines(text)
+    assert 'crazybox_cache_requests_total{cache="index",result="hit"} 1' in sample_lines(text)
+    assert '# TYPE crazybox_queue_depth gauge' in text
+    assert sample_lines(text)[-1] == 'crazybox_queue_depth 3'
+
+
+def test_drain_and_merge():
+    worker, server = Metrics(buckets=(1, 10)), Metrics(buckets=(1, 10))
+    server.observe('compile', 2)
+    worker.observe('compile', 0.5)
+    worker.observe('compile', 20)
+    worker.count('crazybox_judgements_total', status='WA')
+    # 评测进程的数据经过序列化发送到服务进程
+    server.merge(json.loads(json.dumps(worker.drain())))
+    server.merge(worker.drain())
+
+    assert worker.phases == {} and worker.counters == {}
+    assert server.phases['compile'] == {'buckets': [1, 1], 'sum': 22.5, 'count': 3}
+    assert server.counters == {('crazybox_judgements_total', (('status', 'WA'),)): 1}
+    assert PHASE_HISTOGRAM + '_bucket{phase="compile",le="+Inf"} 3' in sample_lines(server.render())
+
+
+def test_metrics_route_requires_the_token(monkeypatch):
+    import server
+    from config import JUDGE_TOKEN
+    monkeypatch.setattr(server.scheduler, 'stats', lambda: {'queue_depth': 0, 'running': 0, 'workers': []})
+    client = server.app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Token wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Token ' + JUDGE_TOKEN})
+    assert response.status_code == 200
+    assert 'crazybox_queue_depth 0' in sample_lines(response.get_data(as_text=True))
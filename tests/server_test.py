@@ -31,8 +31,35 @@ def test_sync():
     print(response.json())
 
 
-def test_judge():
-    logger.info('test judge')
+def test_sync_delta():
+    logger.info('test sync delta')
+    import json
+    import hashlib
+    base = os.path.join(os.getcwd(), '2')
+    manifest = dict()
+    for name in os.listdir(base):
+        with open(os.path.join(base, name), 'rb') as file:
+            manifest[name] = hashlib.sha256(file.read()).hexdigest()
+    response = requests.post(url + 'sync/diff/', headers={'Authorization': 'Token %s' % JUDGE_TOKEN},
+                             data={'test_case_id': '2', 'manifest': json.dumps(manifest)})
+    print(response.json())
+    diff = response.json()['data']
+
+    import io
+    import zipfile
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as target:
+        for name in diff['upload']:
+            target.write(os.path.join(base, name), name)
+    archive.seek(0)
+    response = requests.post(url + 'sync/', headers={'Authorization': 'Token %s' % JUDGE_TOKEN},
+                             data={'test_case_id': '2', 'mode': 'delta', 'delete': json.dumps(diff['delete'])},
+                             files={'zipfile': ('delta.zip', archive)})
+    print(response.json())
+
+
+def submit():
+    """:return: the response of the judge api to a+b in a.cpp on test case 2"""
     src_code = open(os.path.join(os.getcwd(), 'a.cpp')).read().encode()
     data = {
         'src_code': src_code,
@@ -45,13 +72,49 @@ def test_judge():
 
     response = requests.post(url + 'judge/', headers={'Authorization': 'Token %s' % JUDGE_TOKEN},
                              data=data)
+    print(response.json())
+    return response.json()
+
+
+def test_judge():
+    logger.info('test judge')
+    result = submit()
+    assert result['code'] == 0
+    assert result['submission_id']
+
+
+def test_status():
+    logger.info('test status')
+    import time
     import json
+    result = submit()
+    assert result['code'] == 0
+    submission_id = result['submission_id']
+    while True:
+        response = requests.get(url + 'status/%s' % submission_id, headers={'Authorization': 'Token %s' % JUDGE_TOKEN})
+        if response.json()['data']['state'] == 'finished':
+            break
+        time.sleep(0.5)
     print(json.dumps(response.json(), sort_keys=True, indent=4))
-    # print(response.json())
+
+
+def test_nodes():
+    # 本地集群: 在各自的目录中启动评测节点
+    #   CRAZYBOX_NODE_ID=a python server.py --port 5001
+    #   CRAZYBOX_NODE_ID=b python server.py --port 5002
+    # 再启动协调节点 python server.py --mode coordinator --node http://0.0.0.0:5001/，提交到协调节点
+    logger.info('test nodes')
+    response = requests.post(url + 'nodes/', headers={'Authorization': 'Token %s' % JUDGE_TOKEN},
+                             data={'url': 'http://0.0.0.0:5002/'})
+    print(response.json())
+    response = requests.get(url + 'nodes/', headers={'Authorization': 'Token %s' % JUDGE_TOKEN})
+    print(response.json())
 
 
 if __name__ == '__main__':
+    # test_nodes()
     # test_ping()
     # test_hash()
     # test_sync()
-    test_judge()
+    # test_sync_delta()
+    test_status()
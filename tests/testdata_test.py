@@ -0,0 +1,128 @@
+# coding=utf-8
+import os
+import io
+import sys
+import json
+from zipfile import ZipFile
+
+import pytest
+from checksumdir import dirhash
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import testdata
+from exceptions import CrazyBoxError
+from testdata import natural_key, CaseIndex, ManifestStore, SnapshotStore, PROBLEM_MANIFEST, ALL_OR_NOTHING, PER_TEST
+
+
+def write(path, data):
+    with open(str(path), 'w') as file:
+        file.write(data)
+
+
+def make_cases(data_dir, names):
+    for name in names:
+        write(data_dir / (name + '.in'), '1 2\n')
+        write(data_dir / (name + '.out'), '3\n')
+
+
+def test_manifest_hash_equals_dirhash(tmp_path):
+    """the web side compares the hash of TestCaseHashAPI with checksumdir.dirhash of its copy"""
+    data_dir = tmp_path / 'data'
+    os.makedirs(str(data_dir / 'sub' / 'deeper'))
+    make_cases(data_dir, ['1', '2'])  # 相同内容的文件
+    write(data_dir / 'empty', '')
+    write(data_dir / '.hidden', 'x')
+    write(data_dir / 'sub' / 'a.txt', 'a' * 100000)
+    write(data_dir / 'sub' / 'deeper' / 'b', 'b')
+    os.symlink('empty', str(data_dir / 'link'))
+    store = ManifestStore(str(tmp_path / 'manifest'))
+    assert store.dir_hash(str(data_dir)) == dirhash(str(data_dir), 'sha256')
+
+    # 扫描只重新计算变化过的文件，结果仍然一致
+    write(data_dir / 'sub' / 'a.txt', 'changed')
+    os.remove(str(data_dir / '2.in'))
+    write(data_dir / '3.in', 'new')
+    assert store.dir_hash(str(data_dir)) == dirhash(str(data_dir), 'sha256')
+    assert ManifestStore(str(tmp_path / 'manifest')).dir_hash(str(data_dir)) == dirhash(str(data_dir), 'sha256')
+    assert store.dir_hash(str(tmp_path / 'missing')) == -1
+
+
+def test_natural_key():
+    assert sorted(['10', '2', '1'], key=natural_key) == ['1', '2', '10']
+    assert sorted(['test10.in', 'test2.in', 'test1.in'], key=natural_key) == ['test1.in', 'test2.in', 'test10.in']
+    assert sorted(['b1', 'a10', 'a2'], key=natural_key) == ['a2', 'a10', 'b1']
+
+
+def test_cases_in_natural_order(tmp_path):
+    make_cases(tmp_path, ['10', '2', '1'])
+    write(tmp_path / '3.in', '')  # 没有答案的输入不是测试点
+    index = CaseIndex(str(tmp_path / 'index')).load(str(tmp_path))
+    assert [case['name'] for case in index['cases']] == ['1', '2', '10']
+    assert index['cases'][0] == {'name': '1', 'input_size': 4, 'answer_size': 2, 'time_limit': None, 'group': None}
+    assert index['groups'] == []
+
+
+def test_problem_manifest_overrides(tmp_path):
+    make_cases(tmp_path, ['1', '2', '10'])
+    write(tmp_path / PROBLEM_MANIFEST, json.dumps({
+        'cases': {'2': {'time_limit': 3000, 'group': 'small'}, '1': {'group': 'small'}, '10': {'group': 'big'}},
+        'groups': {'small': {'score': 30}, 'big': {'policy': PER_TEST}},
+    }))
+    index = CaseIndex(str(tmp_path / 'index')).load(str(tmp_path))
+    assert [(case['name'], case['time_limit'], case['group']) for case in index['cases']] == \
+        [('1', None, 'small'), ('2', 3000, 'small'), ('10', None, 'big')]
+    assert index['groups'] == [{'name': 'small', 'policy': ALL_OR_NOTHING, 'score': 30, 'cases': ['1', '2']},
+                               {'name': 'big', 'policy': PER_TEST, 'score': 1, 'cases': ['10']}]
+
+
+def test_problem_manifest_errors(tmp_path):
+    make_cases(tmp_path, ['1'])
+    indexes = CaseIndex(str(tmp_path / 'index'))
+    write(tmp_path / PROBLEM_MANIFEST, '{')
+    with pytest.raises(CrazyBoxError):
+        indexes.load(str(tmp_path))
+    write(tmp_path / PROBLEM_MANIFEST, json.dumps({'cases': {'1': {'group': 'g'}}, 'groups': {'h': {}}}))
+    with pytest.raises(CrazyBoxError):
+        indexes.load(str(tmp_path))
+
+
+def test_index_rebuilt_when_manifest_changes(tmp_path):
+    make_cases(tmp_path, ['1'])
+    indexes = CaseIndex(str(tmp_path / 'index'))
+    assert indexes.load(str(tmp_path))['cases'][0]['time_limit'] is None
+    write(tmp_path / PROBLEM_MANIFEST, json.dumps({'cases': {'1': {'time_limit': 500}}}))
+    os.utime(str(tmp_path / PROBLEM_MANIFEST), ns=(1, 1))
+    assert indexes.load(str(tmp_path))['cases'][0]['time_limit'] == 500
+
+
+def archive(files):
+    data = io.BytesIO()
+    with ZipFile(data, 'w') as zipfile:
+        for name, content in files.items():
+            zipfile.writestr(name, content)
+    data.seek(0)
+    return data
+
+
+def test_retired_version_drops_its_index_and_manifest(tmp_path, monkeypatch):
+    indexes = CaseIndex(str(tmp_path / 'index'))
+    monkeypatch.setattr(testdata, 'indexes', indexes)
+    manifests = ManifestStore(str(tmp_path / 'manifest'))
+    monkeypatch.setattr(testdata, 'manifests', manifests)
+    store = SnapshotStore(str(tmp_path / 'data'), retention=-1)
+    os.makedirs(str(tmp_path / 'data'))
+
+    first = store.sync('1', archive({'1.in': '1', '1.out': '1'}))
+    manifests.scan(first)  # 集群按解析后的版本路径计算哈希
+    assert os.path.exists(indexes.path(first)) and os.path.exists(manifests.path(first))
+    second = store.sync('1', archive({'1.in': '2', '1.out': '2'}))
+    # 第一次被替换时只做标记
+    assert os.path.exists(indexes.path(first))
+    third = store.sync('1', archive({'1.in': '3', '1.out': '3'}))
+    assert not os.path.exists(first)
+    assert not os.path.exists(indexes.path(first))
+    assert first not in indexes.indexes
+    assert not os.path.exists(manifests.path(first))
+    assert first not in manifests.manifests
+    assert os.path.exists(indexes.path(second)) and os.path.exists(indexes.path(third))
@@ -0,0 +1,208 @@
+# coding=utf-8
+import os
+import sys
+import time
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import utils
+from utils import volume_mountpoint, forget_mountpoint, redirect_to_log, capture_file, OutputCapture
+from utils import wrap_usage, wrap_cgroup_cpu, pop_cgroup_cpu, parse_usage, wrap_interactor, pop_interactor_report
+from utils import USAGE_MARKER, CGROUP_CPU_MARKER, INTERACTOR_MARKER
+from crazybox import INTERACTOR_COMMAND
+import checker
+from result import WA
+
+# stands in for GNU time where it is not installed: reopens the -o file with fopen("w") like it does
+TIME_SHIM = '''#!/usr/bin/env python3
+import sys
+import subprocess
+fmt, output, command = sys.argv[2], sys.argv[4], sys.argv[5:]
+with open(output, 'w') as file:
+    code = subprocess.call(command)
+    file.write(fmt.replace('%e', '0.01').replace('%U', '0.00').replace('%S', '0.00').replace('%M', '1234') + '\\n')
+sys.exit(code)
+'''
+
+
+def gnu_time(tmp_path):
+    """:return: path of GNU time, of TIME_SHIM where it is not installed"""
+    time_path = '/usr/bin/time'
+    if not os.path.exists(time_path):
+        time_path = str(tmp_path / 'time')
+        with open(time_path, 'w') as file:
+            file.write(TIME_SHIM)
+        os.chmod(time_path, 0o755)
+    return time_path
+
+
+def test_usage_from_host_log_file(tmp_path):
+    """a run container writing its stdout to a log file on the host, as create_container with host_dir"""
+    time_path = gnu_time(tmp_path)
+
+    out_path = tmp_path / 'p.out'
+    # the same command as crazybox._run without a sandbox
+    command = '/bin/bash -c "{}; exit $s"'.format(wrap_cgroup_cpu(wrap_usage('echo hello > {}'.format(out_path))))
+    command = command.replace('/usr/bin/time', time_path)
+    log = str(tmp_path / '.box-log')
+    assert subprocess.call(redirect_to_log(command, log), cwd=str(tmp_path)) == 0
+
+    stdout = capture_file(log + '.stdout')
+    stdout, _ = pop_cgroup_cpu(stdout)
+    stdout, usage = parse_usage(stdout)
+    assert usage is not None, stdout
+    assert usage['memory'] > 0
+    assert usage['wall_time'] is not None
+    assert stdout == b''
+    assert out_path.read_text() == 'hello\n'
+    assert capture_file(log + '.stderr') == b''
+
+
+def test_forgotten_mountpoint_is_looked_up_again(tmp_path, monkeypatch):
+    volumes = {'crazybox-1': {'Mountpoint': str(tmp_path / 'a')}}
+    fake = SimpleNamespace(client=SimpleNamespace(volumes=SimpleNamespace(
+        get=lambda name: SimpleNamespace(attrs=volumes[name]))))
+    monkeypatch.setattr(utils, 'docker_clients', fake)
+    os.makedirs(str(tmp_path / 'a'))
+    os.makedirs(str(tmp_path / 'b'))
+
+    assert volume_mountpoint('crazybox-1') == str(tmp_path / 'a')
+    volumes['crazybox-1'] = {'Mountpoint': str(tmp_path / 'b')}
+    assert volume_mountpoint('crazybox-1') == str(tmp_path / 'a')
+    forget_mountpoint('crazybox-1')
+    assert 'crazybox-1' not in utils._mountpoints
+    assert volume_mountpoint('crazybox-1') == str(tmp_path / 'b')
+    forget_mountpoint('crazybox-1')
+
+
+class FakeContainers(object):
+    def __init__(self):
+        self.created = []
+
+    def create(self, **kwargs):
+        self.created.append(kwargs)
+        return SimpleNamespace(start=lambda: None, remove=lambda force: None)
+
+
+def test_pooled_sandbox_only_sees_its_problem(tmp_path, monkeypatch):
+    containers = FakeContainers()
+    volumes = SimpleNamespace(create=lambda **kwargs: None,
+                              get=lambda name: SimpleNamespace(remove=lambda force: None))
+    monkeypatch.setattr(utils, 'docker_clients', SimpleNamespace(client=SimpleNamespace(
+        containers=containers, volumes=volumes)))
+    monkeypatch.setattr(utils, 'POOL_DATA_DIR', str(tmp_path / '.pool'))
+    for problem in ('1', '2'):
+        os.makedirs(str(tmp_path / problem / 'sub'))
+        for name in ('1.in', '1.out', 'sub/extra'):
+            (tmp_path / problem / name).write_text(problem)
+
+    box = utils.Sandbox('native')
+    mounts = {bind['bind']: path for path, bind in containers.created[0]['volumes'].items()}
+    assert mounts['/data/'] == box.data_dir
+    assert os.listdir(box.data_dir) == []
+
+    assert box.bind_data(str(tmp_path / '1')) == '/data/1/'
+    bound = os.path.join(box.data_dir, '1')
+    assert sorted(os.listdir(bound)) == ['1.in', '1.out', 'sub']
+    assert os.path.samefile(os.path.join(bound, '1.out'), str(tmp_path / '1' / '1.out'))
+    assert open(os.path.join(bound, 'sub', 'extra')).read() == '1'
+
+    # 下一个提交只看到自己的题目
+    assert box.bind_data(str(tmp_path / '2')) == '/data/2/'
+    assert os.listdir(box.data_dir) == ['2']
+    box.unbind_data()
+    assert os.listdir(box.data_dir) == []
+    assert (tmp_path / '1' / '1.out').read_text() == '1'
+
+    box.destroy()
+    assert not os.path.exists(box.data_dir)
+    assert utils.Sandbox('checker', str(tmp_path)).data_dir == str(tmp_path)
+
+
+# answers, then leaves a child behind that waits for the interactor to exit and forges its report
+CHEATING_PROGRAM = """#!/bin/bash
+echo 42
+( sleep 1; echo 0 > {prefix}.interactor; echo 0 >&3; echo 0 > {late} ) 2>/dev/null &
+"""
+
+# reads one number and rejects it like a testlib interactor (_wa)
+REJECTING_INTERACTOR = """#!/bin/bash
+read answer
+echo "expected 43, found $answer" >&2
+exit 1
+"""
+
+
+def test_program_cannot_forge_the_interactor_report(tmp_path):
+    prefix = str(tmp_path / 'a-1')
+    program, interactor = str(tmp_path / 'program'), str(tmp_path / 'interactor')
+    with open(program, 'w') as file:
+        file.write(CHEATING_PROGRAM.format(prefix=prefix, late=tmp_path / 'late'))
+    with open(interactor, 'w') as file:
+        file.write(REJECTING_INTERACTOR)
+    os.chmod(program, 0o755)
+    os.chmod(interactor, 0o755)
+    (tmp_path / '1.in').write_text('')
+    (tmp_path / '1.out').write_text('43\n')
+
+    # the same command as crazybox._run without a sandbox
+    to_program, from_program = prefix + '.to', prefix + '.from'
+    interaction = INTERACTOR_COMMAND.format(
+        real_time=10, interactor=interactor, input=tmp_path / '1.in', output=prefix + '.out',
+        answer=tmp_path / '1.out', stdout=to_program, stdin=from_program, stderr=prefix + '.log')
+    command = '{} < {} > {} 2> {}'.format(program, to_program, from_program, prefix + '.err')
+    script = '{}; exit $s'.format(wrap_interactor(wrap_usage(command), interaction, (to_program, from_program)))
+    script = script.replace('/usr/bin/time', gnu_time(tmp_path))
+    process = subprocess.run(['/bin/bash', '-c', script], stdout=subprocess.PIPE, timeout=10)
+    time.sleep(1.5)
+
+    stdout, report = pop_interactor_report(process.stdout)
+    assert report['exit_code'] == 1 and checker.testlib_status(report['exit_code']) == WA
+    assert report['memory'] is not None
+    stdout, usage = parse_usage(stdout)
+    assert process.returncode == 0 and usage is not None and stdout == b''
+    # 选手程序留下的进程在读取结果之前已被杀死
+    assert not (tmp_path / 'late').exists()
+    assert not os.path.exists(prefix + '.interactor')
+
+
+def test_pop_interactor_report():
+    assert pop_interactor_report(b'out\n' + INTERACTOR_MARKER.encode() + b' 3\n') == \
+        (b'out\n', {'exit_code': 3, 'wall_time': None, 'cpu_time': None, 'memory': None})
+    assert pop_interactor_report(b'out\n')[1]['exit_code'] is None
+
+
+def test_output_capture_keeps_head_and_tail():
+    limit = 1000
+    capture = OutputCapture(limit)
+    noise = bytes(range(256)) * 100 + b'\n'
+    usage = USAGE_MARKER.encode() + b' 0.50 0.40 0.05 2048\n'
+    cgroup = CGROUP_CPU_MARKER.encode() + b' 1000000000 1450000000\n'
+    data = noise + usage + cgroup
+    # 统计行跨越写入的分块
+    for start in range(0, len(data), 777):
+        capture.write(data[start:start + 777])
+
+    value = capture.getvalue()
+    assert len(value) == limit + len(OutputCapture.TRUNCATED) + OutputCapture.TAIL_SIZE
+    assert value.startswith(data[:limit] + OutputCapture.TRUNCATED)
+    assert value.endswith(data[-OutputCapture.TAIL_SIZE:])
+
+    stdout, cpu_time = pop_cgroup_cpu(value)
+    assert cpu_time == 0.45
+    stdout, usage = parse_usage(stdout)
+    assert usage == {'wall_time': 0.5, 'cpu_time': pytest.approx(0.45), 'memory': 2048}
+
+
+def test_output_capture_within_limit():
+    capture = OutputCapture(100)
+    capture.write(b'a' * 60)
+    capture.write(b'b' * 60)
+    assert capture.getvalue() == b'a' * 60 + b'b' * 60
+    capture = OutputCapture(100)
+    capture.write(b'c' * 100)
+    assert capture.getvalue() == b'c' * 100
@@ -1,33 +1,53 @@
 # -*- coding: utf-8 -*-
+import io
 import os
+import math
+import atexit
+import time
 import uuid
+import shutil
+import struct
+import shlex
 import signal
-import docker
 import tarfile
-import checksumdir
+import threading
 
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
 from logzero import logger
 
 from config import DEFAULT_LIMITS, CPU_TO_REAL_TIME_FACTOR, DEFAULT_GENERATE_FILE_SIZE, TEMP_DIR, WORKING_DIR
+from config import USAGE_MARKER, TEST_DATA_DIR
+from config import CONTAINER_POOL_SIZE, CONTAINER_POOL_MAX_USES, CONTAINER_POOL_MAX_IDLE, CONTAINER_POOL_CHECK_INTERVAL
+from config import SUPERVISOR_PATH, JUDGE_CPUS, WORKSPACE_SIZE, OUTPUT_CAPTURE_LIMIT, NODE_ID
+from languages import LANG
 from exceptions import CrazyBoxError, DockerError
+from testdata import manifests
+from monitor import monitor
+from clients import docker_clients
+from metrics import metrics
 
-from docker.models.containers import Container
-from requests.packages import urllib3
+from docker.models.containers import Container, _create_container_args
+from docker.utils.socket import read_exactly, SocketError
 
 from docker.errors import APIError, DockerException, NotFound, ImageNotFound
-from requests.exceptions import RequestException, ReadTimeout
-from dateutil.parser import parse
+from requests.exceptions import RequestException
 
 
 # docker lower level functions
-try:
-    client = docker.from_env()
-    api_client = docker.APIClient()
-except Exception as e:
-    logger.exception(e)
-    raise CrazyBoxError(e)
+
+
+# /usr/bin/time writes a single line to the container's stdout after the program exits:
+# "<marker> <wall seconds> <user seconds> <sys seconds> <maximum resident KB>"
+USAGE_FORMAT = USAGE_MARKER + ' %e %U %S %M'
+
+# cpu time (user + sys, ns) of every process in the container's cgroup, including children the
+# program didn't wait for: cpuacct.usage on cgroup v1, usage_usec of cpu.stat on cgroup v2
+CGROUP_CPU = ("cat /sys/fs/cgroup/cpuacct/cpuacct.usage 2>/dev/null || "
+              "sed -n 's/^usage_usec \\([0-9]*\\)$/\\1000/p' /sys/fs/cgroup/cpu.stat 2>/dev/null")
+CGROUP_CPU_MARKER = 'crazybox-cgroup-cpu'
+INTERACTOR_MARKER = 'crazybox-interactor'
 
 
 def is_killed_by_sigkill_or_sigxcpu(status):
@@ -48,8 +68,9 @@ def merge_limits(limits=None):
 
 def generate_ulimits(limits):
     ulimits = []
-    cpu_time = int(limits['cpu_time'])
-    ulimits.append({'name': 'cpu', 'soft': cpu_time, 'hard': cpu_time})
+    # RLIMIT_CPU只有秒的精度，只用来兜底，是否超时由测得的cpu时间判断
+    cpu_time = math.ceil(limits['cpu_time'])
+    ulimits.append({'name': 'cpu', 'soft': cpu_time, 'hard': cpu_time + 1})
     if 'file_size' in limits:
         fsize = limits['file_size']
     else:
@@ -81,102 +102,1117 @@ def generate_volumes(volume_name, data_dir=None):
         return {volume_name: {'bind': WORKING_DIR, 'mode': 'rw'}}
 
 
-def inspect_container_state(container: Container):
+def wrap_usage(command, prefix=''):
+    # /usr/bin/time -f '...' -o /dev/stdout sh -c 'exec ./a < 2.in > 2.out'
+    # 用户程序的stdout已被重定向到文件，容器的stdout只剩下time的统计结果
+    # prefix: commands that exec their arguments (timeout, prlimit) placed between time and sh
+    return "/usr/bin/time -f '{}' -o /dev/stdout {}sh -c 'exec {}'".format(USAGE_FORMAT, prefix, command)
+
+
+def wrap_interactor(script, interactor, fifos):
+    """
+    Run the interactor in the background while the script runs, connected to it through the fifos
+    by the redirections of both commands; the exit status of the script is left in $s.
+
+    The interactor's /usr/bin/time usage and exit status come back through a pipe the script does not
+    inherit and are printed as the last stdout line, see ``pop_interactor_report``, only after the
+    process group of the script was killed: nothing the program writes or leaves running can change
+    them. The script must not start a process group of its own (timeout --foreground).
+    The fifos are opened inside the commands, so a program that never opens its end is still killed
+    at its time limit.
+    """
+    return ("mkfifo {fifos}; exec 3< <({{ /usr/bin/time -f '{fmt}' -o /dev/stdout {interactor}; echo $?; }}); "
+            "setsid {script} 3<&- & p=$!; wait $p; s=$?; kill -9 -- -$p 2>/dev/null; "
+            "r=$(cat <&3); exec 3<&-; rm -f {fifos}; echo {marker} $r").format(
+        fifos=' '.join(fifos), fmt=USAGE_FORMAT, interactor=interactor, script=script, marker=INTERACTOR_MARKER)
+
+
+def pop_interactor_report(stdout: bytes):
+    """
+    Split the line written by ``wrap_interactor`` off the container stdout.
+
+    :return: (stdout without the line,
+              {'exit_code', 'wall_time', 'cpu_time', 'memory'} of the interactor, None values if unknown)
+    """
+    report = {'exit_code': None, 'wall_time': None, 'cpu_time': None, 'memory': None}
+    lines = stdout.rstrip(b'\n').split(b'\n')
+    fields = lines[-1].split()
+    if not fields or fields[0] != INTERACTOR_MARKER.encode():
+        return stdout, report
+    rest = b'\n'.join(lines[:-1])
     try:
-        container_info = api_client.inspect_container(container)
-    except (RequestException, DockerException) as e:
-        raise DockerError(str(e))
-    started_at = parse(container_info['State']['StartedAt'])
-    finished_at = parse(container_info['State']['FinishedAt'])
-    duration = finished_at - started_at
-    duration_seconds = duration.total_seconds()
-    if duration_seconds < 0:
-        duration_seconds = -1
-    return {
-        'duration': duration_seconds,
-        'oom_killed': container_info['State'].get('OOMKilled', False),
+        report['exit_code'] = int(fields[-1])
+    except ValueError:
+        return rest + b'\n' if rest else b'', report
+    _, usage = parse_usage(b' '.join(fields[1:-1]))
+    if usage:
+        report.update(usage)
+    return rest + b'\n' if rest else b'', report
+
+
+def wrap_cgroup_cpu(script):
+    """
+    print the cgroup cpu time before and after the script as the last stdout line,
+    the exit status of the script is left in $s
+    """
+    return 'b=$({0}); {1}; s=$?; echo {2} $b $({0})'.format(CGROUP_CPU, script, CGROUP_CPU_MARKER)
+
+
+def pop_cgroup_cpu(stdout: bytes):
+    """
+    Split the line written by ``wrap_cgroup_cpu`` off the container stdout.
+
+    :return: (stdout without the line, cpu time in s or None if the cgroup is not readable)
+    """
+    lines = stdout.rstrip(b'\n').split(b'\n')
+    fields = lines[-1].decode(errors='replace').split()
+    if not fields or fields[0] != CGROUP_CPU_MARKER:
+        return stdout, None
+    rest = b'\n'.join(lines[:-1])
+    rest = rest + b'\n' if rest else b''
+    try:
+        before, after = (int(field) for field in fields[1:])
+    except ValueError:
+        return rest, None
+    return rest, (after - before) / 1e9
+
+
+def apply_time_limit(result, time_limit):
+    """
+    TLE is decided on the cpu time, the real time limit is only a hard cap on the wall time.
+
+    :param result: run result with cpu_time, an exceeded cpu time sets its timeout
+    """
+    if result['cpu_time'] is not None and not result['oom_killed'] and result['cpu_time'] > time_limit:
+        result['timeout'] = True
+    return result
+
+
+def parse_usage(stdout: bytes):
+    """
+    Split the usage line written by ``wrap_usage`` off the container stdout.
+
+    :return: (stdout without the usage line, {'wall_time': s, 'cpu_time': s, 'memory': KB} or None)
+    """
+    lines = stdout.rstrip(b'\n').split(b'\n')
+    fields = lines[-1].decode(errors='replace').split()
+    if len(fields) != 5 or fields[0] != USAGE_MARKER:
+        return stdout, None
+    try:
+        wall_time, user_time, sys_time, memory = float(fields[1]), float(fields[2]), float(fields[3]), int(fields[4])
+    except ValueError:
+        logger.warning('malformed usage line: %s', lines[-1])
+        return stdout, None
+    rest = b'\n'.join(lines[:-1])
+    return rest + b'\n' if rest else b'', {
+        'wall_time': wall_time,
+        'cpu_time': user_time + sys_time,
+        'memory': memory,
     }
 
 
-def get_container_output(container: Container):
+class OutputCapture(object):
+    """
+    Keep the first limit bytes of a stream written chunk by chunk and its last TAIL_SIZE bytes,
+    everything in between is dropped and marked, so the memory used is bounded by the limit.
+    """
+    TAIL_SIZE = 4096
+    TRUNCATED = b'\n... (truncated) ...\n'
+
+    def __init__(self, limit=OUTPUT_CAPTURE_LIMIT):
+        self.limit = limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        room = self.limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            del self.tail[:-self.TAIL_SIZE]
+
+    def getvalue(self):
+        if self.size > len(self.head) + len(self.tail):
+            return bytes(self.head) + self.TRUNCATED + bytes(self.tail)
+        return bytes(self.head + self.tail)
+
+
+def log_path(container_name, directory=WORKING_DIR):
+    """:return: prefix of the files in the working directory taking the container's stdout/stderr"""
+    return os.path.join(directory, '.{}-log'.format(container_name))
+
+
+def redirect_to_log(command, path):
+    """
+    :param path: prefix of the log files, see ``log_path``
+    :return: argv of command with its stdout/stderr appended to path.stdout/path.stderr
+    """
+    # 命令按docker的方式拆分为参数，不经过外层shell的展开。
+    # 以追加方式打开：/usr/bin/time -o /dev/stdout会以"w"重新打开同一个文件从头写入统计行，
+    # 之后bash写出的cgroup cpu行必须接在它后面，而不是从偏移0覆盖它
+    return ['/bin/bash', '-c', 'exec "$@" >> {0}.stdout 2>> {0}.stderr'.format(path), 'crazybox'] + \
+        shlex.split(command)
+
+
+def capture_file(path, limit=OUTPUT_CAPTURE_LIMIT):
+    """:return: content of the file capped by OutputCapture, the file is removed"""
+    capture = OutputCapture(limit)
     try:
-        stdout = container.logs(stdout=True, stderr=False)
-        stderr = container.logs(stdout=False, stderr=True)
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                capture.write(chunk)
+        os.remove(path)
+    except OSError:
+        pass
+    return capture.getvalue()
+
+
+def read_logs(container_id, limit=OUTPUT_CAPTURE_LIMIT):
+    """:return: (stdout, stderr) of the container from one demultiplexed logs call, capped by OutputCapture"""
+    api = docker_clients.api
+    stdout, stderr = OutputCapture(limit), OutputCapture(limit)
+    try:
+        response = api._get(api._url('/containers/{0}/logs', container_id),
+                            params={'stdout': 1, 'stderr': 1, 'follow': 0, 'timestamps': 0}, stream=True)
+        api._raise_for_status(response)
+        while True:
+            header = response.raw.read(8)
+            if len(header) < 8:
+                break
+            stream, size = struct.unpack('>BxxxL', header)
+            (stderr if stream == 2 else stdout).write(response.raw.read(size))
     except (RequestException, DockerException):
-        return b'', b''
-    return stdout, stderr
+        pass
+    return stdout.getvalue(), stderr.getvalue()
+
+
+def get_container_output(container: Container, limit=OUTPUT_CAPTURE_LIMIT, host_dir=None):
+    """
+    :param host_dir: host mountpoint of the working directory if the container was created with it,
+                     the output is then read from its log files without any docker API call
+    :return: (stdout, stderr) of the container, capped by OutputCapture
+    """
+    if host_dir:
+        path = log_path(container.name, host_dir)
+        return capture_file(path + '.stdout', limit), capture_file(path + '.stderr', limit)
+    return read_logs(container.id, limit)
 
 
 # docker container upper functions
+@metrics.timed('container_create')
 def create_container(container_name, command, volume_name,
-                     time_limit, memory_limit=512 * 1024 * 1024, file_size_limit=10 * 1024 * 1024, data_dir=None):
+                     time_limit, memory_limit=512 * 1024 * 1024, file_size_limit=10 * 1024 * 1024, data_dir=None,
+                     cpuset_cpus=None, host_dir=None):
+    """
+    Create a container running one compile or test case. Together with ``run_container`` and its
+    removal that is three docker API calls: create, start and remove.
+
+    :param host_dir: host mountpoint of the volume, the container's stdout/stderr are then written
+                     to files in the working directory instead of the docker logs
+    """
 
     real_time_limit, memory, ulimits = generate_args(time_limit, memory_limit, file_size_limit)
 
     # logger.debug("container limit: %sS %s", real_time_limit, memory.upper())
 
+    if host_dir:
+        command = redirect_to_log(command, log_path(container_name))
+
     volumes = generate_volumes(volume_name, data_dir)
+    api = docker_clients.api
     try:
-        crazybox = client.containers.create(image='crazybox:latest',
-                                            name=container_name,
-                                            command=command,
-                                            mem_limit=memory, memswap_limit=memory,
-                                            ulimits=ulimits,
-                                            working_dir=WORKING_DIR,
-                                            network_disabled=True,
-                                            volumes=volumes,
-                                            detach=True)
+        # 直接调用create_container，不像containers.create那样再inspect一次
+        response = api.create_container(**_create_container_args(dict(
+            image='crazybox:latest',
+            name=container_name,
+            command=command,
+            mem_limit=memory, memswap_limit=memory,
+            ulimits=ulimits,
+            working_dir=WORKING_DIR,
+            network_disabled=True,
+            volumes=volumes,
+            cpuset_cpus=cpuset_cpus,
+            detach=True,
+            version=api._version)))
     except ImageNotFound:
         logger.exception("No image found: [crazybox:latest]")
         raise CrazyBoxError("No image found: [crazybox:latest]")
+    except (RequestException, DockerException) as ex:
+        raise DockerError(str(ex))
+    crazybox = docker_clients.client.containers.prepare_model({'Id': response['Id'], 'Name': '/' + container_name})
 
     return crazybox, real_time_limit
 
 
-def run_container(container: Container, real_time):
-    container.start()
-    timeout = False
-    exit_code = None
+def run_container(container: Container, real_time, time_limit=None, host_dir=None, interactor=False):
+    """
+    :param real_time: wall time limit, s
+    :param time_limit: cpu time limit, s; the cpu time is taken from the container's cgroup when the
+                       command is wrapped by ``wrap_cgroup_cpu``, otherwise from /usr/bin/time
+    :param host_dir: the host_dir the container was created with
+    :param interactor: the command is wrapped by ``wrap_interactor``, the result then has 'interactor'
+    """
+    # 不再阻塞在container.wait上：退出和oom由docker事件得知，超过real_time立即杀死容器
     try:
-        exit_code = container.wait(timeout=real_time)
-    except ReadTimeout:
-        timeout = True
+        with metrics.timer('container_run'):
+            state = monitor.run(container.id, container.start, real_time)
     except (RequestException, DockerException) as ex:
-        if isinstance(ex, RequestException):
-            wrapped_exc = ex.args[0]
-            if isinstance(wrapped_exc, urllib3.exceptions.ReadTimeoutError):
-                timeout = True
-        if not timeout:
-            raise DockerError(str(ex))
+        raise DockerError(str(ex))
+    exit_code = state['exit_code']
 
     result = {
         'exit_code': exit_code,
         'stdout': b'',
         'stderr': b'',
         'duration': None,  # s
-        'timeout': timeout,
-        'oom_killed': False,
+        'wall_time': None,  # s
+        'cpu_time': None,  # s, user + sys
+        'memory': None,  # KB, peak resident set size
+        'timeout': state['timeout'],
+        'oom_killed': state['oom_killed'],
     }
+    if interactor:
+        result['interactor'] = pop_interactor_report(b'')[1]
     if exit_code is not None:
-        result['stdout'], result['stderr'] = get_container_output(container)
-        state = inspect_container_state(container.id)
-        result.update(state)
+        with metrics.timer('container_output'):
+            stdout, result['stderr'] = get_container_output(container, host_dir=host_dir)
+        if interactor:
+            stdout, result['interactor'] = pop_interactor_report(stdout)
+        stdout, cgroup_cpu = pop_cgroup_cpu(stdout)
+        result['stdout'], usage = parse_usage(stdout)
+        if usage:
+            result.update(usage)
+            result['duration'] = usage['wall_time']
+        if cgroup_cpu is not None:
+            result['cpu_time'] = cgroup_cpu
         if is_killed_by_sigkill_or_sigxcpu(exit_code) and not state['oom_killed']:
             # SIGKILL/SIGXCPU is sent but not by out of memory killer
             result['timeout'] = True
+        if time_limit is not None:
+            apply_time_limit(result, time_limit)
 
     return result
 
 
+# warm sandbox pool
+# 池中的容器长期运行一个空闲进程(sleep)，每次编译/运行通过docker exec执行，
+# 资源限制在exec内部用prlimit/timeout设置，内存限制通过container.update修改
+POOL_LABEL = 'crazybox.pool'
+POOL_OWNER_LABEL = 'crazybox.pool.owner'
+# a sandbox without a data_dir mounts its own directory here on /data/, see Sandbox.bind_data;
+# on the filesystem of the test data so that the files of a submission's problem are hard links
+POOL_DATA_DIR = os.path.join(TEST_DATA_DIR, '.pool')
+
+# bash script run by every exec; the program gets the highest oom score so that the
+# cgroup oom killer never picks the idle PID 1, and the oom_kill counter is reported after it.
+# command is wrapped by wrap_cgroup_cpu, which leaves its exit status in $s
+EXEC_SCRIPT = ("echo 1000 > /proc/self/oom_score_adj 2>/dev/null; {command}; "
+               "grep -s '^oom_kill ' /sys/fs/cgroup/memory/memory.oom_control; exit $s")
+
+RESET_SCRIPT = "kill -9 -1 2>/dev/null; rm -rf {0}* {0}.[!.]* /tmp/* /tmp/.[!.]* 2>/dev/null; true".format(WORKING_DIR)
+WIPE_SCRIPT = "rm -rf {0}* {0}.[!.]* 2>/dev/null; true".format(WORKING_DIR)
+WORKSPACE_LABEL = 'crazybox.workspace'
+
+
+def read_exec_output(sock, limit=OUTPUT_CAPTURE_LIMIT):
+    """
+    Read a multiplexed (non-tty) exec stream until EOF.
+
+    :return: (stdout, stderr), capped by OutputCapture
+    """
+    stdout, stderr = OutputCapture(limit), OutputCapture(limit)
+    while True:
+        try:
+            header = read_exactly(sock, 8)
+        except SocketError:
+            break
+        stream, size = struct.unpack('>BxxxL', header)
+        try:
+            data = read_exactly(sock, size) if size else b''
+        except SocketError:
+            break
+        (stderr if stream == 2 else stdout).write(data)
+    return stdout.getvalue(), stderr.getvalue()
+
+
+def pop_oom_kills(stdout: bytes):
+    lines = stdout.rstrip(b'\n').split(b'\n')
+    if lines[-1].startswith(b'oom_kill '):
+        rest = b'\n'.join(lines[:-1])
+        return (rest + b'\n' if rest else b''), int(lines[-1].split()[1])
+    return stdout, None
+
+
+class Sandbox(object):
+    """
+    A long-lived crazybox container serving compiles and runs through ``docker exec``.
+
+    The container mounts its own volume on WORKING_DIR and read-only on /data/ a directory
+    of its own under POOL_DATA_DIR, which holds the test data of the submission it serves
+    (``bind_data``) and nothing else, so it can serve any submission of its language family
+    without showing it the test data of the other problems.
+    A sandbox outside the pool may mount a given data_dir instead.
+    """
+
+    def __init__(self, family, data_dir=None, volume_name=None):
+        self.family = family
+        self.name = 'crazybox-pool-{}-{}'.format(family, str(uuid.uuid4())[:8])
+        self.own_data = data_dir is None
+        self.data_dir = data_dir or os.path.join(POOL_DATA_DIR, self.name)
+        # a given volume, e.g. the workspace of the worker, is shared and not removed with the sandbox
+        self.own_volume = volume_name is None
+        self.volume_name = volume_name or self.name
+        self.uses = 0
+        self.created_at = self.last_used = time.time()
+        self.memory = None
+        self.oom_kills = 0
+        self.cpus = None
+        # number of test cases running at the same time, they share the memory cgroup of the container
+        self.concurrency = 1
+
+        try:
+            if self.own_data:
+                os.makedirs(self.data_dir)
+            if self.own_volume:
+                create_volume(self.volume_name)
+            self.container = docker_clients.client.containers.create(
+                image='crazybox:latest',
+                name=self.name,
+                command='/bin/sleep infinity',
+                labels={POOL_LABEL: family, POOL_OWNER_LABEL: str(os.getpid())},
+                working_dir=WORKING_DIR,
+                network_disabled=True,
+                read_only=True,
+                tmpfs={'/tmp': 'rw,exec,size=64m'},
+                volumes={self.volume_name: {'bind': WORKING_DIR, 'mode': 'rw'},
+                         self.data_dir: {'bind': '/data/', 'mode': 'ro'}},
+                detach=True)
+            self.container.start()
+        except ImageNotFound:
+            logger.exception("No image found: [crazybox:latest]")
+            self.destroy()
+            raise CrazyBoxError("No image found: [crazybox:latest]")
+        except (RequestException, DockerException) as ex:
+            self.destroy()
+            raise DockerError(str(ex))
+        except OSError as ex:
+            self.destroy()
+            raise CrazyBoxError('failed to create the data directory of %s: %s' % (self.name, ex))
+
+    @staticmethod
+    def data_path(test_data_dir, data_dir=TEST_DATA_DIR):
+        """
+        :return: path of test_data_dir inside a sandbox mounting data_dir, None if it is not under data_dir
+        """
+        rel = os.path.relpath(os.path.realpath(test_data_dir), os.path.realpath(data_dir))
+        if rel == os.curdir:
+            return '/data/'
+        if rel.startswith(os.pardir):
+            return None
+        return os.path.join('/data/', rel)
+
+    def bind_data(self, test_data_dir):
+        """
+        replace the content of the sandbox's /data/ with hard links of the files of test_data_dir,
+        copies where they cannot be linked; /data/ is read-only in the container.
+
+        :return: path of test_data_dir inside the sandbox
+        """
+        self.unbind_data()
+        name = os.path.basename(os.path.realpath(test_data_dir))
+        shutil.copytree(test_data_dir, os.path.join(self.data_dir, name), copy_function=link_or_copy)
+        return os.path.join('/data/', name, '')
+
+    def unbind_data(self):
+        """remove the test data bound by ``bind_data``"""
+        if not self.own_data:
+            return
+        for name in os.listdir(self.data_dir):
+            shutil.rmtree(os.path.join(self.data_dir, name), ignore_errors=True)
+
+    def set_memory(self, memory_limit):
+        """:param memory_limit: MB for one program, multiplied by the concurrency"""
+        memory = str(int(memory_limit * self.concurrency)) + 'm'
+        if memory != self.memory:
+            self.container.update(mem_limit=memory, memswap_limit=memory)
+            self.memory = memory
+
+    def set_cpus(self, cpus=None):
+        """:param cpus: cpuset string like '2,3', None for all judge CPUs"""
+        cpus = cpus or cpu_set.all
+        if cpus != self.cpus:
+            self.container.update(cpuset_cpus=cpus)
+            self.cpus = cpus
+
+    def put_archive(self, path, data):
+        return self.container.put_archive(path, data)
+
+    def get_archive(self, path):
+        return self.container.get_archive(path)
+
+    def execute(self, command, time_limit, memory_limit, file_size_limit=10 * 1024 * 1024, cpu=None,
+                interactor=None):
+        """
+        Run command inside the sandbox under the given limits.
+
+        :param time_limit: cpu time limit, s
+        :param memory_limit: MB
+        :param file_size_limit: Byte
+        :param cpu: pin the program to this CPU
+        :param interactor: (command, fifos) of the interactor run next to the program, see
+                           ``wrap_interactor``; the usage is then only the program's and the result
+                           has 'interactor', see ``pop_interactor_report``
+        :return: same dict as run_container
+        """
+        real_time_limit, _, _ = generate_args(time_limit, memory_limit, file_size_limit)
+        # 交互题的选手程序由wrap_interactor放入自己的进程组，timeout不能再另建进程组
+        prefix = 'timeout {}-s KILL {} prlimit --cpu={}:{} --fsize={} -- '.format(
+            '--foreground ' if interactor else '', real_time_limit, math.ceil(time_limit), math.ceil(time_limit) + 1,
+            file_size_limit)
+        if cpu is not None:
+            prefix = 'taskset -c {} '.format(cpu) + prefix
+        if interactor:
+            # 容器cgroup的cpu时间包括交互器，只使用选手程序自己的rusage
+            script = EXEC_SCRIPT.format(command=wrap_interactor(wrap_usage(command, prefix), *interactor))
+        else:
+            script = EXEC_SCRIPT.format(command=wrap_cgroup_cpu(wrap_usage(command, prefix)))
+
+        try:
+            self.set_memory(memory_limit)
+            exec_id = docker_clients.api.exec_create(self.container.id, ['/bin/bash', '-c', script])['Id']
+            sock = docker_clients.api.exec_start(exec_id, socket=True)
+            getattr(sock, '_sock', sock).settimeout(real_time_limit + 10)
+            stdout, stderr = read_exec_output(sock)
+            exit_code = docker_clients.api.exec_inspect(exec_id)['ExitCode']
+        except (RequestException, DockerException, OSError) as ex:
+            raise DockerError(str(ex))
+
+        stdout, oom_kills = pop_oom_kills(stdout)
+        report = None
+        if interactor:
+            stdout, report = pop_interactor_report(stdout)
+        stdout, cgroup_cpu = pop_cgroup_cpu(stdout)
+        stdout, usage = parse_usage(stdout)
+
+        result = {
+            'exit_code': exit_code,
+            'stdout': stdout,
+            'stderr': stderr,
+            'duration': None,  # s
+            'wall_time': None,  # s
+            'cpu_time': None,  # s, user + sys
+            'memory': None,  # KB, peak resident set size
+            'timeout': False,
+            'oom_killed': False,
+        }
+        if report:
+            result['interactor'] = report
+        if usage:
+            result.update(usage)
+            result['duration'] = usage['wall_time']
+        if cgroup_cpu is not None and self.concurrency == 1:
+            # the cgroup is shared by test cases running at the same time, then only rusage is per program
+            result['cpu_time'] = cgroup_cpu
+
+        killed = exit_code - 128 == signal.SIGKILL
+        if oom_kills is not None:
+            # the counter is shared by concurrent runs, only a killed program can be its cause
+            result['oom_killed'] = killed and oom_kills > self.oom_kills
+            self.oom_kills = max(self.oom_kills, oom_kills)
+        elif usage and killed:
+            # kernel without oom_kill counter: killed before the wall limit with the memory near the limit
+            result['oom_killed'] = usage['wall_time'] < real_time_limit and \
+                usage['memory'] >= memory_limit * 1024 * 0.9
+
+        if is_killed_by_sigkill_or_sigxcpu(exit_code) and not result['oom_killed']:
+            result['timeout'] = True
+
+        return apply_time_limit(result, time_limit)
+
+    def reset(self):
+        """kill leftover processes and wipe the working directory and /tmp"""
+        self.container.exec_run(['/bin/bash', '-c', RESET_SCRIPT])
+
+    def pause(self):
+        self.container.pause()
+
+    def unpause(self):
+        self.container.unpause()
+
+    def healthy(self, status='paused'):
+        try:
+            self.container.reload()
+        except (RequestException, DockerException):
+            return False
+        return self.container.status == status
+
+    def destroy(self):
+        container = getattr(self, 'container', None)
+        try:
+            if container is not None:
+                container.remove(force=True)
+            if self.own_volume:
+                forget_mountpoint(self.volume_name)
+                docker_clients.client.volumes.get(self.volume_name).remove(force=True)
+        except NotFound:
+            pass
+        except (RequestException, DockerException):
+            logger.exception("Failed to destroy sandbox: %s", self.name)
+        if self.own_data:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+def link_or_copy(src, dst):
+    """copy_function of shutil.copytree: a hard link, a copy across filesystems or where linking is denied"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def send_to_socket(sock, data: bytes):
+    if hasattr(sock, 'sendall'):
+        sock.sendall(data)
+    else:
+        sock._sock.sendall(data)
+
+
+class Supervisor(object):
+    """
+    A crazybox-supervisor process (docker/supervisor.c) serving all test cases of one submission.
+
+    It is started once with an exec attached to stdin/stdout; every test case is then a single
+    request line written to its stdin and one result line read back, without any docker API call.
+    """
+
+    def __init__(self, sandbox: Sandbox):
+        self.sandbox = sandbox
+        try:
+            self.exec_id = docker_clients.api.exec_create(sandbox.container.id, [SUPERVISOR_PATH],
+                                                          stdin=True, stdout=True, stderr=False)['Id']
+            self.sock = docker_clients.api.exec_start(self.exec_id, socket=True)
+        except (RequestException, DockerException) as ex:
+            raise DockerError(str(ex))
+        self.buffer = b''
+
+    def read_line(self):
+        while b'\n' not in self.buffer:
+            try:
+                size = struct.unpack('>BxxxL', read_exactly(self.sock, 8))[1]
+                self.buffer += read_exactly(self.sock, size)
+            except (SocketError, OSError) as ex:
+                raise DockerError('supervisor exited: %s' % ex)
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.decode()
+
+    def read_stderr(self, path):
+        return read_head(self.sandbox, path)
+
+    def run(self, command, stdin_path, stdout_path, stderr_path,
+            time_limit, memory_limit, file_size_limit=10 * 1024 * 1024, cpu=None):
+        """
+        :param time_limit: cpu time limit, s
+        :param memory_limit: MB, applied as the memory limit of the sandbox
+        :param file_size_limit: Byte
+        :param cpu: pin the program to this CPU
+        :return: same dict as run_container
+        """
+        real_time_limit, _, _ = generate_args(time_limit, memory_limit, file_size_limit)
+        fields = [int(time_limit * 1000), int(real_time_limit * 1000), int(memory_limit * 1024 * 1024),
+                  int(file_size_limit), -1 if cpu is None else cpu, stdin_path, stdout_path, stderr_path, command]
+        request = '\t'.join(str(field) for field in fields)
+        if '\n' in request or request.count('\t') != len(fields) - 1:
+            raise CrazyBoxError('illegal character in supervisor request: %s' % request)
+
+        try:
+            self.sandbox.set_memory(memory_limit)
+            getattr(self.sock, '_sock', self.sock).settimeout(real_time_limit + 10)
+            send_to_socket(self.sock, request.encode() + b'\n')
+        except (RequestException, DockerException, OSError) as ex:
+            raise DockerError(str(ex))
+        exit_code, wall_ms, cpu_ms, memory_kb, timeout, oom_killed = (int(x) for x in self.read_line().split('\t'))
+        if exit_code < 0:
+            raise DockerError('supervisor failed to start: %s' % command)
+
+        return apply_time_limit({
+            'exit_code': exit_code,
+            'stdout': b'',
+            'stderr': self.read_stderr(stderr_path) if exit_code != 0 else b'',
+            'duration': wall_ms / 1000,  # s
+            'wall_time': wall_ms / 1000,  # s
+            'cpu_time': cpu_ms / 1000,  # s, user + sys
+            'memory': memory_kb,  # KB, peak resident set size
+            'timeout': bool(timeout),
+            'oom_killed': bool(oom_killed),
+        }, time_limit)
+
+    def close(self):
+        try:
+            send_to_socket(self.sock, b'\n')
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ContainerPool(object):
+    """
+    Keep ``sizes[family]`` sandboxes per language family started, reset and paused.
+
+    A sandbox is handed out by ``sandbox()`` and recycled asynchronously when it is
+    released: reset and paused again, or destroyed after ``max_uses`` submissions or a
+    failed health check. Sandboxes created on demand beyond the configured size are
+    evicted after ``max_idle`` seconds idle.
+    """
+
+    def __init__(self, sizes, max_uses=CONTAINER_POOL_MAX_USES,
+                 max_idle=CONTAINER_POOL_MAX_IDLE, check_interval=CONTAINER_POOL_CHECK_INTERVAL):
+        self.sizes = sizes
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.check_interval = check_interval
+        self.idle = {family: [] for family in sizes}
+        self.busy = {family: 0 for family in sizes}
+        self.lock = threading.Lock()
+        self.recycler = ThreadPoolExecutor(max_workers=2)
+        self.started = False
+        self.stopped = threading.Event()
+
+    def enabled(self, family):
+        return self.sizes.get(family, 0) > 0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.remove_orphans()
+        for family in self.sizes:
+            self.fill(family)
+        threading.Thread(target=self.maintain, name='crazybox-pool', daemon=True).start()
+
+    @staticmethod
+    def remove_orphans():
+        """remove pool containers left by judge processes that no longer exist"""
+        try:
+            containers = docker_clients.client.containers.list(all=True, filters={'label': POOL_LABEL})
+        except (RequestException, DockerException):
+            logger.exception("Failed to list pooled containers")
+            return
+        for container in containers:
+            owner = int(container.labels.get(POOL_OWNER_LABEL, 0))
+            try:
+                os.kill(owner, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except (PermissionError, OverflowError):
+                continue
+            logger.info("Removing orphan sandbox: %s", container.name)
+            try:
+                container.remove(force=True)
+                docker_clients.client.volumes.get(container.name).remove(force=True)
+            except (RequestException, DockerException):
+                logger.exception("Failed to remove orphan sandbox: %s", container.name)
+            shutil.rmtree(os.path.join(POOL_DATA_DIR, container.name), ignore_errors=True)
+
+    def create(self, family):
+        box = Sandbox(family)
+        logger.info("New sandbox is created: %s", box.name)
+        return box
+
+    def fill(self, family):
+        while True:
+            with self.lock:
+                if len(self.idle[family]) + self.busy[family] >= self.sizes[family]:
+                    return
+                self.busy[family] += 1
+            try:
+                box = self.create(family)
+                box.pause()
+            except (CrazyBoxError, DockerError, RequestException, DockerException):
+                logger.exception("Failed to warm up a sandbox for %s", family)
+                with self.lock:
+                    self.busy[family] -= 1
+                return
+            with self.lock:
+                self.busy[family] -= 1
+                self.idle[family].append(box)
+
+    def acquire(self, family):
+        while True:
+            with self.lock:
+                box = self.idle[family].pop() if self.idle[family] else None
+                self.busy[family] += 1
+            if box is None:
+                try:
+                    return self.create(family)
+                except Exception:
+                    with self.lock:
+                        self.busy[family] -= 1
+                    raise
+            try:
+                box.unpause()
+                return box
+            except (RequestException, DockerException):
+                logger.warning("Evicting broken sandbox: %s", box.name)
+                with self.lock:
+                    self.busy[family] -= 1
+                self.recycler.submit(box.destroy)
+
+    def release(self, box):
+        box.concurrency = 1
+        box.uses += 1
+        box.last_used = time.time()
+        self.recycler.submit(self.recycle, box)
+
+    def recycle(self, box):
+        family = box.family
+        try:
+            if box.uses >= self.max_uses or not box.healthy('running'):
+                raise DockerError('sandbox retired')
+            box.reset()
+            box.unbind_data()
+            box.set_cpus(None)
+            box.pause()
+        except (DockerError, RequestException, DockerException, OSError):
+            logger.info("Retiring sandbox: %s", box.name)
+            box.destroy()
+            with self.lock:
+                self.busy[family] -= 1
+            self.fill(family)
+            return
+        with self.lock:
+            self.busy[family] -= 1
+            self.idle[family].append(box)
+
+    def maintain(self):
+        while not self.stopped.wait(self.check_interval):
+            for family in self.sizes:
+                with self.lock:
+                    boxes, self.idle[family] = self.idle[family], []
+                keep = []
+                for box in boxes:
+                    surplus = len(keep) + self.busy[family] >= self.sizes[family]
+                    if not box.healthy('paused'):
+                        logger.warning("Evicting unhealthy sandbox: %s", box.name)
+                        box.destroy()
+                    elif surplus and time.time() - box.last_used > self.max_idle:
+                        logger.info("Evicting idle sandbox: %s", box.name)
+                        box.destroy()
+                    else:
+                        keep.append(box)
+                with self.lock:
+                    self.idle[family].extend(keep)
+                self.fill(family)
+
+    @staticmethod
+    @contextmanager
+    def one_off(family, data_dir):
+        """a sandbox outside the pool for a single submission on the workspace of the worker, destroyed afterwards"""
+        with workspace.use() as volume_name:
+            box = Sandbox(family, data_dir, volume_name)
+            try:
+                yield box
+            finally:
+                box.destroy()
+
+    @contextmanager
+    def sandbox(self, family):
+        if not self.started:
+            self.start()
+        box = self.acquire(family)
+        try:
+            yield box
+        finally:
+            self.release(box)
+
+    def shutdown(self):
+        self.stopped.set()
+        self.recycler.shutdown(wait=True)
+        with self.lock:
+            boxes = [box for family in self.idle for box in self.idle[family]]
+            for family in self.idle:
+                self.idle[family] = []
+        for box in boxes:
+            box.destroy()
+
+
+class CpuSet(object):
+    """
+    CPUs reserved for running test cases, handed out to parallel test cases of a
+    submission so that no two programs share a core while being timed.
+    """
+
+    def __init__(self, cpus=None):
+        self.lock = threading.Lock()
+        self.assign(cpus)
+
+    def assign(self, cpus=None):
+        """use only these CPUs from now on, e.g. the share of one judge worker process"""
+        if cpus is None:
+            cpus = range(os.cpu_count())
+        with self.lock:
+            self.cpus = list(cpus)
+            self.all = ','.join(str(cpu) for cpu in self.cpus)
+            self.free = list(self.cpus)
+
+    @contextmanager
+    def reserve(self, count):
+        """yield up to count free CPUs (maybe none), given back afterwards"""
+        with self.lock:
+            cpus, self.free = self.free[:count], self.free[count:]
+        try:
+            yield cpus
+        finally:
+            with self.lock:
+                self.free.extend(cpus)
+
+
+cpu_set = CpuSet(JUDGE_CPUS)
+
+
+pool = ContainerPool(CONTAINER_POOL_SIZE)
+
+
+class CompileServer(object):
+    """
+    A warm compiler daemon, e.g. the javac server, in a sandbox of its own compiling for one language.
+
+    The daemon is started with docker exec on first use in every judge process and restarted when
+    it exits; the client in the compile command talks to it and falls back to the plain compiler
+    while it is not up. The sandbox is not from the pool: a pooled sandbox is reset with kill -9 -1
+    after every submission and its memory cgroup is shared with the test cases.
+    The compiled artifacts are copied into the sandbox or container of the submission.
+    """
+
+    def __init__(self, family, command, memory):
+        """
+        :param command: command line of the daemon
+        :param memory: memory limit of the sandbox, the daemon and one compile, Byte
+        """
+        self.family = family
+        self.command = command
+        self.memory = memory / 1024 / 1024
+        self.lock = threading.Lock()
+        self.pid = None
+        self.box = None
+
+    def ensure(self):
+        if self.pid != os.getpid():
+            # 父进程的编译沙箱属于父进程
+            self.pid = os.getpid()
+            self.box = None
+        if self.box is not None:
+            return self.box
+        box = Sandbox(self.family)
+        try:
+            box.set_memory(self.memory)
+            box.container.exec_run(['/bin/sh', '-c', 'while true; do {}; sleep 1; done'.format(self.command)],
+                                   detach=True)
+        except (RequestException, DockerException) as ex:
+            box.destroy()
+            raise DockerError(str(ex))
+        logger.info("Compile server is started: %s", box.name)
+        atexit.register(box.destroy)
+        self.box = box
+        return box
+
+    def stop(self):
+        box, self.box = self.box, None
+        if box is not None:
+            box.destroy()
+
+    def compile(self, name, command, code_archive, time_limit, artifacts, target):
+        """
+        Compile a submission on the server and copy its artifacts into target.
+
+        :param name: file name of the submission, its files are removed from the server afterwards
+        :param artifacts: absolute paths of the artifacts
+        :param target: the sandbox or container the submission runs in
+        :return: same dict as Sandbox.execute, None when another compile of this process holds the
+                 server or the server failed, then compile in target
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            box = self.ensure()
+            box.put_archive(WORKING_DIR, code_archive)
+            try:
+                ret = box.execute(command, time_limit, self.memory)
+                if ret['exit_code'] == 0:
+                    for path in artifacts:
+                        stream, _ = box.get_archive(path)
+                        target.put_archive(os.path.dirname(path.rstrip('/')), stream.read())
+            finally:
+                box.container.exec_run(['/bin/sh', '-c', 'rm -rf {}{}*'.format(WORKING_DIR, name)])
+            if ret['timeout']:
+                # 超时的编译可能仍在守护进程中运行
+                self.stop()
+            return ret
+        except (DockerError, RequestException, DockerException) as ex:
+            logger.warning("Compile server failed, compiling in the sandbox: %s", ex)
+            self.stop()
+            return None
+        finally:
+            self.lock.release()
+
+
+compile_servers = {name: CompileServer(language['family'], **language['compile_server'])
+                   for name, language in LANG.items() if 'compile_server' in language}
+
+
+def create_volume(name, tmpfs=True, labels=None):
+    """
+    create a docker volume for a working directory.
+
+    :param tmpfs: back the volume with tmpfs limited to WORKSPACE_SIZE if it is set, its content
+                  is lost once no container mounts it
+    """
+    if tmpfs and WORKSPACE_SIZE:
+        return docker_clients.client.volumes.create(name=name, driver='local', labels=labels,
+                                                    driver_opts={'type': 'tmpfs', 'device': 'tmpfs',
+                                                                 'o': 'size=%s' % WORKSPACE_SIZE})
+    return docker_clients.client.volumes.create(name=name, labels=labels)
+
+
+class Workspace(object):
+    """
+    The persistent scratch working directory of a judge worker.
+
+    The docker volume is created the first time it is used and kept for the life of the worker,
+    a small holder container keeps it mounted (a tmpfs volume is unmounted with its last
+    container) and wipes it when the host cannot reach the mountpoint. Between submissions the
+    volume is only wiped, so no volume is created or removed on the hot path.
+    """
+
+    def __init__(self):
+        self.name = None
+        self.lock = threading.Lock()
+        self.holder = None
+        self.mountpoint = None
+        self.dirty = True
+
+    def assign(self, index):
+        """name the workspace after the judge worker, a restarted worker takes its workspace over"""
+        self.name = 'crazybox-workspace-%s%s' % (NODE_ID + '-' if NODE_ID else '', index)
+
+    def ensure(self):
+        if self.holder is not None:
+            try:
+                self.holder.reload()
+                if self.holder.status == 'running':
+                    return
+            except (RequestException, DockerException):
+                pass
+        if self.name is None:
+            self.name = 'crazybox-workspace-pid%d' % os.getpid()
+            atexit.register(self.destroy)
+        labels = {WORKSPACE_LABEL: self.name}
+        try:
+            try:
+                docker_clients.client.volumes.get(self.name)
+            except NotFound:
+                create_volume(self.name, labels=labels)
+            try:
+                holder = docker_clients.client.containers.get(self.name)
+            except NotFound:
+                holder = docker_clients.client.containers.create(
+                    image='crazybox:latest',
+                    name=self.name,
+                    command='/bin/sleep infinity',
+                    labels=labels,
+                    network_disabled=True,
+                    read_only=True,
+                    mem_limit='16m',
+                    volumes={self.name: {'bind': WORKING_DIR, 'mode': 'rw'}},
+                    detach=True)
+            if holder.status != 'running':
+                holder.start()
+        except ImageNotFound:
+            logger.exception("No image found: [crazybox:latest]")
+            raise CrazyBoxError("No image found: [crazybox:latest]")
+        except (RequestException, DockerException) as ex:
+            raise DockerError(str(ex))
+        logger.info("Workspace is ready: %s", self.name)
+        self.holder = holder
+        self.mountpoint = volume_mountpoint(self.name)
+        self.dirty = True
+
+    def wipe(self):
+        if self.mountpoint:
+            for name in os.listdir(self.mountpoint):
+                path = os.path.join(self.mountpoint, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        else:
+            self.holder.exec_run(['/bin/sh', '-c', WIPE_SCRIPT])
+        self.dirty = False
+
+    @contextmanager
+    def use(self):
+        """yield the volume name for one submission, None if another submission of this process holds it"""
+        if not self.lock.acquire(blocking=False):
+            yield None
+            return
+        try:
+            with metrics.timer('workspace'):
+                self.ensure()
+                if self.dirty:
+                    self.wipe()
+            self.dirty = True
+            yield self.name
+        finally:
+            try:
+                if self.holder is not None:
+                    self.wipe()
+            except (OSError, RequestException, DockerException):
+                logger.exception("Failed to wipe the workspace: %s", self.name)
+            finally:
+                self.lock.release()
+
+    def destroy(self):
+        try:
+            if self.holder is not None:
+                self.holder.remove(force=True)
+            forget_mountpoint(self.name)
+            docker_clients.client.volumes.get(self.name).remove(force=True)
+        except NotFound:
+            pass
+        except (RequestException, DockerException):
+            logger.exception("Failed to remove the workspace: %s", self.name)
+        self.holder = None
+
+
+workspace = Workspace()
+
+
 # other functions
 @contextmanager
 def working_volume():
+    """
+    yield the docker volume of the working directory for one submission:
+    the workspace of this worker, a temporary volume if another submission of this process holds it
+    """
+    with workspace.use() as volume_name:
+        if volume_name:
+            yield volume_name
+            return
+
     volume_name = 'crazybox-' + str(uuid.uuid4())
     logger.info("Creating new docker volume for working directory")
     try:
         try:
-            client.volumes.create(name=volume_name)
-        except APIError:
+            # 每个容器只运行一步，tmpfs卷会在容器之间被卸载，所以使用普通卷
+            with metrics.timer('volume'):
+                create_volume(volume_name, tmpfs=False)
+        except APIError as e:
             logger.exception("Failed to create a docker volume")
             raise DockerError(str(e))
 
@@ -187,86 +1223,149 @@ def working_volume():
     finally:
 
         logger.info("Removing the docker volume: %s", volume_name)
+        forget_mountpoint(volume_name)
         try:
-            client.volumes.get(volume_name).remove(force=True)
+            with metrics.timer('cleanup'):
+                docker_clients.client.volumes.get(volume_name).remove(force=True)
         except NotFound:
             logger.warning("Failed to remove the docker volume, it doesn't exist")
         except APIError:
-            logger.exception("Failed to remove the docker volume, try prune unused container first: ")
-            ret = client.containers.prune()
-            logger.info("SpaceReclaimed: %s, ContainersDeleted: %s", ret['SpaceReclaimed'], ret['ContainersDeleted'])
-            ret = client.volumes.prune()
-            logger.info("SpaceReclaimed: %s, VolumesDeleted: %s", ret['SpaceReclaimed'], ret['VolumesDeleted'])
+            logger.exception("Failed to remove the docker volume: %s", volume_name)
         else:
             logger.info("Docker volume removed")
 
 
-@contextmanager
 def compress_code(src_code, file_name_suffix, name=None):
+    """
+    Build the tar archive of the source code in memory.
+
+    :param src_code: str or bytes, bytes are used as they are so any encoding survives
+    :return: (name, tar data)
+    """
     if not name:
         name = str(uuid.uuid4())
-    file_path = os.path.join(TEMP_DIR, name + file_name_suffix)
-    tar_file_path = os.path.join(TEMP_DIR, name + '.tar')
+    if not isinstance(src_code, bytes):
+        src_code = src_code.encode('utf-8', 'surrogateescape')
+
+    info = tarfile.TarInfo(name + file_name_suffix)
+    info.size = len(src_code)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as file:
+        file.addfile(info, io.BytesIO(src_code))
+    return name, data.getvalue()
 
+
+def add_to_archive(archive: bytes, name, data: bytes, mode=0o644):
+    """:return: the tar archive with a file of the data appended"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = mode
+    out = io.BytesIO(archive)
+    with tarfile.open(fileobj=out, mode='a') as file:
+        file.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+_mountpoints = {}
+
+
+def volume_mountpoint(volume_name):
+    """:return: host directory of the docker volume if this process can read it, otherwise None"""
+    # 同名卷的挂载点不变，长期使用的工作区卷只查询一次
+    if volume_name in _mountpoints:
+        return _mountpoints[volume_name]
     try:
-        with open(file_path, 'w') as file:
-            file.write(src_code)
-        with tarfile.open(tar_file_path, 'w') as file:
-            file.add(file_path, arcname=name + file_name_suffix)
-        logger.info("New temporary file is created: %s", name)
+        mountpoint = docker_clients.client.volumes.get(volume_name).attrs['Mountpoint']
+    except (RequestException, DockerException, KeyError):
+        return None
+    if not (mountpoint and os.access(mountpoint, os.R_OK | os.X_OK)):
+        mountpoint = None
+    _mountpoints[volume_name] = mountpoint
+    return mountpoint
 
-        yield name
 
-    finally:
-        try:
-            os.remove(file_path)
-            os.remove(tar_file_path)
-        except Exception as ex:
-            logger.exception("Failed to remove the temporary file: %s", str(ex))
-        else:
-            logger.info("temporary file removed")
+def forget_mountpoint(volume_name):
+    """drop the cached mountpoint of a volume that is removed, a later volume may reuse the name"""
+    _mountpoints.pop(volume_name, None)
 
 
 @contextmanager
-def extract_tar(tar_path):
-    out_file_path = None
+def output_file(container, path, host_dir=None):
+    """
+    yield a host path of the file at path inside the container, None if it doesn't exist.
+
+    With the host mountpoint of the working directory the file is used in place. Otherwise its
+    archive is streamed from docker into a temporary file chunk by chunk, removed afterwards.
+    """
+    if host_dir:
+        host_path = os.path.join(host_dir, os.path.relpath(path, WORKING_DIR))
+        yield host_path if os.path.isfile(host_path) else None
+        return
+
+    out_file_path = os.path.join(TEMP_DIR, str(uuid.uuid4()) + '.out')
     try:
-        if os.path.exists(tar_path):
-            tar = tarfile.open(tar_path)
-            file_name = tar.getnames()[0]
-            tar.extract(file_name, TEMP_DIR)
-            out_file_path = os.path.join(TEMP_DIR, file_name)
+        try:
+            with metrics.timer('archive'):
+                stream, _ = container.get_archive(path)
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    member = tar.next()
+                    with open(out_file_path, 'wb') as file:
+                        shutil.copyfileobj(tar.extractfile(member), file, 1024 * 1024)
+        except (APIError, tarfile.TarError, AttributeError):
+            out_file_path = None
 
         yield out_file_path
 
     finally:
-        if os.path.exists(tar_path):
-            os.remove(tar_path)
-        if os.path.exists(out_file_path):
+        if out_file_path and os.path.exists(out_file_path):
             os.remove(out_file_path)
 
 
-def replace_arg(command, src_path, exe_path, max_memory=None):
-    try:
-        command = command.format(src_path=src_path, exe_path=exe_path)
-    except Exception as ex:
-        logger.debug("replace command[%s] with src path[%s]: %s", command, src_path, ex)
+def read_head(container, path, limit=OUTPUT_CAPTURE_LIMIT, host_dir=None):
+    """:return: at most the first limit bytes of the file at path inside the container, b'' if it can't be read"""
+    if host_dir:
+        try:
+            with open(os.path.join(host_dir, os.path.relpath(path, WORKING_DIR)), 'rb') as file:
+                return file.read(limit)
+        except OSError:
+            pass
     try:
-        command = command.format(src_path=src_path)
-    except Exception as ex:
-        logger.debug("replace command[%s] with exe path[%s]: %s", command, src_path, ex)
+        stream, _ = container.get_archive(path)
+        with tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                return tar.extractfile(member).read(limit)
+    except (RequestException, DockerException, tarfile.TarError, AttributeError):
+        logger.warning('Failed to read the file in the container: %s', path)
+    return b''
 
-    if max_memory:
-        try:
-            command = command.format(max_memory=max_memory)
-        except Exception as ex:
-            logger.debug("replace command[%s] with max memory[%s]: %s", command, src_path, ex)
 
-    return command
+class _KeepField(dict):
+    """format_map arguments leaving the fields without a value as they are"""
+
+    def __missing__(self, key):
+        return '{' + key + '}'
+
+
+def replace_arg(command, src_path, exe_path, max_memory=None):
+    """
+    fill {src_path}, {exe_path} and {max_memory} of a command, the fields without a value stay
+
+    :param max_memory: e.g. '256M'
+    """
+    # 逐个字段替换，缺少一个字段(如未给出max_memory)时不影响其余字段
+    arguments = _KeepField(src_path=src_path, exe_path=exe_path)
+    if max_memory:
+        arguments['max_memory'] = max_memory
+    try:
+        return command.format_map(arguments)
+    except (ValueError, IndexError) as ex:
+        logger.warning("replace command[%s] with src path[%s]: %s", command, src_path, ex)
+        return command
 
 
 def get_dir_hash(directory):
-    if os.path.exists(directory):
-        return checksumdir.dirhash(directory, 'sha256')
-    else:
-        return -1
+    # 由manifest计算，只重新计算变化过的文件
+    return manifests.dir_hash(directory)